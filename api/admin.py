@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Address, Company, Comment, PhoneNumber, Contacts, TaskQueue
+from django.db import transaction
+from django.utils import timezone
+from .models import Address, Company, Comment, PhoneNumber, Contacts, NegativeResult, TaskQueue
+from .tasks import process_task_queue
+from .utils import stage_summary
 
 
 @admin.register(Address)
@@ -12,14 +16,14 @@ class AddressAdmin(admin.ModelAdmin):
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
-    list_display = ['name', 'url', 'slug', 'is_processed', 'score', 'created_at']
+    list_display = ['name', 'domain', 'slug', 'is_processed', 'score', 'created_at']
     list_filter = ['is_processed', 'created_at', 'last_updated']
-    search_fields = ['name', 'url', 'slug']
-    readonly_fields = ['slug', 'created_at', 'last_updated', 'score']
+    search_fields = ['name', 'url', 'domain', 'slug']
+    readonly_fields = ['domain', 'slug', 'created_at', 'last_updated', 'score']
     plural_name = "Companies"
     fieldsets = (
         ('Basic Information', {
-            'fields': ('name', 'url', 'slug', 'about')
+            'fields': ('name', 'url', 'domain', 'slug', 'about')
         }),
         ('Address & Location', {
             'fields': ('address',)
@@ -95,17 +99,21 @@ class ContactsAdmin(admin.ModelAdmin):
 
 @admin.register(TaskQueue)
 class TaskQueueAdmin(admin.ModelAdmin):
-    list_display = ['url', 'status', 'retry_count', 'last_executed_at', 'created_at']
-    list_filter = ['status', 'created_at', 'last_executed_at']
-    search_fields = ['url', 'error_message']
-    readonly_fields = ['created_at', 'updated_at', 'last_executed_at']
+    list_display = ['url', 'status', 'priority', 'retry_count', 'enqueued_at', 'last_executed_at', 'finished_at', 'scrape_seconds']
+    list_filter = ['status', 'priority', 'created_at', 'last_executed_at']
+    search_fields = ['url', 'domain', 'error_message']
+    readonly_fields = ['domain', 'created_at', 'updated_at', 'enqueued_at', 'last_executed_at', 'finished_at', 'next_attempt_at', 'stage_timings']
     plural_name = "Task Queue"
     fieldsets = (
         ('Task Information', {
-            'fields': ('url', 'status')
+            'fields': ('url', 'domain', 'status', 'priority')
         }),
         ('Execution Details', {
-            'fields': ('last_executed_at', 'retry_count', 'error_message')
+            'fields': ('enqueued_at', 'last_executed_at', 'finished_at', 'retry_count', 'next_attempt_at', 'error_message')
+        }),
+        ('Stage Timings', {
+            'fields': ('stage_timings',),
+            'description': 'Seconds spent in each stage of the last attempt',
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -113,12 +121,58 @@ class TaskQueueAdmin(admin.ModelAdmin):
         }),
     )
     
-    actions = ['retry_failed_tasks']
+    actions = ['retry_failed_tasks', 'show_stage_percentiles']
     
     def retry_failed_tasks(self, request, queryset):
-        """Action to retry failed tasks"""
-        failed_tasks = queryset.filter(status='failed')
-        updated_count = failed_tasks.update(status='pending', retry_count=0)
+        """Action to retry failed and dead tasks now"""
+        failed_tasks = queryset.filter(status__in=['failed', 'dead'])
+        NegativeResult.objects.forget(failed_tasks.values_list('url', flat=True))
+        updated_count = failed_tasks.update(status='pending', retry_count=0, enqueued_at=timezone.now(),
+                                            next_attempt_at=None, finished_at=None, lease_expires_at=None)
+        if updated_count:
+            # Dispatch now rather than at the next beat safety net
+            transaction.on_commit(process_task_queue.delay)
         self.message_user(request, f'{updated_count} task(s) queued for retry.')
     
-    retry_failed_tasks.short_description = "Retry selected failed tasks"
+    retry_failed_tasks.short_description = "Retry selected failed or dead tasks now"
+
+    def scrape_seconds(self, obj):
+        """Total wall time of the last attempt"""
+        if not obj.stage_timings:
+            return None
+        return round(sum(obj.stage_timings.values()), 1)
+
+    scrape_seconds.short_description = "Scrape (s)"
+
+    def show_stage_percentiles(self, request, queryset):
+        """Action to show where the selected tasks' scrapes spent their time"""
+        summary = stage_summary(queryset.values_list('stage_timings', flat=True))
+        if not summary:
+            self.message_user(request, 'None of the selected tasks has stage timings yet.')
+            return
+        for name, stats in summary.items():
+            self.message_user(
+                request,
+                f"{name}: p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s, max {stats['max']:.3f}s "
+                f"over {stats['count']} scrape(s)",
+            )
+
+    show_stage_percentiles.short_description = "Show stage timing percentiles of selected tasks"
+
+
+@admin.register(NegativeResult)
+class NegativeResultAdmin(admin.ModelAdmin):
+    list_display = ['domain', 'reason', 'created_at', 'expires_at', 'is_active']
+    list_filter = ['created_at', 'expires_at']
+    search_fields = ['domain', 'reason']
+    readonly_fields = ['created_at']
+    plural_name = "Negative Results"
+
+    actions = ['purge_expired']
+
+    def purge_expired(self, request, queryset):
+        """Action to delete every expired entry"""
+        deleted_count, _ = NegativeResult.objects.expired().delete()
+        self.message_user(request, f'{deleted_count} expired negative result(s) purged.')
+
+    purge_expired.short_description = "Purge all expired entries"
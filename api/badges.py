@@ -0,0 +1,105 @@
+import io
+from functools import lru_cache
+from django.conf import settings
+
+# How long browsers and CDNs may reuse a badge before revalidating it
+BADGE_MAX_AGE = getattr(settings, 'BADGE_MAX_AGE', 60 * 60)
+
+WIDTH, HEIGHT, LABEL_WIDTH = 164, 24, 58
+LABEL_COLOR, EMPTY_STAR_COLOR, UNRATED_COLOR = '#1D2833', '#d1d5db', '#9ca3af'
+STAR_SIZE, STAR_GAP = 12, 2
+STARS_X = LABEL_WIDTH + 6
+# A 12x12 five-pointed star
+STAR_POINTS = [(6, 0), (7.8, 4), (12, 4.4), (8.8, 7.2), (9.7, 11.4), (6, 9.3), (2.3, 11.4), (3.2, 7.2), (0, 4.4), (4.2, 4)]
+
+SVG_TEMPLATE = (
+    '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'width="{width}" height="{height}" role="img" aria-label="{title}"><title>{title}</title>'
+    '<defs><path id="s" d="{star}"/>'
+    '<linearGradient id="f" gradientUnits="userSpaceOnUse" x1="{stars_x}" x2="{stars_end}">'
+    '<stop offset="{fill}" stop-color="{color}"/><stop offset="{fill}" stop-color="{empty}"/></linearGradient></defs>'
+    '<rect width="{width}" height="{height}" rx="4" fill="#fff" stroke="#e5e7eb"/>'
+    '<path d="M4 0h{label_body}v{height}H4a4 4 0 0 1-4-4V4a4 4 0 0 1 4-4z" fill="{label_color}"/>'
+    '<g font-family="Verdana,DejaVu Sans,sans-serif" font-size="11" font-weight="bold">'
+    '<text x="{label_center}" y="16" fill="#fff" text-anchor="middle">VGetit</text>'
+    '<text x="{score_x}" y="16" fill="{color}">{score}</text></g>'
+    '<g fill="url(#f)">{stars}</g></svg>'
+)
+
+
+def score_tenths(score):
+    """Badges only show one decimal, so 4.24 and 4.16 share one image."""
+    return max(0, min(50, int(round((score or 0) * 10))))
+
+
+def score_color(tenths):
+    # The thresholds of the HTML badge
+    if tenths >= 40:
+        return '#10b981'
+    if tenths >= 25:
+        return '#f59e0b'
+    return '#ef4444'
+
+
+def star_offsets():
+    return [STARS_X + i * (STAR_SIZE + STAR_GAP) for i in range(5)]
+
+
+@lru_cache(maxsize=None)
+def render_svg(tenths):
+    """The badge for a score of tenths/10, or for an unrated company when tenths is None."""
+    color = UNRATED_COLOR if tenths is None else score_color(tenths)
+    score = 'n/a' if tenths is None else f'{tenths / 10:.1f}'
+    offsets = star_offsets()
+    star = 'M' + 'L'.join(f'{x:g} {y:g}' for x, y in STAR_POINTS) + 'Z'
+    svg = SVG_TEMPLATE.format(
+        width=WIDTH, height=HEIGHT, label_body=LABEL_WIDTH - 4, label_color=LABEL_COLOR,
+        label_center=LABEL_WIDTH / 2, stars_x=STARS_X, stars_end=offsets[-1] + STAR_SIZE,
+        fill=f'{(tenths or 0) / 50:.3f}', color=color, empty=EMPTY_STAR_COLOR,
+        score=score, score_x=offsets[-1] + STAR_SIZE + 6, star=star,
+        title='VGetit trust score: ' + ('not rated' if tenths is None else f'{score} out of 5'),
+        stars=''.join(f'<use xlink:href="#s" x="{x}" y="6"/>' for x in offsets),
+    )
+    return svg.encode()
+
+
+@lru_cache(maxsize=None)
+def render_png(tenths):
+    """The same badge as a PNG, for sites that don't accept SVG images. Needs Pillow."""
+    from PIL import Image, ImageColor, ImageDraw, ImageFont  # Only the PNG badge needs it
+
+    scale = 2  # Drawn at twice the size so it stays sharp on high-density screens
+    color = UNRATED_COLOR if tenths is None else score_color(tenths)
+    image = Image.new('RGBA', (WIDTH * scale, HEIGHT * scale), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.rounded_rectangle([0, 0, WIDTH * scale - 1, HEIGHT * scale - 1], 4 * scale, fill='#fff', outline='#e5e7eb')
+    draw.rounded_rectangle([0, 0, LABEL_WIDTH * scale, HEIGHT * scale - 1], 4 * scale, fill=LABEL_COLOR)
+    font = ImageFont.load_default(size=11 * scale)
+    draw.text((LABEL_WIDTH * scale / 2, 12 * scale), 'VGetit', fill='#fff', font=font, anchor='mm')
+
+    fill_until = STARS_X + (5 * STAR_SIZE + 4 * STAR_GAP) * (tenths or 0) / 50
+    for x in star_offsets():
+        points = [((x + px) * scale, (6 + py) * scale) for px, py in STAR_POINTS]
+        draw.polygon(points, fill=EMPTY_STAR_COLOR)
+        if fill_until > x:
+            # Fill the part of the star left of the score
+            mask = Image.new('L', image.size, 0)
+            ImageDraw.Draw(mask).polygon(points, fill=255)
+            ImageDraw.Draw(mask).rectangle([fill_until * scale, 0, image.size[0], image.size[1]], fill=0)
+            image.paste(ImageColor.getcolor(color, 'RGBA'), mask=mask)
+
+    score = 'n/a' if tenths is None else f'{tenths / 10:.1f}'
+    draw.text(((star_offsets()[-1] + STAR_SIZE + 6) * scale, 12 * scale), score, fill=color, font=font, anchor='lm')
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+BADGE_FORMATS = {
+    'svg': (render_svg, 'image/svg+xml'),
+    'png': (render_png, 'image/png'),
+}
+
+
+def badge_etag(tenths, format):
+    return f'"badge-{format}-{"na" if tenths is None else tenths}"'
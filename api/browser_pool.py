@@ -0,0 +1,211 @@
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from billiard.process import current_process
+from django.conf import settings
+from playwright.sync_api import sync_playwright, Error as PlaywrightError
+from playwright_stealth import Stealth
+from pyvirtualdisplay import Display
+from api.metrics import get_worker_metrics
+from api.utils import StageTimer, process_tree_rss_mb
+
+os.environ['PYVIRTUALDISPLAY_DISPLAYFD'] = '0'
+
+BROWSER_POOL_SIZE = getattr(settings, 'BROWSER_POOL_SIZE', 1)
+BROWSER_POOL_MAX_PAGES = getattr(settings, 'BROWSER_POOL_MAX_PAGES', 50)
+BROWSER_POOL_MAX_MEMORY_MB = getattr(settings, 'BROWSER_POOL_MAX_MEMORY_MB', 1024)
+BROWSER_USER_DATA_DIR = getattr(settings, 'BROWSER_USER_DATA_DIR', './user_data')
+
+LAUNCH_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--no-sandbox",
+    "--disable-infobars"
+]
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+# Left out when seeding a profile: Chromium's lock of the running profile, and caches it rebuilds
+PROFILE_COPY_IGNORE = shutil.ignore_patterns('Singleton*', 'Cache', 'Code Cache', 'GPUCache')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PooledContext:
+    """A persistent Chromium context together with its usage counters."""
+
+    def __init__(self, playwright, user_data_dir):
+        self.user_data_dir = user_data_dir
+        self.context = playwright.chromium.launch_persistent_context(
+            user_data_dir=user_data_dir,
+            headless=False,
+            args=LAUNCH_ARGS,
+            user_agent=USER_AGENT
+        )
+        self.pages_served = 0
+        self.created_at = time.monotonic()
+
+    def is_healthy(self):
+        try:
+            self.context.cookies()
+            return True
+        except PlaywrightError:
+            return False
+
+    def close(self):
+        try:
+            self.context.close()
+        except PlaywrightError:
+            pass
+
+
+class BrowserPool:
+    """
+    Long-lived Chromium contexts for one worker process.
+
+    The virtual display and Playwright driver are started once. Each call to
+    page() hands out a fresh page from the next context in turn; a context is
+    relaunched when it fails its health check, after max_pages pages, or when
+    the browser processes exceed max_memory_mb. Playwright's sync API is bound
+    to the thread that started it, so a pool must stay on that thread.
+    After every page its metrics() are published for /api/metrics.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_POOL_MAX_PAGES,
+                 max_memory_mb=BROWSER_POOL_MAX_MEMORY_MB, user_data_dir=BROWSER_USER_DATA_DIR):
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.user_data_dir = user_data_dir
+        self._display = None
+        self._playwright_manager = None
+        self._playwright = None
+        self._contexts = [None] * self.size
+        self._next = 0
+        self._stats = {
+            'pages_served': 0,
+            'contexts_launched': 0,
+            'recycled_max_pages': 0,
+            'recycled_memory': 0,
+            'recycled_unhealthy': 0,
+        }
+
+    def start(self, timer=None):
+        if self._playwright is not None:
+            return
+        timer = timer or StageTimer()
+        print("display")
+        with timer.stage('display_start'):
+            self._display = Display(visible=False, size=(1920, 1080))
+            self._display.start()
+        print("browser")
+        with timer.stage('playwright_start'):
+            self._playwright_manager = Stealth().use_sync(sync_playwright())
+            self._playwright = self._playwright_manager.__enter__()
+
+    def shutdown(self):
+        for i, ctx in enumerate(self._contexts):
+            if ctx:
+                ctx.close()
+            self._contexts[i] = None
+        if self._playwright_manager is not None:
+            self._playwright_manager.__exit__(None, None, None)
+            self._playwright_manager = self._playwright = None
+        if self._display is not None:
+            self._display.stop()
+            self._display = None
+
+    def _profile_dir(self, slot):
+        # Chromium locks its profile directory, so every context of every
+        # worker process needs its own copy. A new copy starts from the base
+        # profile, keeping its cookies and solved-captcha state.
+        index = getattr(current_process(), 'index', 0) * self.size + slot
+        if index == 0:
+            return self.user_data_dir
+        path = f"{self.user_data_dir}-{index}"
+        if not os.path.exists(path) and os.path.isdir(self.user_data_dir):
+            try:
+                shutil.copytree(self.user_data_dir, path, symlinks=True, ignore=PROFILE_COPY_IGNORE)
+            except (shutil.Error, OSError) as e:
+                # Whatever was copied is still a usable, if emptier, profile
+                print(f"Could not copy browser profile to {path}: {e}")
+        return path
+
+    def _memory_mb(self):
+        return process_tree_rss_mb(os.getpid(), include_self=False)
+
+    def _acquire(self, timer):
+        self.start(timer)
+        slot = self._next
+        self._next = (self._next + 1) % self.size
+
+        ctx = self._contexts[slot]
+        if ctx and not ctx.is_healthy():
+            self._recycle(slot, 'recycled_unhealthy')
+            ctx = None
+        if ctx is None:
+            with timer.stage('browser_launch'):
+                ctx = PooledContext(self._playwright, self._profile_dir(slot))
+            self._contexts[slot] = ctx
+            self._stats['contexts_launched'] += 1
+        return slot, ctx
+
+    def _release(self, slot, ctx):
+        ctx.pages_served += 1
+        self._stats['pages_served'] += 1
+        if self.max_pages and ctx.pages_served >= self.max_pages:
+            self._recycle(slot, 'recycled_max_pages')
+        elif self.max_memory_mb and self._memory_mb() >= self.max_memory_mb:
+            self._recycle(slot, 'recycled_memory')
+        get_worker_metrics().publish('browser_pool', self.metrics())
+
+    def _recycle(self, slot, reason):
+        ctx = self._contexts[slot]
+        if ctx:
+            print(f"Recycling browser context {ctx.user_data_dir} ({reason}, {ctx.pages_served} pages)")
+            ctx.close()
+        self._contexts[slot] = None
+        self._stats[reason] += 1
+
+    @contextmanager
+    def page(self, timer=None):
+        """A fresh page; the display, driver and browser start-up it causes are timed into `timer`."""
+        timer = timer or StageTimer()
+        slot, ctx = self._acquire(timer)
+        with timer.stage('new_page'):
+            page = ctx.context.new_page()
+        try:
+            yield page
+        finally:
+            try:
+                page.close()
+            except PlaywrightError:
+                pass
+            self._release(slot, ctx)
+
+    def metrics(self):
+        live = [ctx for ctx in self._contexts if ctx]
+        return {
+            **self._stats,
+            'size': self.size,
+            'live_contexts': len(live),
+            'pages_on_live_contexts': sum(ctx.pages_served for ctx in live),
+            'memory_mb': round(self._memory_mb(), 1) if live else 0,
+        }
+
+
+def get_browser_pool():
+    """Returns the BrowserPool shared by this worker process, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BrowserPool()
+    return _pool
+
+
+def shutdown_browser_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
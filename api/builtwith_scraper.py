@@ -1,11 +1,9 @@
 import time
 from selectolax.parser import HTMLParser, Node
-from playwright.sync_api import sync_playwright
-from playwright_stealth import Stealth
-from api.captcha_solver import CaptchaAI
-from pyvirtualdisplay import Display
-import os
-os.environ['PYVIRTUALDISPLAY_DISPLAYFD'] = '0'
+from api.browser_pool import get_browser_pool
+from api.captcha_solver import get_captcha_solver
+from api.exceptions import ScrapeError
+from api.utils import StageTimer
 
 def safe_get_text(node: Node, seperator=''):
     return node.text(strip=True, separator=seperator) if node else ''
@@ -87,92 +85,86 @@ def parse_html_content(html_content: str):
         'listed_contacts': table_data
     }
 
-def scrape_company_data(target_url: str):
-    ai_solver = CaptchaAI()
+def scrape_company_data(target_url: str, timer: StageTimer = None):
+    """Scrapes BuiltWith for the domain; each stage's wall time is recorded into `timer`."""
+    timer = timer or StageTimer()
+    with timer.stage('model_load'):  # Only the first scrape of a worker process loads CLIP
+        ai_solver = get_captcha_solver()
+    pool = get_browser_pool()
 
     captured_data = {
         "image_bytes": None,
         "target_label": None
     }
 
-    with Display(visible=False, size=(1920, 1080)) as disp:
-        print("display")
-        with Stealth().use_sync(sync_playwright()) as p:
-            print("browser")
-            browser = p.chromium.launch_persistent_context(
-                user_data_dir="./user_data",
-                headless=False,
-                args=[
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",
-                    "--disable-infobars"
-                ],
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
-            page = browser.new_page()
-
-            def handle_response(response):
-                if "human-test/prompt" in response.url and response.status == 200:
-                    try:
-                        json_data = response.json()
-                        captured_data["target_label"] = json_data.get("label")
-                        print(f"Hedef metin yakalandı: {captured_data['target_label']}")
-                    except:
-                        pass
-
-            page.on("response", handle_response)
-
-            print("Sayfaya gidiliyor...")
+    with pool.page(timer) as page:
+        def handle_response(response):
+            if "human-test/prompt" in response.url and response.status == 200:
+                try:
+                    json_data = response.json()
+                    captured_data["target_label"] = json_data.get("label")
+                    print(f"Hedef metin yakalandı: {captured_data['target_label']}")
+                except:
+                    pass
+
+        page.on("response", handle_response)
+
+        print("Sayfaya gidiliyor...")
+        with timer.stage('navigation'):
             page.goto(f"https://builtwith.com/meta/{target_url}")
 
-            blob_selector = "img[src^='blob:']"
-            try:
+        blob_selector = "img[src^='blob:']"
+        try:
+            with timer.stage('captcha_wait'):
                 page.wait_for_selector(blob_selector, state="visible", timeout=30000)
                 page.wait_for_timeout(5000)
 
-                if not captured_data["target_label"]:
-                    return
+            if not captured_data["target_label"]:
+                raise ScrapeError("No captcha prompt captured")
 
+            with timer.stage('captcha_screenshot'):
                 captured_data["image_bytes"] = page.locator(blob_selector).screenshot()
 
+            with timer.stage('clip_inference'):
                 target_idx = ai_solver.solve(
                     captured_data["image_bytes"],
                     captured_data["target_label"]
                 )
 
-                element_box = page.locator(blob_selector).bounding_box()
+            element_box = page.locator(blob_selector).bounding_box()
 
-                if element_box:
-                    w = element_box["width"]
-                    h = element_box["height"]
+            if element_box:
+                w = element_box["width"]
+                h = element_box["height"]
 
-                    tile_w = w / 4
-                    tile_h = h / 2
+                tile_w = w / 4
+                tile_h = h / 2
 
-                    row = target_idx // 4
-                    col = target_idx % 4
+                row = target_idx // 4
+                col = target_idx % 4
 
-                    click_x = element_box["x"] + (col * tile_w) + (tile_w / 2)
-                    click_y = element_box["y"] + (row * tile_h) + (tile_h / 2)
+                click_x = element_box["x"] + (col * tile_w) + (tile_w / 2)
+                click_y = element_box["y"] + (row * tile_h) + (tile_h / 2)
 
+                with timer.stage('click'):
                     page.mouse.move(click_x, click_y, steps=15)
                     time.sleep(0.2)
                     page.mouse.down()
                     time.sleep(0.1)
                     page.mouse.up()
 
+                with timer.stage('click_settle'):
                     time.sleep(5)
-                else:
-                    print("Hata: Görsel bounding box alınamadı.")
+            else:
+                print("Hata: Görsel bounding box alınamadı.")
 
-            except Exception as e:
-                print(f"Bir hata oluştu veya captcha çıkmadı: {e}")
+        except ScrapeError:
+            raise
+        except Exception as e:
+            print(f"Bir hata oluştu veya captcha çıkmadı: {e}")
 
+        with timer.stage('page_content'):
             html_content = page.content()
 
-            browser.close()
-
-            result = parse_html_content(html_content, 'test')
-            return result
-
-
+    with timer.stage('parse'):
+        return parse_html_content(html_content)
@@ -1,14 +1,26 @@
-import time
+import threading
 from io import BytesIO
 from PIL import Image
 import torch
 from transformers import CLIPProcessor, CLIPModel
+from django.conf import settings
+
+CAPTCHA_MODEL_NAME = getattr(settings, 'CAPTCHA_MODEL_NAME', 'openai/clip-vit-base-patch32')
+CAPTCHA_TORCH_THREADS = getattr(settings, 'CAPTCHA_TORCH_THREADS', 0)
+
+_solver = None
+_solver_lock = threading.Lock()
 
 class CaptchaAI:
-    def __init__(self):
+    def __init__(self, model_name=CAPTCHA_MODEL_NAME):
         print("Model yükleniyor (biraz zaman alabilir)...")
-        self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+        if CAPTCHA_TORCH_THREADS:
+            # Fewer intra-op threads means fewer per-thread buffers, so several
+            # scrape workers can share a box without oversubscribing it.
+            torch.set_num_threads(CAPTCHA_TORCH_THREADS)
+        self.model = CLIPModel.from_pretrained(model_name, low_cpu_mem_usage=True)
+        self.model.eval()
+        self.processor = CLIPProcessor.from_pretrained(model_name)
         print("Model hazır.")
 
     def solve(self, image_bytes, target_label):
@@ -38,4 +50,17 @@ class CaptchaAI:
         confidence = probs[best_match_idx].item()
 
         print(f"AI Tahmini: Kutu #{best_match_idx} (Güven: %{confidence * 100:.2f})")
-        return best_match_idx
\ No newline at end of file
+        return best_match_idx
+
+
+def get_captcha_solver():
+    """
+    Returns the CaptchaAI instance shared by this worker process.
+    The CLIP model is loaded on first use and reused by every later scrape.
+    """
+    global _solver
+    if _solver is None:
+        with _solver_lock:
+            if _solver is None:
+                _solver = CaptchaAI()
+    return _solver
@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+import redis
+
+COMPANY_CACHE_URL = getattr(settings, 'COMPANY_CACHE_URL', getattr(settings, 'CELERY_BROKER_URL', ''))
+# Documents kept in each web process, and how long Redis keeps one nothing invalidates
+COMPANY_CACHE_LOCAL_SIZE = getattr(settings, 'COMPANY_CACHE_LOCAL_SIZE', 1024)
+COMPANY_CACHE_TTL = getattr(settings, 'COMPANY_CACHE_TTL', 60 * 60)
+# How long one request may hold the right to build a missing document, and how long others wait for it
+COMPANY_CACHE_LOCK_SECONDS = getattr(settings, 'COMPANY_CACHE_LOCK_SECONDS', 5)
+COMPANY_CACHE_LOCK_WAIT = getattr(settings, 'COMPANY_CACHE_LOCK_WAIT', 2)
+
+KEY_PREFIX = 'vgetit:company-doc'
+COUNTERS = ('local_hits', 'shared_hits', 'misses', 'builds', 'waits', 'errors')
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class CompanyDocumentCache:
+    """
+    Read-through cache of serialized company documents, keyed by slug and a
+    per-slug version that every change to the company bumps. Documents live
+    in Redis, shared by all web processes, with a small LRU of them in each
+    process in front. Readers always look the version up first, so a bump
+    makes every copy of the old document unreachable at once; nothing has to
+    be found and deleted. Without a Redis client the versions are kept in
+    process too, which is only correct for a single process (tests, dev).
+
+    A missing document is built once: concurrent readers in a process wait
+    for the thread building it, and across processes a short Redis lock lets
+    one build while the others poll for its result.
+    """
+
+    def __init__(self, client=None, local_size=COMPANY_CACHE_LOCAL_SIZE, ttl=COMPANY_CACHE_TTL,
+                 lock_seconds=COMPANY_CACHE_LOCK_SECONDS, lock_wait=COMPANY_CACHE_LOCK_WAIT, poll_interval=0.05):
+        self.client = client
+        self.local_size = local_size
+        self.ttl = ttl
+        self.lock_seconds = lock_seconds
+        self.lock_wait = lock_wait
+        self.poll_interval = poll_interval
+        self.local = OrderedDict()  # slug -> (version, document)
+        self.versions = {}  # Only used without Redis
+        self.building = {}  # document key -> Event set once it is built
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def version(self, slug):
+        if self.client is None:
+            with self.lock:
+                return self.versions.get(slug, 0)
+        return int(self.client.get(f'{KEY_PREFIX}:version:{slug}') or 0)
+
+    def invalidate(self, slugs):
+        slugs = {slug for slug in slugs if slug}
+        if not slugs:
+            return
+        with self.lock:
+            for slug in slugs:
+                self.local.pop(slug, None)
+                if self.client is None:
+                    self.versions[slug] = self.versions.get(slug, 0) + 1
+        if self.client is None:
+            return
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for slug in slugs:
+                    pipe.incr(f'{KEY_PREFIX}:version:{slug}')
+                pipe.execute()
+        except redis.RedisError as e:
+            # Stale until the documents expire (COMPANY_CACHE_TTL)
+            print(f"Could not invalidate {len(slugs)} company documents: {e}")
+
+    def get_or_build(self, slug, build):
+        """
+        Returns the company document for the slug, calling build() (which
+        returns a JSON-serializable document, or None for no company) only
+        when no current copy is cached. None is never cached.
+        """
+        try:
+            version = self.version(slug)
+        except redis.RedisError as e:
+            self.count('errors')
+            print(f"Company cache unavailable: {e}")
+            return build()
+
+        document = self.local_get(slug, version)
+        if document is not None:
+            self.count('local_hits')
+            return document
+
+        key = f'{KEY_PREFIX}:{slug}:{version}'
+        document = self.shared_get(key)
+        if document is not None:
+            self.count('shared_hits')
+            self.local_set(slug, version, document)
+            return document
+
+        self.count('misses')
+        return self.build_once(slug, version, key, build)
+
+    def build_once(self, slug, version, key, build):
+        with self.lock:
+            event = self.building.get(key)
+            leader = event is None
+            if leader:
+                event = self.building[key] = threading.Event()
+
+        if not leader:
+            self.count('waits')
+            event.wait(self.lock_wait)
+            document = self.local_get(slug, version)
+            # The builder found no company, failed or is slow: build our own
+            return document if document is not None else build()
+
+        locked = False
+        try:
+            locked = self.acquire(key)
+            if not locked:
+                self.count('waits')
+                document = self.wait_for(key)
+                if document is not None:
+                    self.local_set(slug, version, document)
+                    return document
+
+            self.count('builds')
+            document = build()
+            if document is None:
+                return None
+            payload = json.dumps(document, cls=DjangoJSONEncoder)
+            # Served from the JSON round trip, so a miss answers exactly like a hit
+            document = json.loads(payload)
+            self.local_set(slug, version, document)
+            self.shared_set(key, payload)
+            return document
+        finally:
+            if locked and self.client is not None:
+                self.shared_delete(f'{key}:lock')
+            with self.lock:
+                self.building.pop(key, None)
+            event.set()
+
+    def acquire(self, key):
+        """True if this process should build the document; without Redis it always does."""
+        if self.client is None:
+            return True
+        try:
+            return bool(self.client.set(f'{key}:lock', 1, nx=True, px=int(self.lock_seconds * 1000)))
+        except redis.RedisError as e:
+            self.count('errors')
+            print(f"Could not lock company document {key}: {e}")
+            return True
+
+    def wait_for(self, key):
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            document = self.shared_get(key)
+            if document is not None:
+                return document
+        return None
+
+    def local_get(self, slug, version):
+        with self.lock:
+            entry = self.local.get(slug)
+            if entry is None or entry[0] != version:
+                return None
+            self.local.move_to_end(slug)
+            return entry[1]
+
+    def local_set(self, slug, version, document):
+        with self.lock:
+            entry = self.local.get(slug)
+            if entry is not None and entry[0] > version:
+                return  # A newer document got here first
+            self.local[slug] = (version, document)
+            self.local.move_to_end(slug)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def shared_get(self, key):
+        if self.client is None:
+            return None
+        try:
+            payload = self.client.get(key)
+        except redis.RedisError as e:
+            self.count('errors')
+            print(f"Could not read company document {key}: {e}")
+            return None
+        return None if payload is None else json.loads(payload)
+
+    def shared_set(self, key, payload):
+        if self.client is None:
+            return
+        try:
+            self.client.set(key, payload, ex=self.ttl)
+        except redis.RedisError as e:
+            self.count('errors')
+            print(f"Could not store company document {key}: {e}")
+
+    def shared_delete(self, key):
+        try:
+            self.client.delete(key)
+        except redis.RedisError as e:
+            print(f"Could not delete {key}: {e}")
+
+    def stats(self):
+        """This process's counters since start, with the share of lookups answered from cache."""
+        with self.lock:
+            stats = dict(self.counters, local_entries=len(self.local))
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else None
+        return stats
+
+
+def get_document_cache():
+    """
+    Returns the cache shared by this process: backed by Redis when
+    COMPANY_CACHE_URL (the broker by default) is Redis, in-process otherwise.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if COMPANY_CACHE_URL.startswith(('redis://', 'rediss://', 'unix://')):
+                    _cache = CompanyDocumentCache(redis.Redis.from_url(COMPANY_CACHE_URL))
+                else:
+                    _cache = CompanyDocumentCache()
+    return _cache
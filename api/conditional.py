@@ -0,0 +1,54 @@
+import hashlib
+from collections import namedtuple
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from api.models import Comment
+
+# Company columns every company response is derived from, besides its related rows
+VALIDATOR_FIELDS = [
+    'id', 'last_updated', 'is_processed', 'score', 'rating_sum', 'rating_count',
+    'verified_phone_count', 'verified_contact_count', 'address_verified',
+]
+
+
+Validators = namedtuple('Validators', ['etag', 'last_modified', 'company_id'])
+
+
+def company_validators(companies):
+    """
+    Returns the Validators (etag, last_modified and, for the view's own
+    queries, the company id) of the first company in the queryset, or None
+    if there is none. One query: the company row by its unique key plus
+    the newest comment change through comment_company_updated_idx, with no
+    serialization. last_updated moves whenever the company is saved, and
+    with every saved or deleted phone number, contact, comment or address of
+    it (see update_score_counters); comment edits move the watermark too.
+    Rows changed with QuerySet.update(), which sends no signals, are not seen.
+    """
+    watermark = Comment.objects.filter(company=OuterRef('pk')).order_by('-updated_at').values('updated_at')[:1]
+    row = companies.annotate(comments_updated_at=Subquery(watermark)).values(
+        *VALIDATOR_FIELDS, 'comments_updated_at',
+    ).first()
+    if row is None:
+        return None
+    state = '|'.join(str(row[name]) for name in [*VALIDATOR_FIELDS, 'comments_updated_at'])
+    etag = '"%s"' % hashlib.md5(state.encode(), usedforsecurity=False).hexdigest()
+    last_modified = max(filter(None, [row['last_updated'], row['comments_updated_at']]))
+    return Validators(etag, last_modified.timestamp(), row['id'])
+
+
+def not_modified(request, validators):
+    """A 304 response if the request's If-None-Match or If-Modified-Since still matches, else None."""
+    if validators is None:
+        return None
+    return get_conditional_response(request, etag=validators.etag, last_modified=int(validators.last_modified))
+
+
+def set_validators(response, validators):
+    """Adds ETag and Last-Modified, and makes caches revalidate rather than guess a freshness lifetime."""
+    if validators is not None and response.status_code == 200:
+        response['ETag'] = validators.etag
+        response['Last-Modified'] = http_date(validators.last_modified)
+        response['Cache-Control'] = 'no-cache'
+    return response
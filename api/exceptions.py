@@ -0,0 +1,8 @@
+class ScrapeError(Exception):
+    """A scrape that did not produce company data. Retryable unless stated otherwise."""
+    retryable = True
+
+
+class PermanentScrapeError(ScrapeError):
+    """The page was scraped but cannot yield the company (e.g. it has no name); retrying will not help."""
+    retryable = False
@@ -0,0 +1,367 @@
+import csv
+import io
+import json
+import time
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from api.models import (
+    Company, Address, PhoneNumber, Contacts, available_slug, deferred_score_updates, refresh_company_scores
+)
+from api.phone_validation import validate_phone_numbers
+from api.utils import custom_slugify, normalize_domain
+
+
+class RowError(ValueError):
+    """A CSV row that cannot be imported at all."""
+
+
+def parse_row(row):
+    """
+    Turns one BuiltWith CSV row into plain values. Raises RowError when the
+    row lacks a usable domain or name; malformed phone or contact JSON only adds a
+    warning and leaves that list empty. Phone numbers are verified separately,
+    in bulk, by verify_phone_numbers().
+    """
+    domain = (row.get('domain') or '').strip()
+    name = (row.get('name') or '').strip()
+    if not normalize_domain(domain) or not name:
+        raise RowError('Missing domain or name, skipping')
+
+    parsed = {
+        'url': f'https://{domain}' if not domain.startswith('http') else domain,
+        'domain': normalize_domain(domain),
+        'name': name,
+        'social_urls': row.get('socials', '[]'),
+        'address': (row.get('address') or '').strip(),
+        'address_verified': (row.get('verified_people_exist') or 'False').lower() == 'true',
+        'phone_numbers': [],
+        'contacts': [],
+        'warnings': [],
+    }
+
+    try:
+        for phone_data in json.loads(row.get('phone_numbers') or '[]'):
+            phone_number = (phone_data.get('number') or '').strip()
+            description = (phone_data.get('description') or '').strip()
+            if phone_number:
+                parsed['phone_numbers'].append({
+                    'number': phone_number,
+                    'description': description,
+                    'verified': False,  # Set by verify_phone_numbers()
+                })
+    except json.JSONDecodeError:
+        parsed['warnings'].append('Invalid phone numbers JSON, skipping')
+
+    try:
+        for contact_data in json.loads(row.get('listed_contacts') or '[]'):
+            contact_name = (contact_data.get('name') or '').strip()
+            if contact_name:
+                parsed['contacts'].append({
+                    'name': contact_name,
+                    'verified_profile': contact_data.get('verified_profile', False),
+                    'level': (contact_data.get('level') or 'Unknown').strip(),
+                    'google_link': (contact_data.get('google_link') or '').strip(),
+                    'linkedin_link': (contact_data.get('linkedin_link') or '').strip(),
+                })
+    except json.JSONDecodeError:
+        parsed['warnings'].append('Invalid contacts JSON, skipping')
+
+    return parsed
+
+
+def verify_phone_numbers(rows, region="US"):
+    """Sets 'verified' on every phone number of the parsed rows with one batch validation."""
+    phones = [phone for row in rows for phone in row['phone_numbers']]
+    for phone, is_valid in zip(phones, validate_phone_numbers([phone['number'] for phone in phones], region)):
+        phone['verified'] = is_valid
+
+
+class BatchImporter:
+    """
+    Streams CSV rows in batches of batch_size and writes each batch in its own
+    transaction. Companies are upserted on domain with one INSERT ... ON CONFLICT
+    DO UPDATE, addresses are written with one bulk insert and one bulk
+    update, phone numbers and contacts are replaced set-wise, and scores are
+    rebuilt once per batch. A batch that fails is written again row by row.
+    """
+
+    def __init__(self, stdout, style, batch_size=1000):
+        self.stdout = stdout
+        self.style = style
+        self.batch_size = batch_size
+        self.created_count = 0
+        self.updated_count = 0
+        self.error_count = 0
+        self.row_count = 0
+
+    def run(self, reader):
+        started = time.monotonic()
+        batch = {}
+        for row_num, row in enumerate(reader, start=2):  # Start from 2 (header is 1)
+            try:
+                parsed = parse_row(row)
+            except RowError as e:
+                self.stdout.write(self.style.WARNING(f'Row {row_num}: {e}'))
+                self.error_count += 1
+                continue
+            for warning in parsed['warnings']:
+                self.stdout.write(self.style.WARNING(f'Row {row_num}: {warning}'))
+            # A domain repeated within a batch keeps its last row, as the row engine would
+            parsed['row_num'] = row_num
+            batch.pop(parsed['domain'], None)
+            batch[parsed['domain']] = parsed
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = {}
+        if batch:
+            self.flush(batch)
+
+        elapsed = time.monotonic() - started
+        rate = self.row_count / elapsed if elapsed else 0
+        self.stdout.write(f'Imported {self.row_count} rows in {elapsed:.1f}s ({rate:.0f} rows/s)')
+
+    def flush(self, batch):
+        rows = list(batch.values())
+        first, last = rows[0]['row_num'], rows[-1]['row_num']
+        verify_phone_numbers(rows)
+        try:
+            created = self.write_rows(rows)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'Rows {first}-{last}: {str(e)}, retrying row by row'))
+            self.flush_rows(rows)
+            return
+        self.row_count += len(rows)
+        self.created_count += created
+        self.updated_count += len(rows) - created
+        self.stdout.write(self.style.SUCCESS(
+            f'Rows {first}-{last}: {created} created, {len(rows) - created} updated'
+        ))
+
+    def flush_rows(self, rows):
+        """Writes a failed batch one row at a time, so one bad row costs only itself."""
+        for row in rows:
+            try:
+                created = self.write_rows([row])
+            except Exception as e:
+                self.error_count += 1
+                self.stdout.write(self.style.ERROR(f'Row {row["row_num"]}: Error - {str(e)}'))
+                continue
+            self.row_count += 1
+            self.created_count += created
+            self.updated_count += 1 - created
+
+    def write_rows(self, rows):
+        with transaction.atomic(), deferred_score_updates():
+            return self.write_batch(rows)
+
+    def write_batch(self, rows):
+        domains = [row['domain'] for row in rows]
+        existing_slugs = dict(Company.objects.filter(domain__in=domains).values_list('domain', 'slug'))
+        slugs = self.assign_slugs([row for row in rows if row['domain'] not in existing_slugs])
+        slugs.update(existing_slugs)
+
+        Company.objects.bulk_create(
+            [
+                Company(
+                    url=row['url'],
+                    domain=row['domain'],
+                    slug=slugs[row['domain']],
+                    name=row['name'],
+                    is_processed=True,
+                    social_urls=row['social_urls'],
+                )
+                for row in rows
+            ],
+            update_conflicts=True,
+            unique_fields=['domain'],
+            update_fields=['name', 'is_processed', 'social_urls', 'last_updated'],
+        )
+        companies = {
+            domain: (company_id, address_id)
+            for domain, company_id, address_id
+            in Company.objects.filter(domain__in=domains).values_list('domain', 'id', 'address_id')
+        }
+        company_ids = [company_id for company_id, _ in companies.values()]
+
+        self.write_addresses(rows, companies)
+
+        # One DELETE each; the score rebuild below covers what the per-row delete signals would do
+        PhoneNumber.objects.filter(company_id__in=company_ids)._raw_delete(connection.alias)
+        PhoneNumber.objects.bulk_create([
+            PhoneNumber(company_id=companies[row['domain']][0], **phone)
+            for row in rows for phone in row['phone_numbers']
+        ])
+        Contacts.objects.filter(company_id__in=company_ids)._raw_delete(connection.alias)
+        Contacts.objects.bulk_create([
+            Contacts(company_id=companies[row['domain']][0], **contact)
+            for row in rows for contact in row['contacts']
+        ])
+
+        refresh_company_scores(company_ids)
+        return len(rows) - len(existing_slugs)
+
+    def assign_slugs(self, rows):
+        """Slugs for new companies by domain, following Company.save but with one query for the common case."""
+        bases = {row['domain']: custom_slugify(row['url']) for row in rows}
+        taken = set(Company.objects.filter(slug__in=set(bases.values())).values_list('slug', flat=True))
+        slugs = {}
+        reserved = set()
+        for domain, base in bases.items():
+            slug = base if base not in taken and base not in reserved else available_slug(base, reserved)
+            reserved.add(slug)
+            slugs[domain] = slug
+        return slugs
+
+    def write_addresses(self, rows, companies):
+        to_update = []
+        to_create = []
+        for row in rows:
+            if not row['address']:
+                continue
+            company_id, address_id = companies[row['domain']]
+            address = Address(id=address_id, address=row['address'], verified=row['address_verified'])
+            (to_update if address_id else to_create).append((company_id, address))
+
+        Address.objects.bulk_update([address for _, address in to_update], ['address', 'verified'])
+        Address.objects.bulk_create([address for _, address in to_create])
+        Company.objects.bulk_update(
+            [Company(id=company_id, address_id=address.id) for company_id, address in to_create],
+            ['address'],
+        )
+
+
+class CopyImporter(BatchImporter):
+    """
+    PostgreSQL fast path for very large files. Each batch is streamed with
+    COPY FROM STDIN into session-local staging tables and merged into the
+    company, address, phone number and contact tables with a handful of
+    set-based statements, so no model instances are built per row. Slugs and
+    phone verification follow the same rules as the other engines.
+    """
+
+    STAGING_TABLES = {
+        'import_company': ['domain', 'url', 'slug', 'name', 'social_urls', 'address', 'address_verified'],
+        'import_phone': ['domain', 'number', 'description', 'verified'],
+        'import_contact': ['domain', 'name', 'verified_profile', 'level', 'google_link', 'linkedin_link'],
+    }
+
+    def __init__(self, stdout, style, batch_size=50_000):
+        super().__init__(stdout, style, batch_size=batch_size)
+
+    def write_batch(self, rows):
+        domains = [row['domain'] for row in rows]
+        existing_slugs = dict(Company.objects.filter(domain__in=domains).values_list('domain', 'slug'))
+        slugs = self.assign_slugs([row for row in rows if row['domain'] not in existing_slugs])
+        slugs.update(existing_slugs)
+
+        tables = {
+            'company': Company._meta.db_table,
+            'address': Address._meta.db_table,
+            'phone': PhoneNumber._meta.db_table,
+            'contact': Contacts._meta.db_table,
+        }
+        with connection.cursor() as cursor:
+            self.create_staging_tables(cursor)
+            self.copy(cursor, 'import_company', (
+                [row['domain'], row['url'], slugs[row['domain']], row['name'], row['social_urls'] or '', row['address'], row['address_verified']]
+                for row in rows
+            ))
+            self.copy(cursor, 'import_phone', (
+                [row['domain'], phone['number'], phone['description'], phone['verified']]
+                for row in rows for phone in row['phone_numbers']
+            ))
+            self.copy(cursor, 'import_contact', (
+                [row['domain'], contact['name'], bool(contact['verified_profile']), contact['level'],
+                 contact['google_link'], contact['linkedin_link']]
+                for row in rows for contact in row['contacts']
+            ))
+
+            # Upsert companies; xmax = 0 only for freshly inserted rows
+            cursor.execute(f"""
+                INSERT INTO {tables['company']} (
+                    name, about, slug, url, domain, is_processed, social_urls, score, rating_sum, rating_count,
+                    verified_phone_count, verified_contact_count, address_verified, created_at, last_updated
+                )
+                SELECT name, '', slug, url, domain, true, social_urls, 0, 0, 0, 0, 0, false, now(), now()
+                FROM import_company
+                ON CONFLICT (domain) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    is_processed = true,
+                    social_urls = EXCLUDED.social_urls,
+                    last_updated = EXCLUDED.last_updated
+                RETURNING (xmax = 0)
+            """)
+            created = sum(1 for (inserted,) in cursor.fetchall() if inserted)
+
+            cursor.execute(f"""
+                UPDATE import_company s SET company_id = c.id, address_id = c.address_id
+                FROM {tables['company']} c WHERE c.domain = s.domain
+            """)
+
+            # Addresses: update the existing row, or reserve ids for new rows and link them
+            cursor.execute(f"""
+                UPDATE {tables['address']} a SET address = s.address, verified = s.address_verified
+                FROM import_company s WHERE a.id = s.address_id AND s.address <> ''
+            """)
+            cursor.execute(f"""
+                UPDATE import_company
+                SET address_id = nextval(pg_get_serial_sequence('{tables['address']}', 'id')), new_address = true
+                WHERE address_id IS NULL AND address <> ''
+            """)
+            cursor.execute(f"""
+                INSERT INTO {tables['address']} (id, address, verified)
+                SELECT address_id, address, address_verified FROM import_company WHERE new_address
+            """)
+            cursor.execute(f"""
+                UPDATE {tables['company']} c SET address_id = s.address_id
+                FROM import_company s WHERE s.new_address AND c.id = s.company_id
+            """)
+
+            # Replace phone numbers and contacts set-wise
+            cursor.execute(f"""
+                DELETE FROM {tables['phone']} p USING import_company s WHERE p.company_id = s.company_id
+            """)
+            cursor.execute(f"""
+                INSERT INTO {tables['phone']} (company_id, number, verified, description)
+                SELECT s.company_id, p.number, p.verified, p.description
+                FROM import_phone p JOIN import_company s ON s.domain = p.domain
+            """)
+            cursor.execute(f"""
+                DELETE FROM {tables['contact']} p USING import_company s WHERE p.company_id = s.company_id
+            """)
+            cursor.execute(f"""
+                INSERT INTO {tables['contact']} (company_id, name, verified_profile, level, google_link, linkedin_link)
+                SELECT s.company_id, p.name, p.verified_profile, p.level, p.google_link, p.linkedin_link
+                FROM import_contact p JOIN import_company s ON s.domain = p.domain
+            """)
+
+        Company.objects.filter(id__in=RawSQL('SELECT company_id FROM import_company', [])).refresh_scores()
+        return created
+
+    def create_staging_tables(self, cursor):
+        # Temporary tables live for the session and are emptied at every commit
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS import_company (
+                domain text PRIMARY KEY, url text, slug text, name text, social_urls text, address text,
+                address_verified boolean, company_id integer, address_id bigint, new_address boolean DEFAULT false
+            ) ON COMMIT DELETE ROWS
+        """)
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS import_phone (
+                domain text, number text, description text, verified boolean
+            ) ON COMMIT DELETE ROWS
+        """)
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS import_contact (
+                domain text, name text, verified_profile boolean, level text, google_link text, linkedin_link text
+            ) ON COMMIT DELETE ROWS
+        """)
+        # A batch nested in an outer transaction does not commit, so clear explicitly too
+        cursor.execute("TRUNCATE import_company, import_phone, import_contact")
+
+    def copy(self, cursor, table, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+        buffer.seek(0)
+        columns = ', '.join(self.STAGING_TABLES[table])
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from api.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Compare requests per second of the HTML badge widget and the SVG/PNG badges, through the full middleware stack'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', nargs='?', help='Company to render (default: the first processed one)')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per path')
+
+    def handle(self, *args, **options):
+        slug = options['slug'] or Company.objects.filter(is_processed=True).values_list('slug', flat=True).first()
+        if not slug or not Company.objects.filter(slug=slug).exists():
+            raise CommandError('No such company; pass the slug of an existing one.')
+
+        client = Client(SERVER_NAME='localhost')
+        base = f'/api/embed/company/{slug}/'
+        etag = client.get(base + 'badge.svg')['ETag']
+        paths = [
+            ('HTML template', base, {}),
+            ('SVG badge', base + 'badge.svg', {}),
+            ('SVG badge, 304', base + 'badge.svg', {'HTTP_IF_NONE_MATCH': etag}),
+        ]
+        try:
+            import PIL  # noqa: F401
+            paths.append(('PNG badge', base + 'badge.png', {}))
+        except ImportError:
+            self.stdout.write('Pillow is not installed; skipping the PNG badge')
+
+        results = []
+        for label, path, headers in paths:
+            response = client.get(path, **headers)  # Warm up caches and imports
+            if response.status_code not in (200, 304):
+                raise CommandError(f'{path} answered {response.status_code}')
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                client.get(path, **headers)
+            elapsed = time.perf_counter() - started
+            results.append((label, options['requests'] / elapsed, len(response.content)))
+
+        baseline = results[0][1]
+        self.stdout.write(self.style.SUCCESS('='*50))
+        for label, rate, size in results:
+            self.stdout.write(f'{label:<16} {rate:>10.0f} req/s  x{rate / baseline:<6.1f} {size:>7} bytes')
+        self.stdout.write(self.style.SUCCESS('='*50))
@@ -0,0 +1,63 @@
+import csv
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.phone_validation import check_phone_number, clear_phone_validation_cache, validate_phone_numbers
+
+
+class Command(BaseCommand):
+    help = 'Compare serial, memoized and parallel phone validation on the numbers of a BuiltWith CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', type=str, help='CSV with a phone_numbers JSON column')
+        parser.add_argument('--region', default='US', help='Default region used by import_csv')
+        parser.add_argument('--processes', type=int, default=None, help='Process pool size (default: CPU count)')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many numbers')
+
+    def handle(self, *args, **options):
+        numbers = self.read_numbers(options['csv_file'], options['limit'])
+        if not numbers:
+            raise CommandError('No phone numbers found in the CSV.')
+        region = options['region']
+        distinct = len(set(numbers))
+        self.stdout.write(f'{len(numbers)} numbers, {distinct} distinct')
+
+        started = time.perf_counter()
+        baseline = [check_phone_number(number, region) for number in numbers]
+        serial = time.perf_counter() - started
+
+        clear_phone_validation_cache()
+        started = time.perf_counter()
+        memoized = validate_phone_numbers(numbers, region, processes=1)
+        cached = time.perf_counter() - started
+
+        clear_phone_validation_cache()
+        started = time.perf_counter()
+        parallel_results = validate_phone_numbers(numbers, region, processes=options['processes'])
+        parallel = time.perf_counter() - started
+
+        if memoized != baseline or parallel_results != baseline:
+            raise CommandError('Validation results differ between strategies.')
+
+        self.stdout.write(self.style.SUCCESS('='*50))
+        for label, seconds in (('Serial, uncached', serial), ('Memoized', cached), ('Memoized + process pool', parallel)):
+            self.stdout.write(
+                f'{label:<25} {seconds:8.2f}s  {len(numbers) / seconds:>10.0f} numbers/s  x{serial / seconds:.1f}'
+            )
+        self.stdout.write(self.style.SUCCESS('='*50))
+
+    def read_numbers(self, csv_file, limit):
+        numbers = []
+        try:
+            with open(csv_file, 'r', encoding='utf-8', newline='') as file:
+                for row in csv.DictReader(file):
+                    try:
+                        phones = json.loads(row.get('phone_numbers') or '[]')
+                    except json.JSONDecodeError:
+                        continue
+                    numbers.extend((phone.get('number') or '').strip() for phone in phones if phone.get('number'))
+                    if limit and len(numbers) >= limit:
+                        return numbers[:limit]
+        except FileNotFoundError:
+            raise CommandError(f'CSV file not found: {csv_file}')
+        return numbers
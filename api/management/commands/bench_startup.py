@@ -0,0 +1,69 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that belong to the scrape workers only. None of them may be loaded
+# by the web process.
+HEAVY_MODULES = ['torch', 'transformers', 'playwright', 'playwright_stealth', 'pyvirtualdisplay', 'selectolax', 'PIL']
+
+PROBE = """
+import json, os, resource, sys, time
+start = time.perf_counter()
+import vgetit.wsgi
+from django.urls import get_resolver
+get_resolver().url_patterns  # Views are imported on the first request; load them now
+elapsed = time.perf_counter() - start
+rss_kb = 0
+try:
+    with open('/proc/self/statm') as f:
+        rss_kb = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+except OSError:
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = json.loads(sys.argv[1])
+print(json.dumps({
+    'import_seconds': elapsed,
+    'rss_kb': rss_kb,
+    'loaded': [m for m in heavy if m in sys.modules],
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and resident memory of the web process (vgetit.wsgi)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters to sample')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'vgetit.settings'))
+        samples = []
+
+        for _ in range(options['runs']):
+            proc = subprocess.run(
+                [sys.executable, '-c', PROBE, json.dumps(HEAVY_MODULES)],
+                cwd=settings.BASE_DIR,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            if proc.returncode != 0:
+                raise CommandError(f'Importing vgetit.wsgi failed:\n{proc.stderr}')
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+        import_times = [s['import_seconds'] for s in samples]
+        rss_values = [s['rss_kb'] / 1024 for s in samples]
+        loaded = sorted({m for s in samples for m in s['loaded']})
+
+        self.stdout.write(self.style.SUCCESS('='*50))
+        self.stdout.write(f'Runs: {len(samples)}')
+        self.stdout.write(f'Import time: median {statistics.median(import_times) * 1000:.1f} ms, max {max(import_times) * 1000:.1f} ms')
+        self.stdout.write(f'RSS: median {statistics.median(rss_values):.1f} MiB, max {max(rss_values):.1f} MiB')
+        self.stdout.write(self.style.SUCCESS('='*50))
+
+        if loaded:
+            raise CommandError(f'Web process loaded scrape-only modules: {", ".join(loaded)}')
+        self.stdout.write(self.style.SUCCESS('Web process is free of scrape-only modules.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from api.models import NegativeResult
+
+
+class Command(BaseCommand):
+    help = 'Delete expired negative-result cache entries (or all of them, or those for given domains)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('domains', nargs='*', help='Only purge these domains or URLs, expired or not')
+        parser.add_argument('--all', action='store_true', help='Purge every entry, expired or not')
+
+    def handle(self, *args, **options):
+        if options['domains']:
+            deleted = NegativeResult.objects.forget(options['domains'])
+        elif options['all']:
+            deleted, _ = NegativeResult.objects.all().delete()
+        else:
+            deleted, _ = NegativeResult.objects.expired().delete()
+        self.stdout.write(self.style.SUCCESS(f'Purged {deleted} negative result(s).'))
@@ -0,0 +1,37 @@
+import json
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from api.models import TaskQueue
+
+
+def format_seconds(value):
+    return '-' if value is None else f'{value:.1f}s'
+
+
+class Command(BaseCommand):
+    help = 'Show per-lane task queue depth, wait time and time-to-result percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=60, help='Minutes of finished work to include')
+        parser.add_argument('--json', action='store_true', help='Print the metrics as JSON')
+
+    def handle(self, *args, **options):
+        metrics = TaskQueue.objects.lane_metrics(window=timedelta(minutes=options['window']))
+        if options['json']:
+            self.stdout.write(json.dumps(metrics, indent=2))
+            return
+
+        self.stdout.write(self.style.SUCCESS('='*50))
+        self.stdout.write(
+            f"{'Lane':<12} {'Pending':>8} {'Running':>8} {'Retrying':>9} {'Dead':>6} {'Oldest':>9} {'Wait p95':>9} {'Result p50':>11} {'Result p95':>11}"
+        )
+        for lane, lane_metrics in metrics.items():
+            self.stdout.write(
+                f"{lane:<12} {lane_metrics['pending']:>8} {lane_metrics['processing']:>8} "
+                f"{lane_metrics['retrying']:>9} {lane_metrics['dead']:>6} "
+                f"{format_seconds(lane_metrics['oldest_pending_seconds']):>9} "
+                f"{format_seconds(lane_metrics['wait_p95']):>9} "
+                f"{format_seconds(lane_metrics['time_to_result_p50']):>11} "
+                f"{format_seconds(lane_metrics['time_to_result_p95']):>11}"
+            )
+        self.stdout.write(self.style.SUCCESS('='*50))
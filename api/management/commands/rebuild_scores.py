@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+from api.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized score counters and scores of all companies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Companies per UPDATE')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Company.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write(self.style.WARNING('No companies to rebuild.'))
+            return
+
+        rebuilt = 0
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            with transaction.atomic():
+                rebuilt += Company.objects.filter(id__gte=start, id__lt=start + batch_size).refresh_scores()
+            self.stdout.write(f'Rebuilt {rebuilt} companies (up to id {start + batch_size - 1})')
+
+        self.stdout.write(self.style.SUCCESS(f'Score counters rebuilt for {rebuilt} companies.'))
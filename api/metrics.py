@@ -0,0 +1,302 @@
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+import redis
+from api.company_cache import get_document_cache
+from api.models import TaskQueue
+
+# Requests running more queries than this are counted and logged
+METRICS_QUERY_BUDGET = getattr(settings, 'METRICS_QUERY_BUDGET', 20)
+# When set, /api/metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', '')
+# Redis the Celery workers publish their in-process metrics to, and how long a silent worker's stay
+WORKER_METRICS_URL = getattr(settings, 'WORKER_METRICS_URL', getattr(settings, 'CELERY_BROKER_URL', ''))
+WORKER_METRICS_TTL = getattr(settings, 'WORKER_METRICS_TTL', 10 * 60)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Counts of observations at or below each bucket bound, Prometheus style. Not locked; see RequestMetrics."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """(le, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip([*self.buckets, '+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class QueryCounter:
+    """A connection.execute_wrapper that counts queries and the time spent in them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+_query_counter = ContextVar('query_counter', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    counter = _query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install_query_counter(connection, **kwargs):
+    # First, so the pop() of any execute_wrapper() block already open can't remove it
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_queries)
+
+
+connection_created.connect(install_query_counter)
+
+
+@contextmanager
+def counting_queries():
+    """
+    Yields a QueryCounter of the queries run while active. The counter is
+    found through a context variable, so queries that async code runs
+    through sync_to_async, on another thread, are counted too.
+    """
+    for alias in connections:
+        install_query_counter(connections[alias])  # Connections opened before this module was loaded
+    counter = QueryCounter()
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+class RequestMetrics:
+    """
+    Per-view histograms of wall time, query count, query time and response
+    size, kept in process memory. Recording a request is a few list
+    increments under a lock, cheap enough to leave on everywhere.
+    """
+
+    HISTOGRAMS = {
+        'duration_seconds': ('Wall time from the first middleware to the response', DURATION_BUCKETS),
+        'db_queries': ('Database queries per request', QUERY_BUCKETS),
+        'db_seconds': ('Time spent in database queries per request', DURATION_BUCKETS),
+        'response_bytes': ('Response body size', SIZE_BUCKETS),
+    }
+
+    def __init__(self, query_budget=METRICS_QUERY_BUDGET):
+        self.query_budget = query_budget
+        self.views = {}
+        self.responses = Counter()  # (view, status) -> requests
+        self.over_budget = Counter()  # view -> requests
+        self.lock = threading.Lock()
+
+    def record(self, view, status, duration, queries=None, db_seconds=None, size=None):
+        """Adds one request; values that are None (unknown) are left out."""
+        values = {'duration_seconds': duration, 'db_queries': queries, 'db_seconds': db_seconds, 'response_bytes': size}
+        over_budget = queries is not None and queries > self.query_budget
+        with self.lock:
+            histograms = self.views.get(view)
+            if histograms is None:
+                histograms = self.views[view] = {
+                    name: Histogram(buckets) for name, (_, buckets) in self.HISTOGRAMS.items()
+                }
+            for name, value in values.items():
+                if value is not None:
+                    histograms[name].observe(value)
+            self.responses[view, status] += 1
+            if over_budget:
+                self.over_budget[view] += 1
+        return over_budget
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, _) in self.HISTOGRAMS.items():
+                metric = f'vgetit_http_request_{name}'
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+                for view, histograms in sorted(self.views.items()):
+                    histogram = histograms[name]
+                    labels = f'view="{escape(view)}"'
+                    total = 0
+                    for bound, total in histogram.samples():
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {total}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum:g}')
+                    lines.append(f'{metric}_count{{{labels}}} {total}')
+
+            lines += ['# HELP vgetit_http_responses_total Responses by view and status',
+                      '# TYPE vgetit_http_responses_total counter']
+            for (view, status), count in sorted(self.responses.items()):
+                lines.append(f'vgetit_http_responses_total{{view="{escape(view)}",status="{status}"}} {count}')
+
+            lines += [f'# HELP vgetit_http_query_budget_exceeded_total Requests over {self.query_budget} queries',
+                      '# TYPE vgetit_http_query_budget_exceeded_total counter']
+            for view, count in sorted(self.over_budget.items()):
+                lines.append(f'vgetit_http_query_budget_exceeded_total{{view="{escape(view)}"}} {count}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_family(lines, metric, kind, help_text, samples):
+    """Appends a gauge or counter; samples are (labels dict, value) pairs and None values are left out."""
+    lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+    for labels, value in samples:
+        if value is None:
+            continue
+        label_text = ','.join(f'{key}="{escape(label)}"' for key, label in labels.items())
+        lines.append(f'{metric}{{{label_text}}} {value:g}' if label_text else f'{metric} {value:g}')
+
+
+class WorkerMetrics:
+    """
+    Latest snapshot of each worker process's metrics of a source (such as
+    the browser pool), so the web process can export numbers that only
+    exist in the workers. Snapshots live in Redis and expire once a worker
+    stops publishing; without a Redis client they are kept in process,
+    which only sees workers running in this process (tests, dev).
+    """
+
+    KEY_PREFIX = 'vgetit:worker-metrics'
+
+    def __init__(self, client=None, ttl=WORKER_METRICS_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.local = {}  # (source, worker) -> values
+        self.lock = threading.Lock()
+
+    def publish(self, source, values, worker=None):
+        worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+        if self.client is None:
+            with self.lock:
+                self.local[source, worker] = dict(values)
+            return
+        try:
+            self.client.set(f'{self.KEY_PREFIX}:{source}:{worker}', json.dumps(values), ex=self.ttl)
+        except redis.RedisError as e:
+            print(f"Could not publish {source} metrics: {e}")
+
+    def collect(self, source):
+        """{worker: values} of the workers that published for the source recently."""
+        if self.client is None:
+            with self.lock:
+                return {worker: dict(values) for (name, worker), values in self.local.items() if name == source}
+        prefix = f'{self.KEY_PREFIX}:{source}:'
+        try:
+            keys = list(self.client.scan_iter(match=prefix + '*', count=100))
+            payloads = self.client.mget(keys) if keys else []
+        except redis.RedisError as e:
+            print(f"Could not read {source} metrics: {e}")
+            return {}
+        return {
+            (key.decode() if isinstance(key, bytes) else key)[len(prefix):]: json.loads(payload)
+            for key, payload in zip(keys, payloads) if payload is not None
+        }
+
+
+_worker_metrics = None
+_worker_metrics_lock = threading.Lock()
+
+
+def get_worker_metrics():
+    """The WorkerMetrics of this process: Redis-backed when WORKER_METRICS_URL (the broker by default) is Redis."""
+    global _worker_metrics
+    if _worker_metrics is None:
+        with _worker_metrics_lock:
+            if _worker_metrics is None:
+                if WORKER_METRICS_URL.startswith(('redis://', 'rediss://', 'unix://')):
+                    _worker_metrics = WorkerMetrics(redis.Redis.from_url(WORKER_METRICS_URL))
+                else:
+                    _worker_metrics = WorkerMetrics()
+    return _worker_metrics
+
+
+# What each worker's BrowserPool.metrics() holds, and how it is exported
+BROWSER_POOL_METRICS = (
+    ('pages_served', 'counter', 'Pages handed out by the browser pool'),
+    ('contexts_launched', 'counter', 'Browser contexts launched'),
+    ('recycled_max_pages', 'counter', 'Contexts relaunched after serving their page budget'),
+    ('recycled_memory', 'counter', 'Contexts relaunched because the browser used too much memory'),
+    ('recycled_unhealthy', 'counter', 'Contexts relaunched after failing their health check'),
+    ('live_contexts', 'gauge', 'Browser contexts currently open'),
+    ('memory_mb', 'gauge', 'Resident memory of the browser processes, in MiB'),
+)
+
+
+request_metrics = RequestMetrics()
+
+
+def render_metrics():
+    """Everything /api/metrics exports, in the Prometheus text format."""
+    lines = request_metrics.render()
+
+    cache = get_document_cache().stats()
+    write_family(lines, 'vgetit_company_cache_events_total', 'counter', 'Company document cache lookups and builds', [
+        ({'event': event}, cache[event]) for event in ('local_hits', 'shared_hits', 'misses', 'builds', 'waits', 'errors')
+    ])
+    write_family(lines, 'vgetit_company_cache_hit_ratio', 'gauge',
+                 'Share of company document lookups answered from cache', [({}, cache['hit_ratio'])])
+
+    lanes = TaskQueue.objects.lane_metrics()
+    for key, help_text in (
+        ('pending', 'Tasks waiting to be claimed'),
+        ('processing', 'Tasks claimed and running'),
+        ('retrying', 'Failed tasks waiting for their retry'),
+        ('dead', 'Tasks that gave up'),
+        ('oldest_pending_seconds', 'Age of the oldest waiting task'),
+        ('wait_p95', 'p95 seconds from enqueue to start over the last hour'),
+        ('time_to_result_p50', 'p50 seconds from enqueue to result over the last hour'),
+        ('time_to_result_p95', 'p95 seconds from enqueue to result over the last hour'),
+    ):
+        write_family(lines, f'vgetit_task_queue_{key}', 'gauge', help_text,
+                     [({'lane': lane}, values[key]) for lane, values in lanes.items()])
+
+    pools = get_worker_metrics().collect('browser_pool')
+    for key, kind, help_text in BROWSER_POOL_METRICS:
+        metric = f'vgetit_browser_pool_{key}' + ('_total' if kind == 'counter' else '')
+        write_family(lines, metric, kind, help_text,
+                     [({'worker': worker}, values.get(key)) for worker, values in sorted(pools.items())])
+
+    stages = TaskQueue.objects.stage_metrics()
+    write_family(lines, 'vgetit_scrape_stage_seconds', 'summary',
+                 'Wall time of each scrape stage over the scrapes started in the last hour', [
+                     ({'stage': stage, 'quantile': quantile}, stats[key])
+                     for stage, stats in stages.items() for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'))
+                 ])
+    for stage, stats in stages.items():
+        lines.append(f'vgetit_scrape_stage_seconds_sum{{stage="{escape(stage)}"}} {stats["sum"]:g}')
+        lines.append(f'vgetit_scrape_stage_seconds_count{{stage="{escape(stage)}"}} {stats["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,47 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from api.metrics import counting_queries, request_metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Records every request's wall time, query count, query time and response
+    size under its resolved view name (see api.metrics), and logs requests
+    that run more queries than METRICS_QUERY_BUDGET. Goes first in
+    MIDDLEWARE so the time covers the whole stack. Streaming responses are
+    timed to their first byte and have no size.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with counting_queries() as counter:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with counting_queries() as counter:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, counter)
+        return response
+
+    def record(self, request, response, duration, counter):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        size = None if response.streaming else len(response.content)
+        over_budget = request_metrics.record(
+            view, response.status_code, duration, queries=counter.count, db_seconds=counter.seconds, size=size,
+        )
+        if over_budget:
+            print(f"Query budget exceeded: {request.method} {request.path} ({view}) ran {counter.count} queries "
+                  f"in {counter.seconds * 1000:.0f} ms, budget {request_metrics.query_budget}")
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_taskqueue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['company', '-created_at', 'id'], name='comment_company_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['-score', 'id'], name='company_score_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['-last_updated', 'id'], name='company_updated_id_idx'),
+        ),
+    ]
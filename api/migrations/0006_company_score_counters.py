@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_score_counters(apps, schema_editor):
+    # Stored scores are already correct, only their inputs need backfilling.
+    Company = apps.get_model('api', 'Company')
+    Address = apps.get_model('api', 'Address')
+    Comment = apps.get_model('api', 'Comment')
+    PhoneNumber = apps.get_model('api', 'PhoneNumber')
+    Contacts = apps.get_model('api', 'Contacts')
+
+    def related(model, aggregate, **filters):
+        rows = model.objects.filter(company=OuterRef('pk'), **filters).order_by()
+        return Coalesce(Subquery(rows.values('company').annotate(value=aggregate).values('value')), 0)
+
+    Company.objects.update(
+        rating_sum=related(Comment, Sum('rating')),
+        rating_count=related(Comment, Count('pk')),
+        verified_phone_count=related(PhoneNumber, Count('pk'), verified=True),
+        verified_contact_count=related(Contacts, Count('pk'), verified_profile=True),
+        address_verified=Coalesce(
+            Subquery(Address.objects.filter(pk=OuterRef('address_id')).values('verified')[:1]),
+            Value(False),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='address_verified',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='verified_contact_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='verified_phone_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_score_counters, migrations.RunPython.noop),
+    ]
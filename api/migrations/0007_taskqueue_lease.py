@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_company_score_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskqueue',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
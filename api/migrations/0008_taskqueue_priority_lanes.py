@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:33
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_enqueued_at(apps, schema_editor):
+    TaskQueue = apps.get_model('api', 'TaskQueue')
+    TaskQueue.objects.update(enqueued_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_taskqueue_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskqueue',
+            name='enqueued_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='taskqueue',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='taskqueue',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Interactive'), (1, 'Refresh'), (2, 'Backfill')], default=0),
+        ),
+        migrations.RunPython(backfill_enqueued_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='taskqueue',
+            index=models.Index(fields=['status', 'priority', 'created_at'], name='taskqueue_lane_idx'),
+        ),
+    ]
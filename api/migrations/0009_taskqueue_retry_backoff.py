@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_taskqueue_priority_lanes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskqueue',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='taskqueue',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('dead', 'Dead')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='taskqueue',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='taskqueue_retry_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_taskqueue_retry_backoff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NegativeResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=255, unique=True)),
+                ('reason', models.TextField(blank=True)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,187 @@
+import re
+from django.db import migrations, models
+from django.db.models import Case, Count, DecimalField, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Least, Round
+from django.db.models.lookups import GreaterThan
+
+BATCH_SIZE = 2000
+
+# Which duplicate task survives a merge: the one furthest from being done with
+TASK_STATUS_RANK = {'processing': 0, 'pending': 1, 'failed': 2, 'completed': 3, 'dead': 4}
+
+
+# Copies of api.utils.normalize_domain and api.models.score_expression as they
+# were when this migration was written, so later changes to either can't
+# change what it does.
+
+def normalize_domain(url):
+    if not url:
+        return ""
+    host = url.strip().lower()
+    host = re.sub(r'^[a-z][a-z0-9+.-]*://', '', host)
+    host = re.split(r'[/?#]', host, maxsplit=1)[0]
+    host = host.rsplit('@', 1)[-1]
+    host = host.split(':', 1)[0].rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def score_expression(rating_sum, rating_count, verified_phone_count, verified_contact_count, address_verified):
+    def flag(condition):
+        return Case(When(condition, then=Value(1.0)), default=Value(0.0), output_field=FloatField())
+
+    average_rating = Case(
+        When(GreaterThan(rating_count, 0), then=Cast(rating_sum, FloatField()) / Cast(rating_count, FloatField())),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    total = (
+        flag(address_verified)
+        + flag(GreaterThan(verified_phone_count, 0))
+        + flag(GreaterThan(verified_contact_count, 0))
+        + average_rating * Value(0.4)
+    )
+    capped = Least(total, Value(5.0), output_field=FloatField())
+    return Cast(Round(Cast(capped, DecimalField(max_digits=6, decimal_places=3)), 1), FloatField())
+
+
+def fill_domains(model):
+    batch = []
+    for pk, url in model.objects.values_list('pk', 'url').iterator(chunk_size=BATCH_SIZE):
+        # Rows without a usable host keep a key of their own instead of colliding on ''
+        batch.append(model(pk=pk, domain=normalize_domain(url) or f'#{pk}'))
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_update(batch, ['domain'])
+            batch = []
+    model.objects.bulk_update(batch, ['domain'])
+
+
+def duplicate_groups(model, fields, order_by):
+    """Rows sharing a domain, grouped, in order of preference: {domain: [row, ...]}."""
+    domains = (
+        model.objects.values('domain').annotate(rows=Count('pk')).filter(rows__gt=1).values('domain')
+    )
+    groups = {}
+    for row in model.objects.filter(domain__in=domains).order_by('domain', *order_by).values(*fields):
+        groups.setdefault(row['domain'], []).append(row)
+    return groups
+
+
+def merge_companies(apps):
+    """
+    Keeps one company per domain: the processed one, else the most recently
+    updated. Comments move to the survivor (a user with comments on several
+    duplicates keeps the newest); the other duplicates, with their own phone
+    numbers, contacts and addresses, are deleted.
+    """
+    Address = apps.get_model('api', 'Address')
+    Company = apps.get_model('api', 'Company')
+    Comment = apps.get_model('api', 'Comment')
+    PhoneNumber = apps.get_model('api', 'PhoneNumber')
+    Contacts = apps.get_model('api', 'Contacts')
+
+    groups = duplicate_groups(Company, ['id', 'domain', 'address_id'], ['-is_processed', '-last_updated', 'id'])
+    survivor_of = {}
+    loser_addresses = []
+    for rows in groups.values():
+        for row in rows[1:]:
+            survivor_of[row['id']] = rows[0]['id']
+            if row['address_id']:
+                loser_addresses.append(row['address_id'])
+    if not survivor_of:
+        return
+
+    kept = {}
+    superseded = []
+    comments = Comment.objects.filter(
+        company_id__in=[*survivor_of, *set(survivor_of.values())]
+    ).order_by('-created_at', '-id').values_list('id', 'company_id', 'user_id')
+    for comment_id, company_id, user_id in comments.iterator(chunk_size=BATCH_SIZE):
+        key = (survivor_of.get(company_id, company_id), user_id)
+        if key in kept:
+            superseded.append(comment_id)
+        else:
+            kept[key] = (comment_id, company_id)
+    for start in range(0, len(superseded), BATCH_SIZE):
+        Comment.objects.filter(id__in=superseded[start:start + BATCH_SIZE]).delete()
+    Comment.objects.bulk_update(
+        [
+            Comment(id=comment_id, company_id=survivor_of[company_id])
+            for comment_id, company_id in kept.values() if company_id in survivor_of
+        ],
+        ['company'],
+        batch_size=BATCH_SIZE,
+    )
+
+    losers = list(survivor_of)
+    for start in range(0, len(losers), BATCH_SIZE):
+        chunk = losers[start:start + BATCH_SIZE]
+        PhoneNumber.objects.filter(company_id__in=chunk).delete()
+        Contacts.objects.filter(company_id__in=chunk).delete()
+        Company.objects.filter(id__in=chunk).delete()
+    for start in range(0, len(loser_addresses), BATCH_SIZE):
+        Address.objects.filter(id__in=loser_addresses[start:start + BATCH_SIZE]).delete()
+
+    # Signals don't run here, so rebuild the survivors' score counters and scores
+    def related(model, aggregate, **filters):
+        rows = model.objects.filter(company=OuterRef('pk'), **filters).order_by()
+        return Coalesce(Subquery(rows.values('company').annotate(value=aggregate).values('value')), 0)
+
+    survivors = Company.objects.filter(id__in=set(survivor_of.values()))
+    survivors.update(
+        rating_sum=related(Comment, Sum('rating')),
+        rating_count=related(Comment, Count('pk')),
+        verified_phone_count=related(PhoneNumber, Count('pk'), verified=True),
+        verified_contact_count=related(Contacts, Count('pk'), verified_profile=True),
+    )
+    survivors.update(score=score_expression(
+        F('rating_sum'), F('rating_count'), F('verified_phone_count'), F('verified_contact_count'),
+        Q(address_verified=True),
+    ))
+
+
+def merge_tasks(apps):
+    """Keeps one task per domain, the least finished one, in the most urgent lane of the group."""
+    TaskQueue = apps.get_model('api', 'TaskQueue')
+
+    groups = duplicate_groups(TaskQueue, ['id', 'domain', 'status', 'priority', 'updated_at'], ['-updated_at', 'id'])
+    losers = []
+    for rows in groups.values():
+        rows.sort(key=lambda row: TASK_STATUS_RANK.get(row['status'], len(TASK_STATUS_RANK)))
+        losers.extend(row['id'] for row in rows[1:])
+        TaskQueue.objects.filter(id=rows[0]['id']).update(priority=min(row['priority'] for row in rows))
+    for start in range(0, len(losers), BATCH_SIZE):
+        TaskQueue.objects.filter(id__in=losers[start:start + BATCH_SIZE]).delete()
+
+
+def merge_duplicate_domains(apps, schema_editor):
+    Company = apps.get_model('api', 'Company')
+    TaskQueue = apps.get_model('api', 'TaskQueue')
+    fill_domains(Company)
+    fill_domains(TaskQueue)
+    merge_companies(apps)
+    merge_tasks(apps)
+
+
+class Migration(migrations.Migration):
+    # The unique constraints are added by 0012, in a transaction of their own:
+    # PostgreSQL refuses to ALTER a table with pending deferred FK checks.
+
+    dependencies = [
+        ('api', '0010_negativeresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='domain',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='taskqueue',
+            name='domain',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(merge_duplicate_domains, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_domain_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='company',
+            name='domain',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='company',
+            name='url',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='taskqueue',
+            name='domain',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='taskqueue',
+            name='url',
+            field=models.CharField(max_length=255),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_comment_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(condition=models.Q(('is_processed', True)), fields=['-last_updated', 'id'], name='company_processed_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskqueue',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['priority', 'created_at'], name='taskqueue_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskqueue',
+            index=models.Index(fields=['priority', '-last_executed_at'], name='taskqueue_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskqueue',
+            index=models.Index(condition=models.Q(('status', 'completed')), fields=['priority', '-finished_at'], name='taskqueue_completed_idx'),
+        ),
+    ]
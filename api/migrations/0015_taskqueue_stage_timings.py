@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskqueue',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
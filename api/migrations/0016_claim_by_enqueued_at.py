@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_taskqueue_stage_timings'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='taskqueue',
+            name='taskqueue_lane_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='taskqueue',
+            name='taskqueue_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='taskqueue',
+            index=models.Index(fields=['status', 'priority', 'enqueued_at', 'id'], name='taskqueue_lane_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskqueue',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['priority', 'enqueued_at', 'id'], name='taskqueue_pending_idx'),
+        ),
+    ]
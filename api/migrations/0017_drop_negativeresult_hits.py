@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:26
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_claim_by_enqueued_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='negativeresult',
+            name='hits',
+        ),
+    ]
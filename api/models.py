@@ -1,74 +1,280 @@
-from django.db import models
-from django.utils.text import slugify
+import random
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db.models import Avg
+from django.db.models import Case, Count, F, FloatField, DecimalField, Min, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Least, Round
+from django.db.models.lookups import GreaterThan
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from api.utils import custom_slugify
-import phonenumbers
+from django.utils import timezone
+from api.company_cache import get_document_cache
+from api.phone_validation import validate_phone_numbers
+from api.utils import custom_slugify, normalize_domain, percentile, stage_summary
+
+# How long a claimed task may run before another dispatcher may take it over
+TASK_QUEUE_LEASE_SECONDS = getattr(settings, 'TASK_QUEUE_LEASE_SECONDS', 35 * 60)
+# How long a domain BuiltWith had nothing for is answered as not found without scraping
+NEGATIVE_RESULT_TTL_SECONDS = getattr(settings, 'NEGATIVE_RESULT_TTL_SECONDS', 7 * 24 * 60 * 60)
+# Relative share of dispatches each lane gets while several have work waiting
+TASK_QUEUE_LANE_WEIGHTS = getattr(settings, 'TASK_QUEUE_LANE_WEIGHTS', {'interactive': 8, 'refresh': 2, 'backfill': 1})
 
 class Address(models.Model):
     address = models.TextField(blank=True, null=True)
     verified = models.BooleanField(default=False)
 
+# Denormalized inputs of Company.score, maintained by the signal receivers below
+SCORE_COUNTERS = ('rating_sum', 'rating_count', 'verified_phone_count', 'verified_contact_count', 'address_verified')
+# Only ever written by update_score_counters and refresh_scores, never by Company.save()
+SCORE_FIELDS = (*SCORE_COUNTERS, 'score')
+
+def score_expression(rating_sum, rating_count, verified_phone_count, verified_contact_count, address_verified):
+    """
+    SQL expression for the company score, built from the counter expressions
+    given: one point each for a verified address, phone number and employee,
+    plus 0.4 x the average rating, capped at 5 and rounded to one decimal.
+    """
+    def flag(condition):
+        return Case(When(condition, then=Value(1.0)), default=Value(0.0), output_field=FloatField())
+
+    average_rating = Case(
+        When(GreaterThan(rating_count, 0), then=Cast(rating_sum, FloatField()) / Cast(rating_count, FloatField())),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    total = (
+        flag(address_verified)
+        + flag(GreaterThan(verified_phone_count, 0))
+        + flag(GreaterThan(verified_contact_count, 0))
+        + average_rating * Value(0.4)
+    )
+    capped = Least(total, Value(5.0), output_field=FloatField())
+    return Cast(Round(Cast(capped, DecimalField(max_digits=6, decimal_places=3)), 1), FloatField())
+
+class CompanyQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Loads everything CompanySerializer reads, so serializing any number of
+        companies costs a constant number of queries.
+        """
+        return self.select_related('address').prefetch_related(
+            'contacts',
+            'phone_numbers',
+            Prefetch('comments', queryset=Comment.objects.select_related('user')),
+        )
+
+    def for_url(self, url):
+        """Companies for the URL's canonical domain; every variant of a URL finds the same row."""
+        return self.filter(domain=normalize_domain(url))
+
+    def get_or_create_placeholder(self, url, name):
+        """
+        Returns (company, created) for the URL's domain, inserting an
+        unprocessed placeholder when there is none. The insert is a single
+        INSERT ... ON CONFLICT (domain) DO NOTHING RETURNING, so among any
+        number of concurrent callers exactly one gets created=True and the
+        rest read the row it inserted.
+        """
+        domain = normalize_domain(url)
+        connection = connections[self.db]
+        meta = self.model._meta
+        fields = [field for field in meta.concrete_fields if not field.primary_key]
+        for _ in range(5):
+            company = self.model(url=url, domain=domain, name=name, is_processed=False)
+            company.slug = available_slug(custom_slugify(url))
+            values = [field.get_db_prep_save(field.pre_save(company, add=True), connection) for field in fields]
+            try:
+                with transaction.atomic(using=self.db), connection.cursor() as cursor:
+                    cursor.execute(
+                        f"INSERT INTO {connection.ops.quote_name(meta.db_table)} "
+                        f"({', '.join(connection.ops.quote_name(field.column) for field in fields)}) "
+                        f"VALUES ({', '.join(['%s'] * len(fields))}) "
+                        f"ON CONFLICT ({connection.ops.quote_name(meta.get_field('domain').column)}) DO NOTHING "
+                        f"RETURNING {connection.ops.quote_name(meta.pk.column)}",
+                        values,
+                    )
+                    row = cursor.fetchone()
+            except IntegrityError:
+                continue  # Another domain took the slug in the meantime; pick the next free one
+            if row:
+                company.pk = row[0]
+                company._state.adding = False
+                company._state.db = self.db
+                invalidate_company_documents(slugs=[company.slug])  # Inserted without signals
+                return company, True
+            return self.get(domain=domain), False
+        raise IntegrityError(f'Could not find a free slug for {url}')
+
+    def update_score_counters(self, **counters):
+        """
+        Sets the given score counters (values or expressions such as
+        F('rating_count') + 1) and re-derives the score from the new values in
+        the same UPDATE, so no aggregate over related rows is needed. Moves
+        last_updated too, which the ETag and Last-Modified are derived from.
+        """
+        inputs = {name: counters.get(name, F(name)) for name in SCORE_COUNTERS}
+        if 'address_verified' not in counters:
+            inputs['address_verified'] = Q(address_verified=True)
+        elif isinstance(counters['address_verified'], bool):
+            inputs['address_verified'] = Value(counters['address_verified'])
+        return self.update(**counters, score=score_expression(**inputs), last_updated=timezone.now())
+
+    def refresh_scores(self):
+        """
+        Rebuilds the score counters of every company in the queryset from its
+        related rows with set-based UPDATEs, then re-derives the scores.
+        """
+        def related(model, aggregate, **filters):
+            rows = model.objects.filter(company=OuterRef('pk'), **filters).order_by()
+            return Coalesce(Subquery(rows.values('company').annotate(value=aggregate).values('value')), 0)
+
+        self.update(
+            rating_sum=related(Comment, Sum('rating')),
+            rating_count=related(Comment, Count('pk')),
+            verified_phone_count=related(PhoneNumber, Count('pk'), verified=True),
+            verified_contact_count=related(Contacts, Count('pk'), verified_profile=True),
+            address_verified=Coalesce(
+                Subquery(Address.objects.filter(pk=OuterRef('address_id')).values('verified')[:1]),
+                Value(False),
+            ),
+        )
+        updated = self.update_score_counters()
+        invalidate_company_documents(slugs=self.values_list('slug', flat=True))
+        return updated
+
 class Company(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255, blank=False)
     about = models.CharField(blank=True)
     address = models.OneToOneField(Address, on_delete=models.CASCADE, blank=True, null=True)
     slug = models.SlugField(max_length=100, unique=True, db_index=True)
-    url = models.CharField(max_length=100, unique=True)
+    url = models.CharField(max_length=100)
+    domain = models.CharField(max_length=255, unique=True)  # normalize_domain(url), the identity of a company
     is_processed = models.BooleanField(default=False)
     social_urls = models.TextField(blank=True, null=True)
     score = models.FloatField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    verified_phone_count = models.IntegerField(default=0)
+    verified_contact_count = models.IntegerField(default=0)
+    address_verified = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    objects = CompanyQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination orderings, see api.pagination.CompanyPagination
+            models.Index(fields=['-score', 'id'], name='company_score_id_idx'),
+            models.Index(fields=['-last_updated', 'id'], name='company_updated_id_idx'),
+            # Recently processed companies (CompanyViewSet.recent_companies), skipping placeholders
+            models.Index(
+                fields=['-last_updated', 'id'], condition=Q(is_processed=True), name='company_processed_updated_idx',
+            ),
+        ]
+
     def verify_phone_numbers(self):
-        numbers = self.phone_numbers.all()
-        for number in numbers:
-            try:
-                parsed = phonenumbers.parse(number.number)
-                if phonenumbers.is_valid_number(parsed):
-                    number.verified = True
-                else:
-                    number.verified = False
-            except phonenumbers.NumberParseException:
-                number.verified = False
+        numbers = list(self.phone_numbers.all())
+        verdicts = validate_phone_numbers([number.number for number in numbers])
+        for number, is_valid in zip(numbers, verdicts):
+            number.verified = is_valid
     
     def calculate_and_save_score(self):
-        verification_score = 0
-        
-        if self.address and self.address.verified:
-            verification_score += 1.0
-            
-        if self.phone_numbers.filter(verified=True).exists():
-            verification_score += 1.0
-
-        if self.contacts.filter(verified_profile=True).exists():
-            verification_score += 1.0
-            
-    
-        avg_rating = self.comments.aggregate(Avg('rating'))['rating__avg'] or 0
-        final_score = verification_score + (float(avg_rating) * 0.4)
-        self.score = round(min(final_score, 5.0), 1)
-        self.save(update_fields=['score'])
+        """Rebuilds this company's score counters from its related rows and re-derives the score."""
+        Company.objects.filter(pk=self.pk).refresh_scores()
+        self.refresh_from_db(fields=['score', *SCORE_COUNTERS])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'address_id' in field_names:  # Not when deferred, which would cost a query
+            instance._saved_address_id = instance.address_id
+        return instance
 
     def save(self, *args, **kwargs):
+        """
+        Updates of an existing row leave SCORE_FIELDS out: the counters move by
+        F() deltas in the database, and this copy of them may be stale. Naming
+        one in update_fields is an error; an instance loaded with deferred
+        fields saves just its loaded fields, as usual. A new address rebuilds
+        the score instead.
+        """
+        self.domain = normalize_domain(self.url)
         if not self.slug and self.url:
-            self.slug = custom_slugify(self.url)
-            original_slug = self.slug
-            i = 1
-            while Company.objects.filter(slug=self.slug).exclude(id=self.id).exists():
-                self.slug = f"{original_slug}-{i}"
-                i += 1
+            self.slug = available_slug(custom_slugify(self.url), exclude_id=self.id)
+        if self.address_id is None:
+            self.address_verified = False
+        elif Company.address.is_cached(self):
+            self.address_verified = self.address.verified
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            score_fields = [name for name in update_fields if name in SCORE_FIELDS]
+            if score_fields:
+                raise ValueError(
+                    f'Score fields are maintained by the database and cannot be saved: {", ".join(score_fields)}'
+                )
+        elif not self._state.adding and not kwargs.get('force_insert') and not self.get_deferred_fields():
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in SCORE_FIELDS
+            ]
+        saved_address_id = getattr(self, '_saved_address_id', None if self._state.adding else self.address_id)
+        address_changed = self.address_id != saved_address_id
         super().save(*args, **kwargs)
+        self._saved_address_id = self.address_id
+        if address_changed:
+            refresh_company_scores([self.pk])
+            if not getattr(_deferred_scores, 'depth', 0):
+                self.refresh_from_db(fields=SCORE_FIELDS)
 
     def __str__(self):
         return self.name
     
-class Comment(models.Model):
+def available_slug(base, reserved=(), exclude_id=None):
+    """First of base, base-1, base-2, ... that is neither in reserved nor used by another company."""
+    slug = base
+    i = 1
+    while slug in reserved or Company.objects.filter(slug=slug).exclude(id=exclude_id).exists():
+        slug = f"{base}-{i}"
+        i += 1
+    return slug
+
+class ScoreCountedModel(models.Model):
+    """
+    Base for rows that feed a Company's score counters. SCORE_SOURCES maps
+    each counter to the field whose value the row adds to it, or to None when
+    the row simply counts one. Remembers what the row contributed when it was
+    loaded, so a save or delete can apply the difference to the counters
+    instead of recounting every related row.
+    """
+    SCORE_SOURCES = {}
+
+    class Meta:
+        abstract = True
+
+    def score_contribution(self):
+        return {
+            counter: 1 if source is None else int(getattr(self, source))
+            for counter, source in self.SCORE_SOURCES.items()
+        }
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Reading a deferred source would cost a query per row; saves then recount instead
+        sources = {'company_id', *(source for source in cls.SCORE_SOURCES.values() if source)}
+        if sources.issubset(field_names):
+            instance._saved_contribution = (instance.company_id, instance.score_contribution())
+        return instance
+
+class Comment(ScoreCountedModel):
+    SCORE_SOURCES = {'rating_sum': 'rating', 'rating_count': None}
+
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField(max_length=1000)
@@ -76,21 +282,32 @@ class Comment(models.Model):
         validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
         unique_together = ('company', 'user')
+        indexes = [
+            models.Index(fields=['company', '-created_at', 'id'], name='comment_company_created_idx'),
+            # The company's comment watermark, see api.conditional
+            models.Index(fields=['company', '-updated_at'], name='comment_company_updated_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.company.name} ({self.rating} stars)'
 
-class PhoneNumber(models.Model):
+
+class PhoneNumber(ScoreCountedModel):
+    SCORE_SOURCES = {'verified_phone_count': 'verified'}
+
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='phone_numbers')
     number = models.CharField(max_length=50)
     verified = models.BooleanField(default=False)
     description = models.CharField(max_length=100, blank=True, null=True)
 
-class Contacts(models.Model):
+class Contacts(ScoreCountedModel):
+    SCORE_SOURCES = {'verified_contact_count': 'verified_profile'}
+
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='contacts')
     name = models.CharField(max_length=255)
     verified_profile = models.BooleanField(default=False)
@@ -98,19 +315,146 @@ class Contacts(models.Model):
     google_link = models.CharField(max_length=255)
     linkedin_link = models.CharField(max_length=255)
 
+class TaskQueueQuerySet(models.QuerySet):
+    def claimable(self, now=None):
+        """
+        Pending rows, failed rows whose retry backoff has elapsed, and
+        processing rows whose lease ran out because their worker died.
+        """
+        now = now or timezone.now()
+        return self.filter(
+            Q(status='pending')
+            | Q(status='failed', next_attempt_at__lte=now)
+            | Q(status='processing', lease_expires_at__lt=now)
+        )
+
+    def claim(self, limit=1, lease_seconds=None):
+        """
+        Atomically moves up to `limit` claimable rows to processing and returns
+        them, longest waiting first: by enqueued_at, so a task queued again
+        goes behind the work queued before it. Rows locked by a concurrent
+        claim are skipped rather than waited for (FOR UPDATE SKIP LOCKED), so
+        any number of dispatchers can claim at once without handing out the
+        same row twice. Each claimed row gets a lease; if it is not finished
+        before the lease expires it becomes claimable again.
+        """
+        now = timezone.now()
+        lease = timedelta(seconds=lease_seconds or TASK_QUEUE_LEASE_SECONDS)
+        with transaction.atomic():
+            ids = list(
+                self.claimable(now)
+                .order_by('enqueued_at', 'id')
+                .select_for_update(skip_locked=True)
+                .values_list('id', flat=True)[:limit]
+            )
+            if not ids:
+                return []
+            self.model.objects.filter(id__in=ids).update(
+                status='processing',
+                last_executed_at=now,
+                lease_expires_at=now + lease,
+            )
+        return list(self.model.objects.filter(id__in=ids).order_by('enqueued_at', 'id'))
+
+    def claim_fair(self, lease_seconds=None, weights=None, rng=random):
+        """
+        Claims one task, picking the lane at random in proportion to its
+        weight among the lanes that have claimable work. Interactive lookups
+        get most dispatches without starving refresh or backfill work, and an
+        idle lane's share goes to the others. FIFO within a lane.
+        """
+        weights = weights or TASK_QUEUE_LANE_WEIGHTS
+        lanes = set(self.claimable().order_by('priority').values_list('priority', flat=True).distinct())
+        while lanes:
+            candidates = sorted(lanes)
+            lane = rng.choices(candidates, weights=[weights.get(TaskQueue.lane_name(p), 1) for p in candidates])[0]
+            claimed = self.filter(priority=lane).claim(limit=1, lease_seconds=lease_seconds)
+            if claimed:
+                return claimed
+            lanes.discard(lane)  # Emptied by a concurrent dispatcher
+        return []
+
+    def lane_metrics(self, window=timedelta(hours=1), now=None):
+        """
+        Per-lane queue depth plus wait (enqueue to start) and time-to-result
+        (enqueue to finish) percentiles, in seconds, over tasks that started
+        or finished within `window`.
+        """
+        now = now or timezone.now()
+        since = now - window
+        depths = {
+            (row['priority'], row['status']): row['count']
+            for row in self.order_by().values('priority', 'status').annotate(count=Count('id'))
+        }
+        metrics = {}
+        for priority, label in TaskQueue.PRIORITY_CHOICES:
+            lane = self.filter(priority=priority)
+            oldest = lane.filter(status='pending').aggregate(oldest=Min('enqueued_at'))['oldest']
+            waits = [
+                (started - enqueued).total_seconds()
+                for enqueued, started in lane.filter(last_executed_at__gte=since)
+                .values_list('enqueued_at', 'last_executed_at')
+            ]
+            results = [
+                (finished - enqueued).total_seconds()
+                for enqueued, finished in lane.filter(status='completed', finished_at__gte=since)
+                .values_list('enqueued_at', 'finished_at')
+            ]
+            metrics[TaskQueue.lane_name(priority)] = {
+                'pending': depths.get((priority, 'pending'), 0),
+                'processing': depths.get((priority, 'processing'), 0),
+                'retrying': depths.get((priority, 'failed'), 0),
+                'dead': depths.get((priority, 'dead'), 0),
+                'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else None,
+                'started': len(waits),
+                'wait_p50': percentile(waits, 50),
+                'wait_p95': percentile(waits, 95),
+                'completed': len(results),
+                'time_to_result_p50': percentile(results, 50),
+                'time_to_result_p95': percentile(results, 95),
+            }
+        return metrics
+
+    def stage_metrics(self, window=timedelta(hours=1), now=None):
+        """
+        Per-stage percentiles of the scrapes started within `window`, as
+        stage_summary() returns them. Ranged per lane, like lane_metrics, so
+        it reads taskqueue_started_idx.
+        """
+        since = (now or timezone.now()) - window
+        return stage_summary(
+            self.filter(
+                priority__in=[priority for priority, _ in TaskQueue.PRIORITY_CHOICES],
+                last_executed_at__gte=since,
+            ).values_list('stage_timings', flat=True)
+        )
+
 class TaskQueue(models.Model):
     """
     Model to track scraping tasks in a queue.
     Implements rate limiting between task executions.
+    Tasks wait in priority lanes: user-initiated lookups, refreshes of known
+    companies and bulk backfill.
     """
-    url = models.CharField(max_length=255, unique=True, db_index=True)
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_REFRESH = 1
+    PRIORITY_BACKFILL = 2
+    PRIORITY_CHOICES = [
+        (PRIORITY_INTERACTIVE, 'Interactive'),
+        (PRIORITY_REFRESH, 'Refresh'),
+        (PRIORITY_BACKFILL, 'Backfill'),
+    ]
+
+    url = models.CharField(max_length=255)  # Passed to the scraper
+    domain = models.CharField(max_length=255, unique=True)  # normalize_domain(url); one task per company
     status = models.CharField(
         max_length=20,
         choices=[
             ('pending', 'Pending'),
             ('processing', 'Processing'),
             ('completed', 'Completed'),
-            ('failed', 'Failed'),
+            ('failed', 'Failed'),  # Waiting for next_attempt_at to retry
+            ('dead', 'Dead'),  # Gave up: permanent error or out of attempts
         ],
         default='pending'
     )
@@ -119,27 +463,231 @@ class TaskQueue(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     retry_count = models.IntegerField(default=0)
     error_message = models.TextField(blank=True, null=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_INTERACTIVE)
+    enqueued_at = models.DateTimeField(default=timezone.now)  # Last time the task (re)entered pending
+    finished_at = models.DateTimeField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    stage_timings = models.JSONField(default=dict, blank=True)  # Seconds per stage of the last attempt
+
+    objects = TaskQueueQuerySet.as_manager()
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'enqueued_at', 'id'], name='taskqueue_lane_idx'),
+            models.Index(fields=['status', 'next_attempt_at'], name='taskqueue_retry_idx'),
+            # The dispatcher's FIFO per lane (by enqueued_at, so a requeued task waits its turn again),
+            # over the rows most claims come from
+            models.Index(
+                fields=['priority', 'enqueued_at', 'id'], condition=Q(status='pending'), name='taskqueue_pending_idx',
+            ),
+            # lane_metrics windows: recently started, and recently completed
+            models.Index(fields=['priority', '-last_executed_at'], name='taskqueue_started_idx'),
+            models.Index(
+                fields=['priority', '-finished_at'], condition=Q(status='completed'), name='taskqueue_completed_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.domain = normalize_domain(self.url)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def lane_name(cls, priority):
+        return dict(cls.PRIORITY_CHOICES)[priority].lower()
 
     def __str__(self):
         return f"{self.url} - {self.status}"
 
 
+class NegativeResultQuerySet(models.QuerySet):
+    def active(self, now=None):
+        return self.filter(expires_at__gt=now or timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+    def lookup(self, url):
+        """The unexpired entry for the URL's domain, or None. A read only, so hot domains cost no writes."""
+        return self.active().filter(domain=normalize_domain(url)).first()
+
+    def remember(self, url, reason='', ttl_seconds=None):
+        """Caches that the URL's domain has no data, for `ttl_seconds` from now."""
+        now = timezone.now()
+        entry, _ = self.update_or_create(
+            domain=normalize_domain(url),
+            defaults={
+                'reason': reason,
+                'created_at': now,
+                'expires_at': now + timedelta(seconds=ttl_seconds or NEGATIVE_RESULT_TTL_SECONDS),
+            },
+        )
+        return entry
+
+    def forget(self, urls):
+        return self.filter(domain__in={normalize_domain(url) for url in urls}).delete()[0]
+
+class NegativeResult(models.Model):
+    """
+    Domains a scrape found no company for. Until the entry expires, searches
+    for the domain are answered as not found instead of queuing another scrape.
+    """
+    domain = models.CharField(max_length=255, unique=True)
+    reason = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = NegativeResultQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.domain
+
+    def is_active(self):
+        return self.expires_at > timezone.now()
+    is_active.boolean = True
+
+
+_deferred_scores = threading.local()
+
+@contextmanager
+def deferred_score_updates():
+    """
+    Defers score maintenance for the current thread. While active, changes to
+    comments, phone numbers, contacts and addresses only record the affected
+    company ids; on exit those companies are rebuilt once with set-based
+    UPDATEs. Nests, and works as a decorator. When the block raises, nothing
+    is rebuilt: its changes are usually being rolled back, and on PostgreSQL
+    any write would fail and hide the original error.
+    """
+    state = _deferred_scores
+    if not getattr(state, 'depth', 0):
+        state.company_ids = set()
+    state.depth = getattr(state, 'depth', 0) + 1
+    try:
+        yield
+    except BaseException:
+        state.depth -= 1
+        if not state.depth:
+            state.company_ids = set()
+        raise
+    else:
+        state.depth -= 1
+        if not state.depth:
+            company_ids, state.company_ids = state.company_ids, set()
+            # Nothing can be written inside a transaction that is already failing
+            if company_ids and not transaction.get_connection().needs_rollback:
+                refresh_company_scores(company_ids)
+
+def refresh_company_scores(company_ids, batch_size=5000):
+    """Rebuilds the given companies' scores now, or on exit when updates are deferred."""
+    if getattr(_deferred_scores, 'depth', 0):
+        _deferred_scores.company_ids.update(company_ids)
+        return
+    company_ids = sorted(company_ids)
+    for start in range(0, len(company_ids), batch_size):
+        Company.objects.filter(pk__in=company_ids[start:start + batch_size]).refresh_scores()
+
+def invalidate_company_documents(company_ids=(), slugs=()):
+    """
+    Makes the cached documents of the given companies stale. Company ids are
+    resolved to slugs with a query, or just recorded while score updates are
+    deferred, since the rebuild on exit invalidates them anyway.
+    """
+    slugs = set(slugs)
+    company_ids = {company_id for company_id in company_ids if company_id}
+    if company_ids and getattr(_deferred_scores, 'depth', 0):
+        _deferred_scores.company_ids.update(company_ids)
+    elif company_ids:
+        slugs.update(Company.objects.filter(pk__in=company_ids).values_list('slug', flat=True))
+    if not slugs:
+        return
+    cache = get_document_cache()
+    cache.invalidate(slugs)
+    if transaction.get_connection().in_atomic_block:
+        # A reader may cache the old rows again before this commits; bump once more after
+        transaction.on_commit(lambda: cache.invalidate(slugs))
+
+def related_company_slugs(instance):
+    """The instance's company slug when the company is already loaded, saving a query."""
+    if type(instance).company.is_cached(instance) and instance.company is not None:
+        return [instance.company.slug]
+    return []
+
+def apply_score_contribution(company_id, contribution, sign=1):
+    """
+    Moves the company's counters by the contribution. A change that moves
+    none (a new description, say) still changes the company document, so it
+    moves last_updated alone.
+    """
+    if not company_id:
+        return
+    if getattr(_deferred_scores, 'depth', 0):
+        _deferred_scores.company_ids.add(company_id)
+        return
+    counters = {name: F(name) + sign * value for name, value in contribution.items() if value}
+    if counters:
+        Company.objects.filter(pk=company_id).update_score_counters(**counters)
+    else:
+        Company.objects.filter(pk=company_id).update(last_updated=timezone.now())
+
+
 @receiver(post_save, sender=Address)
 def update_score_on_address_change(sender, instance, **kwargs):
-    if hasattr(instance, 'company'):
-        instance.company.calculate_and_save_score()
+    companies = Company.objects.filter(address=instance)
+    if getattr(_deferred_scores, 'depth', 0):
+        refresh_company_scores(companies.values_list('pk', flat=True))
+        return
+    companies.update_score_counters(address_verified=instance.verified)
+    invalidate_company_documents(slugs=companies.values_list('slug', flat=True))
 
+@receiver(post_save, sender=Comment)
 @receiver(post_save, sender=PhoneNumber)
+@receiver(post_save, sender=Contacts)
+def update_score_on_related_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_saved_contribution', None)
+    current = (instance.company_id, instance.score_contribution())
+
+    if created:
+        apply_score_contribution(*current)
+    elif previous is None:
+        # Saved over an existing row without loading it first, so the old
+        # contribution is unknown.
+        refresh_company_scores([instance.company_id])
+    elif previous[0] != current[0]:
+        apply_score_contribution(*previous, sign=-1)
+        apply_score_contribution(*current)
+        invalidate_company_documents([previous[0]])
+    else:
+        delta = {name: value - previous[1].get(name, 0) for name, value in current[1].items()}
+        apply_score_contribution(current[0], delta)
+
+    instance._saved_contribution = current
+
+@receiver(post_delete, sender=Comment)
 @receiver(post_delete, sender=PhoneNumber)
-def update_score_on_phone_change(sender, instance, **kwargs):
-    if instance.company:
-        instance.company.calculate_and_save_score()
+@receiver(post_delete, sender=Contacts)
+def update_score_on_related_delete(sender, instance, **kwargs):
+    previous = getattr(instance, '_saved_contribution', None)
+    if previous is None:
+        previous = (instance.company_id, instance.score_contribution())
+    apply_score_contribution(*previous, sign=-1)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_company_document(sender, instance, **kwargs):
+    invalidate_company_documents(slugs=[instance.slug])
 
 @receiver(post_save, sender=Comment)
+@receiver(post_save, sender=PhoneNumber)
+@receiver(post_save, sender=Contacts)
 @receiver(post_delete, sender=Comment)
-def update_score_on_comment_change(sender, instance, **kwargs):
-    if instance.company:
-        instance.company.calculate_and_save_score()
\ No newline at end of file
+@receiver(post_delete, sender=PhoneNumber)
+@receiver(post_delete, sender=Contacts)
+def invalidate_related_company_document(sender, instance, **kwargs):
+    slugs = related_company_slugs(instance)
+    invalidate_company_documents([] if slugs else [instance.company_id], slugs)
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from django.conf import settings
+import redis
+import redis.asyncio
+from api.models import Company
+
+NOTIFY_REDIS_URL = getattr(settings, 'NOTIFY_REDIS_URL', getattr(settings, 'CELERY_BROKER_URL', ''))
+# Longest a client may hold a connection waiting for its company
+COMPANY_EVENTS_TIMEOUT = getattr(settings, 'COMPANY_EVENTS_TIMEOUT', 60)
+# How often waiters re-read the company when there is no Redis to notify them
+COMPANY_EVENTS_POLL_INTERVAL = getattr(settings, 'COMPANY_EVENTS_POLL_INTERVAL', 2)
+
+CHANNEL_PREFIX = 'vgetit:company-events:'
+
+# Company statuses; everything but PROCESSING is final
+PROCESSING = 'processing'
+PROCESSED = 'processed'
+NOT_FOUND = 'not_found'
+
+_publisher = None
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def uses_redis():
+    return NOTIFY_REDIS_URL.startswith(('redis://', 'rediss://', 'unix://'))
+
+
+def publish_company_status(slug, status):
+    """
+    Tells every client waiting on the slug that its scrape ended. Best effort:
+    a lost message only means the waiter answers at its timeout instead.
+    """
+    global _publisher
+    if not slug or not uses_redis():
+        return
+    try:
+        if _publisher is None:
+            _publisher = redis.Redis.from_url(NOTIFY_REDIS_URL)
+        _publisher.publish(CHANNEL_PREFIX + slug, status)
+    except redis.RedisError as e:
+        print(f"Could not publish {status} for {slug}: {e}")
+
+
+async def company_status(slug):
+    is_processed = await Company.objects.filter(slug=slug).values_list('is_processed', flat=True).afirst()
+    if is_processed is None:
+        return NOT_FOUND
+    return PROCESSED if is_processed else PROCESSING
+
+
+class CompanyEventListener:
+    """
+    One Redis pattern subscription per web process, fanned out to every
+    request waiting in it, so a thousand open connections cost one Redis
+    connection rather than a thousand. The subscription runs on a thread
+    and event loop of its own: requests come and go on many loops (one per
+    request under WSGI and async_to_sync), and none of them must own it.
+    """
+
+    def __init__(self, url, subscribe_timeout=5):
+        self.url = url
+        self.subscribe_timeout = subscribe_timeout
+        self.waiters = defaultdict(set)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.loop = None
+        self.task = None
+        self.live = False
+        self.subscribed = threading.Event()
+
+    async def start(self):
+        """Starts the listener thread (once) and returns whether the subscription is live."""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.live = False
+                self.subscribed = threading.Event()
+                self.thread = threading.Thread(target=self.run, name='company-events', daemon=True)
+                self.thread.start()
+            subscribed = self.subscribed
+        if not subscribed.is_set():
+            await asyncio.get_running_loop().run_in_executor(None, subscribed.wait, self.subscribe_timeout)
+        return self.live
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.task = self.loop.create_task(self.listen())
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        """Ends the subscription and waits for the thread to exit."""
+        thread, loop, task = self.thread, self.loop, self.task
+        if thread is None or not thread.is_alive():
+            return
+        if loop is not None and task is not None:
+            loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+
+    async def listen(self):
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.psubscribe(CHANNEL_PREFIX + '*')
+            self.live = True
+            self.subscribed.set()
+            async for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    self.dispatch(message['channel'].decode()[len(CHANNEL_PREFIX):], message['data'].decode())
+        except redis.RedisError as e:
+            print(f"Company event listener stopped: {e}")
+        finally:
+            self.live = False
+            self.subscribed.set()  # Wake start() callers; they see it is not live
+            await pubsub.aclose()
+            await client.aclose()
+
+    def dispatch(self, slug, status):
+        """Wakes the waiters on the slug, each on its own event loop."""
+        with self.lock:
+            futures = self.waiters.pop(slug, ())
+        for future in futures:
+            try:
+                future.get_loop().call_soon_threadsafe(resolve, future, status)
+            except RuntimeError:
+                pass  # Its loop is closed; nobody is waiting any more
+
+    def register(self, slug):
+        future = asyncio.get_running_loop().create_future()
+        with self.lock:
+            self.waiters[slug].add(future)
+        return future
+
+    def unregister(self, slug, future):
+        with self.lock:
+            waiters = self.waiters.get(slug)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self.waiters[slug]
+
+
+def resolve(future, status):
+    if not future.done():
+        future.set_result(status)
+
+
+def get_listener():
+    """Returns the listener shared by every request of this process."""
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                _listener = CompanyEventListener(NOTIFY_REDIS_URL)
+    return _listener
+
+
+async def wait_for_company_status(slug, timeout=COMPANY_EVENTS_TIMEOUT):
+    """
+    Returns the company's status as soon as it is final (processed, or gone
+    because the scrape found nothing), or PROCESSING once `timeout` seconds
+    pass. Notified through Redis pub/sub; without Redis the company is
+    re-read every COMPANY_EVENTS_POLL_INTERVAL seconds instead.
+    """
+    listener = get_listener() if uses_redis() else None
+    if listener and await listener.start():
+        # Registered before reading, so a scrape finishing in between is not missed
+        future = listener.register(slug)
+        try:
+            status = await company_status(slug)
+            if status != PROCESSING:
+                return status
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return PROCESSING
+        finally:
+            listener.unregister(slug, future)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        status = await company_status(slug)
+        remaining = deadline - loop.time()
+        if status != PROCESSING or remaining <= 0:
+            return status
+        await asyncio.sleep(min(COMPANY_EVENTS_POLL_INTERVAL, remaining))
+
+
+async def company_event_stream(slug, timeout=COMPANY_EVENTS_TIMEOUT, heartbeat=15):
+    """
+    Server-Sent Events for one company: comment lines every `heartbeat`
+    seconds to keep proxies from closing the connection, then a single
+    `status` event with the final (or, at `timeout`, still processing) status.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        status = await wait_for_company_status(slug, max(min(heartbeat, remaining), 0))
+        if status != PROCESSING or remaining <= heartbeat:
+            break
+        yield ': keepalive\n\n'
+    yield f'event: status\ndata: {json.dumps({"slug": slug, "status": status})}\n\n'
@@ -0,0 +1,150 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the full ordering tuple.
+
+    DRF's CursorPagination only stores the first ordering field and an offset,
+    so paging through a run of equal values (e.g. thousands of companies with
+    score 0) degrades into an OFFSET scan. Here the cursor holds the values of
+    every ordering field of the boundary row, and each page is a
+    `WHERE (a, b) > (x, y) ORDER BY a, b LIMIT n` index range scan, so a page
+    costs the same however deep the client is. The last field of every
+    ordering must be unique.
+    """
+    orderings = {}
+    default_ordering = None
+    ordering_query_param = 'ordering'
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        self.model = queryset.model
+        values, reverse = self.decode_cursor(request)
+
+        order = [self._flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*order)
+        if values is not None:
+            queryset = queryset.filter(self._seek(order, values))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request):
+        name = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        return self.orderings.get(name, self.orderings[self.default_ordering])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            raw_values = payload['v']
+            reverse = bool(payload.get('r'))
+            if len(raw_values) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, raw_values)
+            ]
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
+        return values, reverse
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _seek(order, values):
+        """
+        Rows strictly after `values` in `order`, expanded as
+        a > x OR (a = x AND b > y) ... with mixed directions. The leading
+        field also gets a plain a >= x bound so the planner can start the
+        index range scan at the cursor instead of filtering from the top.
+        """
+        def after(field, value):
+            return Q(**{f"{field.lstrip('-')}__{'lt' if field.startswith('-') else 'gt'}": value})
+
+        leading = order[0]
+        condition = Q(**{f"{leading.lstrip('-')}__{'lte' if leading.startswith('-') else 'gte'}": values[0]})
+        expanded = Q()
+        for i, (field, value) in enumerate(zip(order, values)):
+            equal = Q(**{f.lstrip('-'): v for f, v in zip(order[:i], values[:i])})
+            expanded |= equal & after(field, value)
+        return condition & expanded
+
+
+class CompanyPagination(KeysetPagination):
+    orderings = {
+        'score': ('-score', 'id'),
+        'recent': ('-last_updated', 'id'),
+    }
+    default_ordering = 'score'
+
+
+class CommentPagination(KeysetPagination):
+    orderings = {
+        'recent': ('-created_at', 'id'),
+    }
+    default_ordering = 'recent'
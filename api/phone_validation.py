@@ -0,0 +1,113 @@
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+import phonenumbers
+
+PHONE_VALIDATION_CACHE_SIZE = getattr(settings, 'PHONE_VALIDATION_CACHE_SIZE', 100_000)
+# Below this many distinct numbers a process pool costs more than it saves
+PHONE_VALIDATION_PARALLEL_THRESHOLD = getattr(settings, 'PHONE_VALIDATION_PARALLEL_THRESHOLD', 20_000)
+PHONE_VALIDATION_PROCESSES = getattr(settings, 'PHONE_VALIDATION_PROCESSES', None)
+CHUNK_SIZE = 2_000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Memoized verdicts, (number, region) -> bool, least recently used first. The
+# same switchboard numbers appear for thousands of companies.
+_verdicts = OrderedDict()
+_verdicts_lock = threading.Lock()
+
+
+def check_phone_number(number, region=None):
+    """
+    Whether phonenumbers parses the number (for the given default region) and
+    considers it valid. Not memoized; see is_valid_phone_number.
+    """
+    try:
+        return phonenumbers.is_valid_number(phonenumbers.parse(number, region))
+    except phonenumbers.NumberParseException:
+        return False
+
+
+def cached_verdicts(keys):
+    """The memoized verdicts among the (number, region) keys."""
+    found = {}
+    with _verdicts_lock:
+        for key in keys:
+            verdict = _verdicts.get(key)
+            if verdict is not None:
+                _verdicts.move_to_end(key)
+                found[key] = verdict
+    return found
+
+
+def remember_verdicts(verdicts):
+    with _verdicts_lock:
+        for key, verdict in verdicts.items():
+            _verdicts[key] = verdict
+            _verdicts.move_to_end(key)
+        while len(_verdicts) > PHONE_VALIDATION_CACHE_SIZE:
+            _verdicts.popitem(last=False)
+
+
+def clear_phone_validation_cache():
+    with _verdicts_lock:
+        _verdicts.clear()
+
+
+def is_valid_phone_number(number, region=None):
+    """check_phone_number, memoized for the PHONE_VALIDATION_CACHE_SIZE most recently used numbers."""
+    key = (number, region)
+    found = cached_verdicts([key])
+    if key in found:
+        return found[key]
+    verdict = check_phone_number(number, region)
+    remember_verdicts({key: verdict})
+    return verdict
+
+
+def _validate_chunk(numbers, region):
+    return [check_phone_number(number, region) for number in numbers]
+
+
+def _get_executor(processes):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=processes)
+        return _executor
+
+
+def validate_phone_numbers(numbers, region=None, processes=PHONE_VALIDATION_PROCESSES):
+    """
+    Validates many numbers at once and returns a list of booleans in input
+    order. Duplicates and memoized numbers are not validated again; when
+    enough new distinct numbers remain they are spread over a process pool
+    in chunks, and their verdicts memoized here. Celery workers are
+    daemonic and cannot fork a pool, so they always validate in-process.
+    """
+    numbers = list(numbers)
+    distinct = list(dict.fromkeys(numbers))
+    cached = cached_verdicts((number, region) for number in distinct)
+    known = {number: verdict for (number, _), verdict in cached.items()}
+    missing = [number for number in distinct if number not in known]
+
+    parallel = (
+        processes != 1
+        and len(missing) >= PHONE_VALIDATION_PARALLEL_THRESHOLD
+        and not multiprocessing.current_process().daemon
+    )
+    if parallel:
+        chunks = [missing[i:i + CHUNK_SIZE] for i in range(0, len(missing), CHUNK_SIZE)]
+        executor = _get_executor(processes)
+        checked = {}
+        for chunk, verdicts in zip(chunks, executor.map(_validate_chunk, chunks, [region] * len(chunks))):
+            checked.update(zip(chunk, verdicts))
+    else:
+        checked = {number: check_phone_number(number, region) for number in missing}
+    remember_verdicts({(number, region): verdict for number, verdict in checked.items()})
+
+    results = {**known, **checked}
+    return [results[number] for number in numbers]
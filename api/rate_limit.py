@@ -0,0 +1,193 @@
+import threading
+import time
+import uuid
+from django.conf import settings
+import redis
+
+# Seconds between scrapes on average, how many may start back to back, and how many may run at once
+SCRAPE_RATE_LIMIT = getattr(settings, 'SCRAPE_RATE_LIMIT', 5)
+SCRAPE_RATE_BURST = getattr(settings, 'SCRAPE_RATE_BURST', 1)
+SCRAPE_MAX_CONCURRENCY = getattr(settings, 'SCRAPE_MAX_CONCURRENCY', 1)
+SCRAPE_RATE_LIMIT_URL = getattr(settings, 'SCRAPE_RATE_LIMIT_URL', getattr(settings, 'CELERY_BROKER_URL', ''))
+# An in-flight slot that is never released (worker killed) frees itself after this long
+SCRAPE_SLOT_LEASE_SECONDS = getattr(settings, 'TASK_QUEUE_LEASE_SECONDS', 35 * 60)
+
+KEY_PREFIX = 'vgetit:scrape-limiter'
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+# KEYS: theoretical arrival time, in-flight zset (member -> lease expiry)
+# ARGV: interval, burst, max in flight, lease, slot
+# Returns {allowed, retry_after}; numbers come back as strings because Redis truncates Lua floats.
+# A retry_after of -1 means every slot is taken: wait for a release rather than the clock.
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_inflight = tonumber(ARGV[3])
+local lease = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if max_inflight > 0 and redis.call('ZCARD', KEYS[2]) >= max_inflight then
+    return {0, '-1'}
+end
+
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+local new_tat = math.max(tat, now) + interval
+local allow_at = new_tat - interval * burst
+if allow_at > now then
+    return {0, tostring(allow_at - now)}
+end
+
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000) + 1000)
+redis.call('ZADD', KEYS[2], now + lease, ARGV[5])
+redis.call('EXPIRE', KEYS[2], math.ceil(lease))
+return {1, '0'}
+"""
+
+# KEYS: as above. ARGV: interval, slot, refund (1 gives the rate token back)
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[2])
+if ARGV[3] == '1' then
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+    tat = math.max(tat - tonumber(ARGV[1]), now)
+    redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000) + 1000)
+end
+return 1
+"""
+
+
+class LocalRateLimiter:
+    """
+    GCRA (a token bucket kept as a single timestamp) plus a cap on in-flight
+    slots, held in process memory. Only correct for a single process, so it
+    is used for tests and brokers without Redis.
+    """
+
+    def __init__(self, interval=SCRAPE_RATE_LIMIT, burst=SCRAPE_RATE_BURST,
+                 max_concurrency=SCRAPE_MAX_CONCURRENCY, lease=SCRAPE_SLOT_LEASE_SECONDS, clock=time.monotonic):
+        self.interval = interval
+        self.burst = max(burst, 1)
+        self.max_concurrency = max_concurrency
+        self.lease = lease
+        self.clock = clock
+        self.tat = 0.0
+        self.in_flight = {}
+        self.wakeup_at = None
+        self.lock = threading.Lock()
+
+    def try_acquire(self, slot):
+        """
+        Returns (allowed, retry_after). retry_after is the number of seconds
+        until the rate allows the next scrape, or None when all slots are in
+        flight and only a release (or an expired lease) frees one.
+        """
+        with self.lock:
+            now = self.clock()
+            self.in_flight = {s: expiry for s, expiry in self.in_flight.items() if expiry > now}
+            if self.max_concurrency > 0 and len(self.in_flight) >= self.max_concurrency:
+                return False, None
+
+            new_tat = max(self.tat, now) + self.interval
+            allow_at = new_tat - self.interval * self.burst
+            if allow_at > now:
+                return False, allow_at - now
+
+            self.tat = new_tat
+            self.in_flight[slot] = now + self.lease
+            return True, 0.0
+
+    def release(self, slot, refund=False):
+        with self.lock:
+            self.in_flight.pop(slot, None)
+            if refund:
+                self.tat = max(self.tat - self.interval, self.clock())
+
+    def claim_wakeup(self, delay):
+        """True if the caller should schedule a dispatch in `delay` seconds; False if one is already due."""
+        with self.lock:
+            now = self.clock()
+            if self.wakeup_at is not None and self.wakeup_at > now:
+                return False
+            self.wakeup_at = now + delay
+            return True
+
+    def clear_wakeup(self):
+        with self.lock:
+            self.wakeup_at = None
+
+
+class RedisRateLimiter:
+    """
+    The same limiter kept in Redis, so every dispatcher in the cluster shares
+    one budget. Each decision is a single Lua script using the Redis clock,
+    which keeps it atomic and immune to skew between hosts.
+    """
+
+    def __init__(self, client, interval=SCRAPE_RATE_LIMIT, burst=SCRAPE_RATE_BURST,
+                 max_concurrency=SCRAPE_MAX_CONCURRENCY, lease=SCRAPE_SLOT_LEASE_SECONDS, prefix=KEY_PREFIX):
+        self.client = client
+        self.interval = interval
+        self.burst = max(burst, 1)
+        self.max_concurrency = max_concurrency
+        self.lease = lease
+        self.keys = [f'{prefix}:tat', f'{prefix}:in-flight']
+        self.wakeup_key = f'{prefix}:wakeup'
+        self.acquire_script = client.register_script(ACQUIRE_SCRIPT)
+        self.release_script = client.register_script(RELEASE_SCRIPT)
+
+    def try_acquire(self, slot):
+        try:
+            allowed, retry_after = self.acquire_script(
+                keys=self.keys,
+                args=[self.interval, self.burst, self.max_concurrency, self.lease, slot],
+            )
+        except redis.RedisError as e:
+            # Failing closed: a broken limiter must not turn into unthrottled scraping
+            print(f"Rate limiter unavailable: {e}")
+            return False, self.interval
+        retry_after = float(retry_after)
+        return bool(int(allowed)), None if retry_after < 0 else retry_after
+
+    def release(self, slot, refund=False):
+        try:
+            self.release_script(keys=self.keys, args=[self.interval, slot, int(refund)])
+        except redis.RedisError as e:
+            print(f"Could not release rate limiter slot {slot}: {e}")
+
+    def claim_wakeup(self, delay):
+        try:
+            return bool(self.client.set(self.wakeup_key, 1, nx=True, px=max(int(delay * 1000), 1)))
+        except redis.RedisError as e:
+            print(f"Could not schedule dispatch: {e}")
+            return False
+
+    def clear_wakeup(self):
+        try:
+            self.client.delete(self.wakeup_key)
+        except redis.RedisError as e:
+            print(f"Could not clear dispatch wakeup: {e}")
+
+
+def new_slot():
+    return uuid.uuid4().hex
+
+
+def get_rate_limiter():
+    """
+    Returns the limiter shared by this process: Redis-backed when the broker
+    is Redis, in-process otherwise.
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if SCRAPE_RATE_LIMIT_URL.startswith(('redis://', 'rediss://', 'unix://')):
+                    _limiter = RedisRateLimiter(redis.Redis.from_url(SCRAPE_RATE_LIMIT_URL))
+                else:
+                    _limiter = LocalRateLimiter()
+    return _limiter
@@ -92,8 +92,8 @@ class CompanySerializer(serializers.ModelSerializer):
         is_address_verified = False
         if obj.address:
             is_address_verified = obj.address.verified
-        is_phone_verified = obj.phone_numbers.filter(verified=True).exists()
-        is_employees_verified = obj.contacts.filter(verified_profile=True).exists()
+        is_phone_verified = obj.verified_phone_count > 0
+        is_employees_verified = obj.verified_contact_count > 0
 
         return {
             "phone": is_phone_verified,
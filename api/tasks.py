@@ -1,170 +1,189 @@
 # scraper/tasks.py
+import random
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
 from django.conf import settings
 from datetime import timedelta
-from api.models import Company, PhoneNumber, Address, Contacts, TaskQueue
-from api.builtwith_scraper import scrape_company_data
-import phonenumbers
+from api.exceptions import PermanentScrapeError, ScrapeError
+from api.models import Company, PhoneNumber, Address, Contacts, NegativeResult, TaskQueue, deferred_score_updates, refresh_company_scores
+from api.notifications import NOT_FOUND, PROCESSED, publish_company_status
+from api.phone_validation import validate_phone_numbers
+from api.rate_limit import get_rate_limiter, new_slot
+from api.utils import StageTimer, normalize_domain
 
-# Get rate limit from settings
-SCRAPE_RATE_LIMIT = getattr(settings, 'SCRAPE_RATE_LIMIT', 5)
+# Retry schedule for failed scrapes: attempt n waits up to base * 2**(n-1) seconds, capped
+TASK_MAX_ATTEMPTS = getattr(settings, 'TASK_MAX_ATTEMPTS', 5)
+TASK_RETRY_BASE_SECONDS = getattr(settings, 'TASK_RETRY_BASE_SECONDS', 60)
+TASK_RETRY_MAX_SECONDS = getattr(settings, 'TASK_RETRY_MAX_SECONDS', 6 * 60 * 60)
 
 @shared_task
-def queue_scrape_company(url):
+def queue_scrape_company(url, priority=TaskQueue.PRIORITY_INTERACTIVE):
     """
-    Queues a company scrape task with rate limiting.
-    If another task is running, adds to queue; otherwise starts immediately.
+    Queues a company scrape task with rate limiting in the given priority lane.
+    Every variant of a URL shares the task of its domain.
+    If the rate limit allows, it is dispatched right away by process_task_queue.
     """
     try:
         # Get or create task in queue
         task_queue, created = TaskQueue.objects.get_or_create(
-            url=url,
-            defaults={'status': 'pending'}
+            domain=normalize_domain(url),
+            defaults={'url': url, 'status': 'pending', 'priority': priority}
         )
-        
-        # Check if we should execute now or queue
-        should_execute = should_execute_next_task()
-        
-        if should_execute:
-            # Execute immediately
-            task_queue.status = 'processing'
-            task_queue.save()
-            scrape_company_task.delay(url)
-        else:
-            # Queue for later (will be picked up by process_task_queue)
-            task_queue.status = 'pending'
-            task_queue.save()
-            
+
+        if not created:
+            # A finished task is queued again in the requested lane, with a fresh attempt budget
+            TaskQueue.objects.filter(
+                pk=task_queue.pk, status__in=['completed', 'dead']
+            ).update(status='pending', priority=priority, enqueued_at=timezone.now(), retry_count=0,
+                     next_attempt_at=None, finished_at=None, lease_expires_at=None)
+            # A waiting task (or one backing off before a retry) moves up if it is now wanted more urgently
+            TaskQueue.objects.filter(
+                pk=task_queue.pk, status__in=['pending', 'failed'], priority__gt=priority
+            ).update(priority=priority)
+
+        dispatch_pending_tasks()
+
     except Exception as e:
         print(f"Error queuing scrape task for {url}: {e}")
 
 @shared_task
-def process_task_queue():
+def process_task_queue(wakeup=False):
     """
     Processes pending tasks from the queue based on rate limit.
-    This should be called periodically (e.g., every 10 seconds via celery beat).
+    Runs when a task is queued or finishes, at the moment the rate limiter
+    said the next slot opens (`wakeup`), and from celery beat as a safety net.
     """
     print("Processing task queue...")
-    # Get pending tasks
-    pending_tasks = TaskQueue.objects.filter(status='pending').order_by('created_at')
-    
-    for task in pending_tasks:
-        if should_execute_next_task():
-            task.status = 'processing'
-            task.save()
-            scrape_company_task.delay(task.url)
-            break  # Only process one at a time
-        else:
-            break  # Wait for rate limit
-
-def should_execute_next_task():
+    if wakeup:
+        get_rate_limiter().clear_wakeup()
+    dispatch_pending_tasks()
+
+def retry_delay(attempt):
+    """Seconds to wait before retrying after the given failed attempt: exponential, capped, jittered."""
+    ceiling = min(TASK_RETRY_MAX_SECONDS, TASK_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    # Half fixed, half random, so failures from one bad minute do not retry in lockstep
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+def is_retryable(error):
     """
-    Check if we should execute the next task based on rate limiting.
-    Returns True if enough time has passed since the last execution.
+    Timeouts, captcha failures and browser errors are worth another attempt.
+    A page that was scraped but has no company on it is not.
     """
-    try:
-        # Get the most recent completed task
-        last_task = TaskQueue.objects.filter(
-            status__in=['completed', 'processing']
-        ).order_by('-last_executed_at').first()
-        
-        if not last_task or not last_task.last_executed_at:
-            return True  # No previous task, execute immediately
-        
-        # Check if enough time has passed
-        time_since_last = timezone.now() - last_task.last_executed_at
-        return time_since_last.total_seconds() >= SCRAPE_RATE_LIMIT
-        
-    except Exception as e:
-        print(f"Error checking rate limit: {e}")
-        return True  # On error, allow execution
+    if isinstance(error, ScrapeError):
+        return error.retryable
+    return True
+
+def dispatch_pending_tasks():
+    """
+    Starts pending tasks, weighted fair across priority lanes and oldest first
+    within one, for as long as the shared rate limiter grants a slot. Claiming is atomic, so concurrent dispatchers never start
+    the same URL twice. When the rate runs out, one dispatch is scheduled for
+    the moment it allows the next scrape; when every slot is in flight, the
+    next finishing scrape triggers dispatch instead.
+    """
+    limiter = get_rate_limiter()
+    while True:
+        slot = new_slot()
+        allowed, retry_after = limiter.try_acquire(slot)
+        if not allowed:
+            # Wait for rate limit
+            if retry_after is not None and limiter.claim_wakeup(retry_after):
+                process_task_queue.apply_async(kwargs={'wakeup': True}, countdown=retry_after)
+            return
+
+        claimed = TaskQueue.objects.claim_fair()
+        if not claimed:
+            limiter.release(slot, refund=True)  # Nothing to do; give the token back
+            return
+
+        scrape_company_task.delay(claimed[0].url, slot=slot)
 
 @shared_task
-def scrape_company_task(url):
+def scrape_company_task(url, slot=None):
     """
     Scrapes company data and updates the company record.
-    If no company name is found, deletes the company entry.
+    Retryable failures are rescheduled with backoff until TASK_MAX_ATTEMPTS;
+    after that, or on a permanent failure such as a missing company name, the
+    task is dead-lettered and the company entry deleted.
+    `slot` is the rate limiter slot the dispatcher acquired for this scrape;
+    it is released when the scrape ends, successful or not.
+    The wall time of each stage is kept in the task's stage_timings.
     """
+    # Imported here so the web process, which only enqueues, never loads
+    # Playwright, torch or transformers.
+    from api.builtwith_scraper import scrape_company_data
+
     task_queue = None
+    timer = StageTimer()
     try:
         # Update task start time
-        task_queue = TaskQueue.objects.get(url=url)
+        task_queue = TaskQueue.objects.get(domain=normalize_domain(url))
         task_queue.last_executed_at = timezone.now()
         task_queue.save()
         
-        result = scrape_company_data(url)
+        result = scrape_company_data(url, timer=timer)
         print(f"Scrape result for {url}: {result}")
         
         # Check if company name was found
-        if not result.get('name') or result.get('name') == '':
-            print(f"Company name is empty for URL {url}, deleting company entry.")
-            Company.objects.filter(url=url).delete()
-            
-            # Mark task as completed
-            task_queue.status = 'completed'
-            task_queue.error_message = 'No company name found'
-            task_queue.save()
-            return
-        
-        # Create address
-        addr = Address.objects.create(address=result.get('address', ''), verified=True)
-        
-        # Get or create company
-        company, created = Company.objects.get_or_create(url=url, defaults={
-            'name': result.get('name', ''),
-            'address': addr,
-            'is_processed': True,
-            'social_urls': result.get('socials', ''),
-        })
-
-        # If company already existed, update it
-        if not created:
-            company.name = result.get('name', '')
-            company.social_urls = result.get('socials', '')
-            company.is_processed = True
-            company.address = addr
-            company.save()
-
-        # Verify and create phone numbers
-        phone_numbers_to_create = []
-        for phone_data in result.get('phone_numbers', []):
-            phone_number = phone_data.get('number', '')
-            description = phone_data.get('description', '')
-
-            is_verified = False
-            try:
-                parsed = phonenumbers.parse(phone_number)
-                if phonenumbers.is_valid_number(parsed):
-                    is_verified = True
-            except phonenumbers.NumberParseException:
-                is_verified = False
-            
-            phone_numbers_to_create.append(
+        if not result or not result.get('name'):
+            raise PermanentScrapeError('No company name found')
+        
+        # One transaction, so readers (and ETags) see the company together with its details
+        with timer.stage('db_write'), transaction.atomic(), deferred_score_updates():
+            # Create address
+            addr = Address.objects.create(address=result.get('address', ''), verified=True)
+        
+            # Get or create company
+            company, created = Company.objects.get_or_create(domain=normalize_domain(url), defaults={
+                'url': url,
+                'name': result.get('name', ''),
+                'address': addr,
+                'is_processed': True,
+                'social_urls': result.get('socials', ''),
+            })
+
+            # If company already existed, update it
+            if not created:
+                company.name = result.get('name', '')
+                company.social_urls = result.get('socials', '')
+                company.is_processed = True
+                company.address = addr
+                company.save()
+
+            # Verify and create phone numbers
+            phone_data = result.get('phone_numbers', [])
+            verdicts = validate_phone_numbers([phone.get('number', '') for phone in phone_data])
+            phone_numbers_to_create = [
                 PhoneNumber(
                     company=company,
-                    number=phone_number,
-                    description=description,
+                    number=phone.get('number', ''),
+                    description=phone.get('description', ''),
                     verified=is_verified
                 )
-            )
+                for phone, is_verified in zip(phone_data, verdicts)
+            ]
         
-        PhoneNumber.objects.bulk_create(phone_numbers_to_create)
-
-        # Create contacts
-        Contacts.objects.bulk_create([
-            Contacts(company=company, **c)
-            for c in result.get('listed_contacts', [])
-        ])
-        company.calculate_and_save_score()
+            PhoneNumber.objects.bulk_create(phone_numbers_to_create)
+
+            # Create contacts
+            Contacts.objects.bulk_create([
+                Contacts(company=company, **c)
+                for c in result.get('listed_contacts', [])
+            ])
+            refresh_company_scores([company.pk])
         
         # Mark task as completed
         task_queue.status = 'completed'
         task_queue.error_message = None
+        task_queue.lease_expires_at = None
+        task_queue.next_attempt_at = None
+        task_queue.finished_at = timezone.now()
+        task_queue.stage_timings = timer.as_dict()
         task_queue.save()
-        
-        # Process next task in queue
-        process_task_queue.delay()
+
+        # Wake clients waiting on /companies/<slug>/events/
+        publish_company_status(company.slug, PROCESSED)
         
         print(f"Successfully processed company data for URL {url}")
 
@@ -173,18 +192,44 @@ def scrape_company_task(url):
         
         # Update task status
         if task_queue:
-            task_queue.status = 'failed'
             task_queue.error_message = str(e)
             task_queue.retry_count += 1
+            task_queue.lease_expires_at = None
+            # How far the attempt got, and how long that took
+            task_queue.stage_timings = timer.as_dict()
+            if is_retryable(e) and task_queue.retry_count < TASK_MAX_ATTEMPTS:
+                # Keep the placeholder company; the user still sees it as processing
+                delay = retry_delay(task_queue.retry_count)
+                task_queue.status = 'failed'
+                task_queue.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+                task_queue.save()
+                process_task_queue.apply_async(countdown=delay)
+                print(f"Retrying {url} in {delay:.0f}s (attempt {task_queue.retry_count + 1} of {TASK_MAX_ATTEMPTS})")
+                return
+
+            task_queue.status = 'dead'
+            task_queue.next_attempt_at = None
+            task_queue.finished_at = timezone.now()
             task_queue.save()
+
+            # Searches for a domain with nothing to scrape are answered from the cache for a while
+            if not is_retryable(e):
+                NegativeResult.objects.remember(url, reason=str(e))
         
-        # Delete the company entry if scraping failed
+        # Delete the company entry if scraping failed for good
         try:
-            Company.objects.filter(url=url).delete()
+            companies = Company.objects.for_url(url)
+            slugs = list(companies.values_list('slug', flat=True))
+            companies.delete()
+            for slug in slugs:
+                publish_company_status(slug, NOT_FOUND)
         except Exception:
             pass
-        
-        # Process next task in queue
+
+    finally:
+        # Free the concurrency slot, then process next task in queue
+        if slot:
+            get_rate_limiter().release(slot)
         process_task_queue.delay()
 
 
@@ -1,3 +1,1278 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from api.models import SCORE_COUNTERS, Address, Company, Comment, Contacts, NegativeResult, PhoneNumber, TaskQueue, deferred_score_updates
+from api import phone_validation
+from api.pagination import CompanyPagination
+from api.phone_validation import clear_phone_validation_cache, is_valid_phone_number, validate_phone_numbers
+from api.rate_limit import LocalRateLimiter
+from api.exceptions import ScrapeError
+from api.importers import BatchImporter, parse_row
+from api.company_cache import CompanyDocumentCache
+from api.metrics import Histogram, RequestMetrics, WorkerMetrics, render_metrics
+from api.notifications import COMPANY_EVENTS_TIMEOUT, CompanyEventListener, wait_for_company_status
+from api.tasks import process_task_queue, queue_scrape_company, retry_delay, scrape_company_task
+from api.utils import StageTimer
 
-# Create your tests here.
+
+def create_company(index, comments=2):
+    address = Address.objects.create(address=f'{index} Main St', verified=True)
+    company = Company.objects.create(
+        name=f'Company {index}',
+        url=f'company{index}.com',
+        address=address,
+        is_processed=True,
+    )
+    PhoneNumber.objects.create(company=company, number='+1 650 253 0000', verified=True)
+    PhoneNumber.objects.create(company=company, number='12345')
+    Contacts.objects.create(company=company, name='Jane Doe', verified_profile=True, level='CEO',
+                            google_link='', linkedin_link='')
+    for i in range(comments):
+        user, _ = User.objects.get_or_create(username=f'user{i}')
+        Comment.objects.create(company=company, user=user, text='Great', rating=4)
+    return company
+
+
+class CompanyQueryCountTests(TestCase):
+    # company (+address, verification flags), contacts, phone numbers, comments (+users)
+    DETAIL_QUERIES = 4
+
+    def setUp(self):
+        self.client = APIClient()
+        self.companies = [create_company(i) for i in range(5)]
+
+    def test_list_query_count_is_constant(self):
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            response = self.client.get('/api/companies/')
+        self.assertEqual(response.status_code, 200)
+
+        create_company(99, comments=4)
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            self.client.get('/api/companies/')
+
+    def test_detail_query_count(self):
+        slug = self.companies[0].slug
+        with self.assertNumQueries(1 + self.DETAIL_QUERIES):  # Validators, then the cold cache build
+            response = self.client.get(f'/api/companies/{slug}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['comments']), 2)
+        self.assertEqual(response.data['comments'][0]['user'], 'user1')
+        self.assertEqual(response.data['verifications'], {'phone': True, 'address': True, 'employees': True})
+
+    def test_get_query_count(self):
+        with self.assertNumQueries(1 + self.DETAIL_QUERIES):
+            response = self.client.get('/api/companies/get/', {'slug': self.companies[1].slug})
+        self.assertEqual(response.data['status'], 'success')
+
+    def test_recent_query_count(self):
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            response = self.client.get('/api/companies/recent/')
+        self.assertEqual(len(response.data), 3)
+
+    def test_search_query_count(self):
+        # Validators and the domain lookup, then the document build on a cold cache
+        with self.assertNumQueries(2 + self.DETAIL_QUERIES):
+            response = self.client.get('/api/companies/search/', {'url': self.companies[2].url})
+        self.assertEqual(response.data['status'], 'success')
+
+        with self.assertNumQueries(2):
+            self.client.get('/api/companies/search/', {'url': self.companies[2].url})
+
+
+class CompanyDocumentCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.company = create_company(1)
+        self.url = f'/api/companies/{self.company.slug}/'
+
+    def test_repeat_reads_skip_the_database(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(2):  # Only the validators
+            second = self.client.get(self.url)
+            got = self.client.get('/api/companies/get/', {'slug': self.company.slug})
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(got.data['company'], first.data)
+
+    def test_related_changes_invalidate(self):
+        self.client.get(self.url)
+        user = User.objects.create(username='critic')
+        Comment.objects.create(company=self.company, user=user, text='Meh', rating=1)
+        self.assertEqual(len(self.client.get(self.url).data['comments']), 3)
+
+        phone = PhoneNumber.objects.get(company=self.company, verified=True)
+        phone.verified = False
+        phone.save()
+        self.assertFalse(self.client.get(self.url).data['verifications']['phone'])
+
+        address = self.company.address
+        address.verified = False
+        address.save()
+        self.assertFalse(self.client.get(self.url).data['verifications']['address'])
+
+        Contacts.objects.filter(company=self.company).delete()
+        self.assertEqual(self.client.get(self.url).data['contacts'], [])
+
+        self.company.about = 'Makes widgets'
+        self.company.save()
+        self.assertEqual(self.client.get(self.url).data['about'], 'Makes widgets')
+
+        self.company.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_concurrent_misses_build_once(self):
+        cache = CompanyDocumentCache()
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.05)
+            return {'slug': 'acme'}
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            documents = list(pool.map(lambda _: cache.get_or_build('acme', build), range(8)))
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(documents, [{'slug': 'acme'}] * 8)
+
+        stats = cache.stats()
+        self.assertEqual((stats['misses'], stats['builds']), (stats['waits'] + 1, 1))
+        cache.get_or_build('acme', build)
+        self.assertEqual(cache.stats()['local_hits'], 1)
+
+    def test_local_tier_is_bounded_and_misses_are_not_cached(self):
+        cache = CompanyDocumentCache(local_size=2)
+        for slug in ('a', 'b', 'c'):
+            cache.get_or_build(slug, lambda: {'slug': slug})
+        self.assertEqual(list(cache.local), ['b', 'c'])
+
+        self.assertIsNone(cache.get_or_build('gone', lambda: None))
+        self.assertNotIn('gone', cache.local)
+        self.assertEqual(cache.stats()['hit_ratio'], 0)
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.company = create_company(1)
+        self.endpoints = [
+            (f'/api/companies/{self.company.slug}/', {}),
+            ('/api/companies/get/', {'slug': self.company.slug}),
+            ('/api/companies/search/', {'url': self.company.url}),
+            (f'/api/companies/{self.company.slug}/comments/', {}),
+        ]
+
+    def test_matching_validators_answer_304_with_one_query(self):
+        for path, params in self.endpoints:
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 200, path)
+            with self.assertNumQueries(1):
+                cached = self.client.get(path, params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(cached.status_code, 304, path)
+            with self.assertNumQueries(1):
+                cached = self.client.get(path, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(cached.status_code, 304, path)
+
+    def test_changes_move_the_etag(self):
+        path = f'/api/companies/{self.company.slug}/comments/'
+        etag = self.client.get(path)['ETag']
+
+        comment = Comment.objects.first()
+        comment.text = 'Changed my mind'  # Same rating, so no counter moves
+        comment.save()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        Comment.objects.filter(pk=comment.pk).delete()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.company.name = 'Renamed'
+        self.company.save()
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_related_edits_without_counter_changes_move_the_etag(self):
+        path = f'/api/companies/{self.company.slug}/'
+        etag = self.client.get(path)['ETag']
+        phone = PhoneNumber.objects.get(company=self.company, verified=True)
+        phone.description = 'Sales'
+        phone.save()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Sales', [phone['description'] for phone in response.data['phone_numbers']])
+
+        etag = response['ETag']
+        address = self.company.address
+        address.address = '2 Main St'
+        address.save()
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unknown_company_has_no_validators(self):
+        response = self.client.get('/api/companies/missing/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+
+class BadgeTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.company = create_company(1, comments=0)  # Score 3.0
+        self.url = f'/api/embed/company/{self.company.slug}/badge.svg'
+
+    def test_svg_badge_is_cached_and_revalidated_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        root = ElementTree.fromstring(response.content)
+        self.assertEqual(root.find('{http://www.w3.org/2000/svg}title').text, 'VGetit trust score: 3.0 out of 5')
+
+        with self.assertNumQueries(0):
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], response['ETag'])
+
+    def test_score_change_regenerates_the_badge(self):
+        etag = self.client.get(self.url)['ETag']
+        Comment.objects.create(company=self.company, user=User.objects.create(username='fan'), text='!', rating=5)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(b'5.0 out of 5', response.content)
+
+    def test_unknown_company(self):
+        response = self.client.get('/api/embed/company/missing/badge.svg')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn(b'not rated', response.content)
+        self.assertNotIn('ETag', response)
+
+    def test_deleted_company_is_not_revalidated(self):
+        placeholder = Company.objects.create(url='pending.com', name='Processing pending.com...')
+        url = f'/api/embed/company/{placeholder.slug}/badge.svg'
+        etag = self.client.get(url)['ETag']  # The unrated badge
+        placeholder.delete()  # The scrape found nothing
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+    @skipUnless(importlib.util.find_spec('PIL'), 'Pillow is not installed')
+    def test_png_badge(self):
+        response = self.client.get(f'/api/embed/company/{self.company.slug}/badge.png')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.company = create_company(1)
+        self.metrics = RequestMetrics(query_budget=3)
+        for target, value in (('api.middleware.request_metrics', self.metrics),
+                              ('api.metrics.request_metrics', self.metrics), ('api.views.METRICS_TOKEN', 's3cret')):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(f'/api/companies/{self.company.slug}/')
+        self.client.get('/api/companies/missing/')
+        response = self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+
+        # Validators plus the four queries building the cold document
+        self.assertIn('vgetit_http_request_db_queries_bucket{view="company-detail",le="5"} 2', text)
+        self.assertIn('vgetit_http_request_db_queries_count{view="company-detail"} 2', text)
+        self.assertIn('vgetit_http_responses_total{view="company-detail",status="404"} 1', text)
+        self.assertIn('vgetit_http_request_duration_seconds_count{view="company-detail"} 2', text)
+        self.assertIn('vgetit_task_queue_pending{lane="interactive"} 0', text)
+        self.assertIn('# TYPE vgetit_company_cache_hit_ratio gauge', text)
+
+    def test_query_budget(self):
+        with mock.patch('builtins.print') as log:
+            self.client.get('/api/companies/recent/')  # Four queries
+        self.assertEqual(self.metrics.over_budget, {'company-recent-companies': 1})
+        self.assertIn('Query budget exceeded', log.call_args.args[0])
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 401)
+        self.assertEqual(self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        with mock.patch('api.views.METRICS_TOKEN', ''):
+            self.assertEqual(self.client.get('/api/metrics').status_code, 404)  # Off until a token is set
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((1, 5))
+        for value in (0, 1, 3, 9):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples()), [(1, 2), (5, 3), ('+Inf', 4)])
+        self.assertEqual(histogram.sum, 13)
+
+
+class CompanyPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        # Equal scores, so only the id tiebreaker keeps pages apart
+        self.companies = [create_company(i, comments=0) for i in range(7)]
+
+    def walk(self, url, params):
+        seen = []
+        response = self.client.get(url, params)
+        while True:
+            seen.extend(c['slug'] for c in response.data['results'])
+            if not response.data['next']:
+                return seen, response
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_every_company_once(self):
+        seen, _ = self.walk('/api/companies/', {'page_size': 3})
+        self.assertEqual(seen, [c.slug for c in sorted(self.companies, key=lambda c: c.id)])
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/api/companies/', {'page_size': 3})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(first.data['previous'])
+
+    def test_recent_ordering(self):
+        seen, _ = self.walk('/api/companies/', {'page_size': 2, 'ordering': 'recent'})
+        expected = Company.objects.order_by('-last_updated', 'id').values_list('slug', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(CompanyPagination, 'max_page_size', 5):
+            response = self.client.get('/api/companies/', {'page_size': 10_000})
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/companies/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CompanyScoreCounterTests(TestCase):
+    def setUp(self):
+        self.company = create_company(1, comments=0)
+        self.user = User.objects.create(username='rater')
+
+    def assertScore(self, expected):
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.score, expected)
+        # The incrementally maintained counters must match a full rebuild
+        counters = {name: getattr(self.company, name) for name in SCORE_COUNTERS}
+        self.company.calculate_and_save_score()
+        self.assertEqual({name: getattr(self.company, name) for name in SCORE_COUNTERS}, counters)
+        self.assertEqual(self.company.score, expected)
+
+    def test_comment_changes_update_score_without_aggregates(self):
+        self.assertScore(3.0)
+        with self.assertNumQueries(2):  # INSERT + one counter UPDATE
+            comment = Comment.objects.create(company=self.company, user=self.user, text='ok', rating=5)
+        self.assertScore(5.0)
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.rating = 1
+        comment.save()
+        self.assertScore(3.4)
+
+        comment.delete()
+        self.assertScore(3.0)
+
+    def test_phone_and_address_changes(self):
+        self.company.phone_numbers.filter(verified=True).delete()
+        self.assertScore(2.0)
+
+        phone = self.company.phone_numbers.get()
+        phone.verified = True
+        phone.save()
+        self.assertScore(3.0)
+
+        address = self.company.address
+        address.verified = False
+        address.save()
+        self.assertScore(2.0)
+
+    def test_saving_a_stale_company_keeps_its_counters(self):
+        stale = Company.objects.get(pk=self.company.pk)
+        comment = Comment.objects.create(company=self.company, user=self.user, text='ok', rating=5)
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertScore(5.0)
+        self.assertEqual((self.company.name, self.company.rating_count, self.company.rating_sum), ('Renamed', 1, 5))
+
+        comment.delete()
+        self.assertScore(3.0)
+
+    def test_score_fields_cannot_be_saved_explicitly(self):
+        self.company.score = 5.0
+        with self.assertRaisesRegex(ValueError, 'score'):
+            self.company.save(update_fields=['name', 'score'])
+        self.company.name = 'Renamed'
+        self.company.save(update_fields=['name'])
+        self.assertScore(3.0)
+        self.assertEqual(self.company.name, 'Renamed')
+
+    def test_saving_a_deferred_company_keeps_its_counters(self):
+        partial = Company.objects.only('name', 'url', 'slug', 'address').get(pk=self.company.pk)
+        Comment.objects.create(company=self.company, user=self.user, text='ok', rating=5)
+        partial.name = 'Renamed'
+        with self.assertNumQueries(1):  # Just the UPDATE, without loading the deferred fields
+            partial.save()
+        self.assertScore(5.0)
+        self.assertEqual(self.company.name, 'Renamed')
+
+    def test_deferred_rows_skip_the_contribution_snapshot(self):
+        Comment.objects.create(company=self.company, user=self.user, text='ok', rating=5)
+        with self.assertNumQueries(1):
+            comments = list(Comment.objects.only('id', 'text'))
+        self.assertFalse(hasattr(comments[0], '_saved_contribution'))
+        # Saved without a snapshot, the company is recounted instead
+        comments[0].rating = 1
+        comments[0].save()
+        self.assertScore(3.4)
+
+    def test_new_address_rescores(self):
+        self.company.address = Address.objects.create(address='Elsewhere', verified=False)
+        self.company.save()
+        self.assertEqual(self.company.score, 2.0)  # Refreshed in place
+        self.assertScore(2.0)
+
+    def test_failed_deferred_block_does_not_rescore(self):
+        # A raw query's error doesn't mark the transaction for rollback; on
+        # PostgreSQL a rebuild would then fail and hide it
+        with self.assertRaisesRegex(DatabaseError, 'missing_table'):
+            with transaction.atomic(), deferred_score_updates():
+                Comment.objects.create(company=self.company, user=self.user, text='ok', rating=5)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT * FROM missing_table')
+        self.assertScore(3.0)
+
+    def test_deferred_updates_rescore_once_on_exit(self):
+        other = create_company(2, comments=0)
+        with CaptureQueriesContext(connection) as queries:
+            with deferred_score_updates():
+                for company in (self.company, other):
+                    company.phone_numbers.all().delete()
+                    for i in range(3):
+                        user = User.objects.create(username=f'{company.slug}-{i}')
+                        Comment.objects.create(company=company, user=user, text='x', rating=5)
+                writes_inside = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "api_company"')]
+        self.assertEqual(writes_inside, [])
+        score_updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "api_company"')]
+        self.assertEqual(len(score_updates), 2)  # counters, then scores, for both companies at once
+        self.assertScore(4.0)
+
+
+class ImportCsvTests(TestCase):
+    HEADER = ['domain', 'name', 'address', 'verified_people_exist', 'phone_numbers', 'socials', 'listed_contacts']
+
+    def write_csv(self, rows):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+        with handle:
+            writer = csv.writer(handle)
+            writer.writerow(self.HEADER)
+            writer.writerows(rows)
+        self.addCleanup(os.unlink, handle.name)
+        return handle.name
+
+    def rows(self):
+        phones = json.dumps([{'number': '+1 650 253 0000', 'description': 'HQ'}, {'number': '123', 'description': ''}])
+        contacts = json.dumps([{'name': 'Jane', 'verified_profile': True, 'level': 'CEO'}])
+        return [
+            ['acme.com', 'Acme', '1 Road', 'True', phones, '[]', contacts],
+            ['https://beta.io', 'Beta', '', 'False', 'not json', '[]', '[]'],
+            ['', 'No domain', '', 'False', '[]', '[]', '[]'],
+            ['acme.com', 'Acme Corp', '2 Road', 'True', phones, '[]', contacts],
+        ]
+
+    def snapshot(self):
+        return [
+            (c.url, c.slug, c.name, c.score, c.address.address if c.address else None,
+             sorted(c.phone_numbers.values_list('number', 'verified')),
+             list(c.contacts.values_list('name', 'verified_profile')))
+            for c in Company.objects.order_by('url')
+        ]
+
+    def test_batch_engine_matches_row_engine(self):
+        path = self.write_csv(self.rows())
+        call_command('import_csv', path, engine='row', stdout=io.StringIO())
+        expected = self.snapshot()
+
+        Company.objects.all().delete()
+        call_command('import_csv', path, engine='batch', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(expected[0][2:4], ('Acme Corp', 3.0))
+
+        # Re-importing updates in place instead of creating duplicates
+        address_count = Address.objects.count()
+        call_command('import_csv', path, engine='batch', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(Address.objects.count(), address_count)
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL')
+    def test_copy_engine_matches_row_engine(self):
+        path = self.write_csv(self.rows())
+        call_command('import_csv', path, engine='row', stdout=io.StringIO())
+        expected = self.snapshot()
+
+        Company.objects.all().delete()
+        call_command('import_csv', path, engine='copy', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), expected)
+
+        address_count = Address.objects.count()
+        call_command('import_csv', path, engine='copy', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(Address.objects.count(), address_count)
+
+    def test_batch_engine_avoids_slug_collisions(self):
+        Company.objects.create(url='acme-com', name='Existing')
+        call_command('import_csv', self.write_csv(self.rows()[:1]), engine='batch', stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Company.objects.values_list('slug', flat=True)),
+            ['acme-com', 'acme-com-1'],
+        )
+
+    def test_url_variants_update_one_company(self):
+        Company.objects.create(url='http://www.acme.com/', name='Existing')
+        call_command('import_csv', self.write_csv(self.rows()), engine='batch', stdout=io.StringIO())
+        company = Company.objects.get(domain='acme.com')
+        self.assertEqual((company.name, company.url, company.slug), ('Acme Corp', 'http://www.acme.com/', 'acme-com'))
+
+    def write_batch_queries(self, size):
+        companies = [Company.objects.create(url=f'size{size}-{i}.com', name=f'Company {i}') for i in range(size)]
+        for company in companies:
+            PhoneNumber.objects.create(company=company, number='+1 650 253 0000', verified=True)
+            Contacts.objects.create(company=company, name='Jane', level='CEO')
+        rows = []
+        for company in companies:
+            row = parse_row({'domain': company.domain, 'name': company.name, 'phone_numbers': '[{"number": "1"}]'})
+            row['row_num'] = len(rows) + 2
+            rows.append(row)
+        with CaptureQueriesContext(connection) as queries, deferred_score_updates():
+            BatchImporter(io.StringIO(), mock.Mock()).write_batch(rows)
+        self.assertEqual(PhoneNumber.objects.filter(company__in=companies).count(), size)
+        # Old phone numbers and contacts go with one DELETE each, without loading them first
+        for model in (PhoneNumber, Contacts):
+            table = connection.ops.quote_name(model._meta.db_table)
+            self.assertEqual(sum(query['sql'].startswith(f'DELETE FROM {table}') for query in queries), 1)
+            self.assertFalse([query for query in queries if query['sql'].startswith('SELECT') and f'FROM {table}' in query['sql']])
+        return len(queries)
+
+    def test_batch_queries_do_not_grow_with_batch_size(self):
+        self.assertEqual(self.write_batch_queries(2), self.write_batch_queries(6))
+
+    def test_failed_batch_is_retried_row_by_row(self):
+        write_batch = BatchImporter.write_batch
+
+        def fail_on_beta(importer, rows):
+            if any(row['domain'] == 'beta.io' for row in rows):
+                raise DatabaseError('value too long')
+            return write_batch(importer, rows)
+
+        out = io.StringIO()
+        with mock.patch.object(BatchImporter, 'write_batch', fail_on_beta):
+            call_command('import_csv', self.write_csv(self.rows()), engine='batch', stdout=out)
+        self.assertEqual(list(Company.objects.values_list('domain', flat=True)), ['acme.com'])
+        self.assertIn('Row 3: Error - value too long', out.getvalue())
+
+
+class TaskQueueClaimTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            TaskQueue.objects.create(url=f'site{i}.com')
+
+    def test_claims_are_distinct_and_oldest_first(self):
+        first = TaskQueue.objects.claim()
+        second = TaskQueue.objects.claim(limit=5)
+        self.assertEqual([t.url for t in first], ['site0.com'])
+        self.assertEqual([t.url for t in second], ['site1.com', 'site2.com'])
+        self.assertEqual(TaskQueue.objects.claim(), [])
+        self.assertTrue(all(t.status == 'processing' and t.lease_expires_at for t in first + second))
+
+    def test_requeued_task_waits_behind_newer_work(self):
+        TaskQueue.objects.filter(url='site0.com').update(status='completed')
+        with mock.patch('api.tasks.dispatch_pending_tasks'):
+            queue_scrape_company('site0.com')
+        self.assertEqual([t.url for t in TaskQueue.objects.claim(limit=5)], ['site1.com', 'site2.com', 'site0.com'])
+
+    def test_expired_lease_is_reclaimed(self):
+        claimed = TaskQueue.objects.claim()[0]
+        TaskQueue.objects.filter(pk=claimed.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([t.url for t in TaskQueue.objects.claim(limit=5)], ['site0.com', 'site1.com', 'site2.com'])
+
+    def test_queue_dispatches_claimed_task(self):
+        limiter = LocalRateLimiter(interval=60, burst=1, max_concurrency=1)
+        with mock.patch('api.tasks.get_rate_limiter', return_value=limiter), \
+                mock.patch('api.tasks.scrape_company_task.delay') as delay:
+            queue_scrape_company('site9.com')
+            queue_scrape_company('site9.com')
+        delay.assert_called_once_with('site0.com', slot=mock.ANY)
+        self.assertEqual(TaskQueue.objects.get(url='site9.com').status, 'pending')
+
+    def test_burst_and_concurrency_dispatch_several(self):
+        limiter = LocalRateLimiter(interval=60, burst=2, max_concurrency=5)
+        with mock.patch('api.tasks.get_rate_limiter', return_value=limiter), \
+                mock.patch('api.tasks.scrape_company_task.delay') as delay:
+            process_task_queue()
+        self.assertEqual([c.args[0] for c in delay.call_args_list], ['site0.com', 'site1.com'])
+
+    def test_rate_wait_schedules_one_wakeup(self):
+        limiter = LocalRateLimiter(interval=60, burst=1, max_concurrency=0)
+        with mock.patch('api.tasks.get_rate_limiter', return_value=limiter), \
+                mock.patch('api.tasks.scrape_company_task.delay'), \
+                mock.patch('api.tasks.process_task_queue.apply_async') as apply_async:
+            process_task_queue()
+            process_task_queue()
+        apply_async.assert_called_once_with(kwargs={'wakeup': True}, countdown=mock.ANY)
+        self.assertAlmostEqual(apply_async.call_args.kwargs['countdown'], 60, delta=1)
+
+    def test_full_concurrency_waits_for_a_finishing_task(self):
+        limiter = LocalRateLimiter(interval=0, burst=1, max_concurrency=1)
+        with mock.patch('api.tasks.get_rate_limiter', return_value=limiter), \
+                mock.patch('api.tasks.scrape_company_task.delay') as delay, \
+                mock.patch('api.tasks.process_task_queue.apply_async') as apply_async:
+            process_task_queue()
+            apply_async.assert_not_called()
+            limiter.release(delay.call_args.kwargs['slot'])
+            process_task_queue()
+        self.assertEqual([c.args[0] for c in delay.call_args_list], ['site0.com', 'site1.com'])
+
+
+class TaskQueueLaneTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        for i in range(5):
+            TaskQueue.objects.create(url=f'backfill{i}.com', priority=TaskQueue.PRIORITY_BACKFILL)
+        TaskQueue.objects.create(url='user.com', priority=TaskQueue.PRIORITY_INTERACTIVE)
+
+    def test_interactive_task_overtakes_older_backfill(self):
+        claimed = TaskQueue.objects.claim_fair(weights={'interactive': 1000, 'backfill': 1}, rng=random.Random(1))
+        self.assertEqual([t.url for t in claimed], ['user.com'])
+        # Only backfill left, so it gets every dispatch, oldest first
+        self.assertEqual(TaskQueue.objects.claim_fair()[0].url, 'backfill0.com')
+
+    def test_weights_share_dispatches_between_lanes(self):
+        for i in range(200):
+            TaskQueue.objects.create(url=f'user{i}.com', priority=TaskQueue.PRIORITY_INTERACTIVE)
+        rng = random.Random(7)
+        lanes = [TaskQueue.objects.claim_fair(weights={'interactive': 3, 'backfill': 1}, rng=rng)[0].priority
+                 for _ in range(40)]
+        # Backfill is not starved behind 200 interactive tasks
+        self.assertEqual(lanes.count(TaskQueue.PRIORITY_BACKFILL), 5)
+        self.assertLess(lanes.index(TaskQueue.PRIORITY_BACKFILL), 20)
+
+    def test_requeue_upgrades_priority(self):
+        with mock.patch('api.tasks.dispatch_pending_tasks'):
+            queue_scrape_company('backfill3.com')
+        self.assertEqual(TaskQueue.objects.get(url='backfill3.com').priority, TaskQueue.PRIORITY_INTERACTIVE)
+
+    def test_lane_metrics(self):
+        for i, seconds in enumerate([10, 20, 30, 40]):
+            TaskQueue.objects.create(
+                url=f'done{i}.com', status='completed', enqueued_at=self.now - timedelta(seconds=100),
+                last_executed_at=self.now - timedelta(seconds=100 - seconds), finished_at=self.now,
+            )
+        metrics = TaskQueue.objects.lane_metrics(now=self.now)
+        self.assertEqual(metrics['backfill']['pending'], 5)
+        self.assertEqual(metrics['interactive']['pending'], 1)
+        self.assertEqual(metrics['interactive']['completed'], 4)
+        self.assertEqual(metrics['interactive']['wait_p50'], 20)
+        self.assertEqual(metrics['interactive']['wait_p95'], 40)
+        self.assertEqual(metrics['interactive']['time_to_result_p95'], 100)
+        self.assertIsNone(metrics['refresh']['wait_p95'])
+
+    def test_stage_timer_adds_up_repeated_stages(self):
+        timer = StageTimer(clock=iter([0, 1.5, 2, 2.25, 3, 4]).__next__)
+        for name in ('navigation', 'click', 'navigation'):
+            with timer.stage(name):
+                pass
+        self.assertEqual(timer.as_dict(), {'navigation': 2.5, 'click': 0.25})
+
+    def test_stage_metrics(self):
+        for i, seconds in enumerate([1, 2, 3, 40]):
+            TaskQueue.objects.create(url=f'timed{i}.com', last_executed_at=self.now,
+                                     stage_timings={'navigation': seconds, 'clip_inference': 0.5})
+        TaskQueue.objects.create(url='old.com', last_executed_at=self.now - timedelta(hours=2),
+                                 stage_timings={'navigation': 99})
+        stages = TaskQueue.objects.stage_metrics(now=self.now)
+        self.assertEqual(set(stages), {'navigation', 'clip_inference'})
+        self.assertEqual(stages['navigation'], {'count': 4, 'p50': 2, 'p95': 40, 'max': 40, 'sum': 46})
+
+        text = render_metrics()
+        self.assertIn('vgetit_scrape_stage_seconds{stage="navigation",quantile="0.95"} 40', text)
+        self.assertIn('vgetit_scrape_stage_seconds_count{stage="clip_inference"} 4', text)
+
+
+class ScrapeRetryTests(TestCase):
+    def setUp(self):
+        Company.objects.create(url='flaky.com', name='Processing flaky.com...', is_processed=False)
+        self.task = TaskQueue.objects.create(url='flaky.com')
+
+    def scrape(self, outcome):
+        scraper = mock.Mock(scrape_company_data=mock.Mock(side_effect=outcome))
+        with mock.patch.dict('sys.modules', {'api.builtwith_scraper': scraper}), \
+                mock.patch('api.tasks.process_task_queue'):
+            self.assertEqual(TaskQueue.objects.claim()[0].url, 'flaky.com')
+            scrape_company_task('flaky.com')
+        self.task.refresh_from_db()
+
+    def test_retryable_failure_backs_off(self):
+        before = timezone.now()
+        self.scrape(ScrapeError('No captcha prompt captured'))
+        self.assertEqual((self.task.status, self.task.retry_count), ('failed', 1))
+        # Jittered between half and all of the base delay
+        self.assertGreaterEqual(self.task.next_attempt_at, before + timedelta(seconds=30))
+        self.assertLessEqual(self.task.next_attempt_at, timezone.now() + timedelta(seconds=60))
+        self.assertTrue(Company.objects.filter(url='flaky.com').exists())
+        self.assertFalse(TaskQueue.objects.claimable().exists())
+        self.assertTrue(TaskQueue.objects.claimable(now=self.task.next_attempt_at).exists())
+
+    def test_dead_letter_after_max_attempts(self):
+        TaskQueue.objects.filter(pk=self.task.pk).update(retry_count=4)
+        self.scrape(TimeoutError('page.goto: Timeout 30000ms exceeded'))
+        self.assertEqual((self.task.status, self.task.retry_count), ('dead', 5))
+        self.assertIsNone(self.task.next_attempt_at)
+        self.assertFalse(Company.objects.filter(url='flaky.com').exists())
+
+    def test_missing_name_is_permanent(self):
+        self.scrape([{'name': ''}])
+        self.assertEqual((self.task.status, self.task.retry_count), ('dead', 1))
+        self.assertEqual(self.task.error_message, 'No company name found')
+        self.assertFalse(Company.objects.filter(url='flaky.com').exists())
+
+    def test_missing_name_is_cached_as_negative(self):
+        self.scrape([{'name': ''}])
+        self.assertEqual(NegativeResult.objects.active().get().domain, 'flaky.com')
+
+    def test_retryable_failure_is_not_cached(self):
+        self.scrape(ScrapeError('No captcha prompt captured'))
+        self.assertFalse(NegativeResult.objects.exists())
+
+    def test_stage_timings_are_kept(self):
+        def scrape(url, timer):
+            with timer.stage('navigation'):
+                pass
+            return {'name': 'Flaky Inc'}
+
+        with mock.patch('api.tasks.publish_company_status'):
+            self.scrape(scrape)
+        self.assertEqual(self.task.status, 'completed')
+        self.assertEqual(set(self.task.stage_timings), {'navigation', 'db_write'})
+
+        def fail(url, timer):
+            with timer.stage('captcha_wait'):
+                raise ScrapeError('No captcha prompt captured')
+
+        # A failed attempt keeps the stages it got through
+        TaskQueue.objects.filter(pk=self.task.pk).update(status='pending')
+        self.scrape(fail)
+        self.assertEqual(set(self.task.stage_timings), {'captcha_wait'})
+
+    def test_backoff_grows_and_is_capped(self):
+        with mock.patch('api.tasks.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([retry_delay(n) for n in (1, 2, 3)], [60, 120, 240])
+            self.assertEqual(retry_delay(30), 6 * 60 * 60)
+
+
+PlaywrightError = type('Error', (Exception,), {})
+
+
+class FakeBrowserContext:
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+    def cookies(self):
+        if not self.healthy:
+            raise PlaywrightError('Target page, context or browser has been closed')
+        return []
+
+    def new_page(self):
+        return mock.Mock()
+
+    def close(self):
+        self.closed = True
+
+
+class BrowserPoolTests(TestCase):
+    def setUp(self):
+        # The pool only runs in scrape workers; stand in for the browser stack
+        fakes = {
+            'playwright': mock.Mock(),
+            'playwright.sync_api': mock.Mock(Error=PlaywrightError),
+            'playwright_stealth': mock.Mock(),
+            'pyvirtualdisplay': mock.Mock(),
+        }
+        with mock.patch.dict('sys.modules', fakes):
+            sys.modules.pop('api.browser_pool', None)
+            browser_pool = importlib.import_module('api.browser_pool')
+        self.profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profiles.cleanup)
+        self.base_profile = os.path.join(self.profiles.name, 'user_data')
+        self.contexts = []
+        self.memory = 10
+        self.pool = browser_pool.BrowserPool(size=1, max_pages=2, max_memory_mb=100, user_data_dir=self.base_profile)
+        self.pool._playwright = mock.Mock()
+        self.pool._playwright.chromium.launch_persistent_context.side_effect = self.launch
+        self.pool._memory_mb = lambda: self.memory
+        self.worker_metrics = WorkerMetrics()
+        patcher = mock.patch('api.metrics._worker_metrics', self.worker_metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def launch(self, user_data_dir, **kwargs):
+        self.contexts.append(FakeBrowserContext())
+        return self.contexts[-1]
+
+    def serve(self, pages):
+        for _ in range(pages):
+            with self.pool.page():
+                pass
+
+    def test_recycles_after_max_pages(self):
+        self.serve(3)
+        self.assertEqual(len(self.contexts), 2)
+        self.assertTrue(self.contexts[0].closed)
+        metrics = self.pool.metrics()
+        self.assertEqual((metrics['pages_served'], metrics['recycled_max_pages'], metrics['live_contexts']), (3, 1, 1))
+
+    def test_recycles_over_memory_ceiling(self):
+        self.memory = 500
+        self.serve(2)
+        self.assertEqual(len(self.contexts), 2)
+        self.assertEqual(self.pool.metrics()['recycled_memory'], 2)
+
+    def test_drops_unhealthy_context(self):
+        self.serve(1)
+        self.contexts[0].healthy = False
+        self.serve(1)
+        self.assertEqual(len(self.contexts), 2)
+        self.assertEqual(self.pool.metrics()['recycled_unhealthy'], 1)
+
+    def test_metrics_are_exported(self):
+        self.serve(1)
+        (worker, values), = self.worker_metrics.collect('browser_pool').items()
+        self.assertEqual(values['pages_served'], 1)
+        self.assertIn(f'vgetit_browser_pool_pages_served_total{{worker="{worker}"}} 1', render_metrics())
+
+    def test_extra_profiles_start_from_the_base_profile(self):
+        os.makedirs(self.base_profile)
+        for name in ('Cookies', 'SingletonLock'):
+            open(os.path.join(self.base_profile, name), 'w').close()
+        self.pool.size = 2
+        self.assertEqual(self.pool._profile_dir(0), self.base_profile)
+        copy = self.pool._profile_dir(1)
+        self.assertEqual(sorted(os.listdir(copy)), ['Cookies'])
+
+
+class PhoneValidationTests(TestCase):
+    NUMBERS = ['+1 650 253 0000', '12345', '+44 20 7031 3000', '+1 650 253 0000', 'not a number', '', '12345']
+
+    def setUp(self):
+        clear_phone_validation_cache()
+        self.addCleanup(clear_phone_validation_cache)
+
+    def test_matches_single_validation_in_order(self):
+        verdicts = validate_phone_numbers(self.NUMBERS)
+        self.assertEqual(verdicts, [True, False, True, True, False, False, False])
+        clear_phone_validation_cache()
+        self.assertEqual(verdicts, [is_valid_phone_number(number) for number in self.NUMBERS])
+        self.assertEqual(validate_phone_numbers([]), [])
+
+    def test_duplicates_are_checked_once(self):
+        with mock.patch('api.phone_validation.check_phone_number', return_value=True) as check:
+            validate_phone_numbers(self.NUMBERS)
+        self.assertEqual(check.call_count, 5)
+
+    def test_process_pool_results_are_memoized(self):
+        with mock.patch('api.phone_validation.PHONE_VALIDATION_PARALLEL_THRESHOLD', 1), \
+                mock.patch('api.phone_validation.CHUNK_SIZE', 2), \
+                mock.patch('api.phone_validation._executor', None):
+            try:
+                verdicts = validate_phone_numbers(self.NUMBERS, processes=2)
+            finally:
+                phone_validation._executor.shutdown()
+        self.assertEqual(verdicts, [True, False, True, True, False, False, False])
+
+        with mock.patch('api.phone_validation.check_phone_number', side_effect=AssertionError('not memoized')):
+            self.assertEqual(validate_phone_numbers(self.NUMBERS), verdicts)
+
+
+class TaskQueueAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        self.dead = TaskQueue.objects.create(url='dead.com', status='dead', retry_count=5, finished_at=timezone.now())
+        self.done = TaskQueue.objects.create(url='done.com', status='completed', finished_at=timezone.now())
+
+    def test_retry_resets_and_dispatches(self):
+        with mock.patch('api.admin.process_task_queue.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/admin/api/taskqueue/', {
+                'action': 'retry_failed_tasks', '_selected_action': [self.dead.pk, self.done.pk],
+            })
+        delay.assert_called_once_with()
+        self.dead.refresh_from_db()
+        self.assertEqual((self.dead.status, self.dead.retry_count, self.dead.finished_at), ('pending', 0, None))
+        self.assertEqual(TaskQueue.objects.get(pk=self.done.pk).status, 'completed')
+
+
+class CaptchaSolverTests(TestCase):
+    def setUp(self):
+        # Stand in for torch and CLIP, which only scrape workers install
+        self.transformers = mock.Mock()
+        self.transformers.CLIPModel.from_pretrained.side_effect = self.load_model
+        fakes = {'PIL': mock.Mock(), 'torch': mock.Mock(), 'transformers': self.transformers}
+        with mock.patch.dict('sys.modules', fakes):
+            sys.modules.pop('api.captcha_solver', None)
+            self.captcha_solver = importlib.import_module('api.captcha_solver')
+
+    def load_model(self, *args, **kwargs):
+        time.sleep(0.05)  # Long enough for concurrent callers to pile up behind the first
+        return mock.Mock()
+
+    def test_import_loads_nothing(self):
+        self.transformers.CLIPModel.from_pretrained.assert_not_called()
+        self.assertIsNone(self.captcha_solver._solver)
+
+    def test_solver_is_built_once(self):
+        with mock.patch('builtins.print'), ThreadPoolExecutor(max_workers=8) as pool:
+            solvers = list(pool.map(lambda _: self.captcha_solver.get_captcha_solver(), range(8)))
+            solvers.append(self.captcha_solver.get_captcha_solver())
+        self.assertEqual(len({id(solver) for solver in solvers}), 1)
+        self.transformers.CLIPModel.from_pretrained.assert_called_once()
+        self.transformers.CLIPProcessor.from_pretrained.assert_called_once()
+
+
+class NegativeResultTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        NegativeResult.objects.remember('https://www.Empty.com/', reason='No company name found')
+
+    def test_search_answers_from_cache_without_queuing(self):
+        with mock.patch('api.views.queue_scrape_company.delay') as delay, CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/companies/search/', {'url': 'empty.com'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['status'], 'not_found')
+        delay.assert_not_called()
+        self.assertFalse(Company.objects.filter(url='empty.com').exists())
+        # Answering from the entry writes nothing
+        self.assertFalse([q['sql'] for q in queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))])
+
+    def test_expired_entry_is_ignored_and_purged(self):
+        NegativeResult.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        with mock.patch('api.views.queue_scrape_company.delay') as delay:
+            response = self.client.get('/api/companies/search/', {'url': 'empty.com'})
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with('empty.com')
+
+        NegativeResult.objects.remember('other.com')
+        call_command('purge_negative_results', stdout=io.StringIO())
+        self.assertEqual(list(NegativeResult.objects.values_list('domain', flat=True)), ['other.com'])
+        call_command('purge_negative_results', 'http://Other.com/x', stdout=io.StringIO())
+        self.assertFalse(NegativeResult.objects.exists())
+
+
+class DomainKeyTests(TestCase):
+    def test_search_variants_share_one_company_and_task(self):
+        client = APIClient()
+        with mock.patch('api.tasks.dispatch_pending_tasks'):
+            for url in ('https://Acme.com', 'http://www.acme.com/', 'acme.com'):
+                response = client.get('/api/companies/search/', {'url': url})
+                self.assertEqual(response.status_code, 202)
+                queue_scrape_company(url)
+        self.assertEqual(list(Company.objects.values_list('domain', flat=True)), ['acme.com'])
+        self.assertEqual(list(TaskQueue.objects.values_list('domain', 'url')), [('acme.com', 'https://Acme.com')])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Concurrent writers need PostgreSQL')
+class ConcurrentSearchTests(TransactionTestCase):
+    def test_parallel_searches_queue_one_scrape(self):
+        def search(_):
+            try:
+                return APIClient().get('/api/companies/search/', {'url': 'https://www.newco.com/'})
+            finally:
+                connection.close()
+
+        with mock.patch('api.views.queue_scrape_company.delay') as delay, ThreadPoolExecutor(max_workers=32) as pool:
+            responses = list(pool.map(search, range(100)))
+
+        delay.assert_called_once_with('https://www.newco.com/')
+        self.assertEqual({response.status_code for response in responses}, {202})
+        self.assertEqual(len({json.dumps(response.data, sort_keys=True) for response in responses}), 1)
+        self.assertEqual(Company.objects.get().slug, responses[0].data['company']['slug'])
+
+    def test_slug_taken_by_another_domain(self):
+        Company.objects.create(url='acme-com', name='Other')
+        company, created = Company.objects.get_or_create_placeholder('acme.com', name='Processing...')
+        self.assertTrue(created)
+        self.assertEqual((company.domain, company.slug), ('acme.com', 'acme-com-1'))
+        self.assertEqual(Company.objects.get_or_create_placeholder('http://acme.com', name='x'), (company, False))
+
+
+class DomainMergeMigrationTests(TransactionTestCase):
+    migrate_from = [('api', '0010_negativeresult')]
+    migrate_to = [('api', '0012_domain_unique')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged(self):
+        apps = self.migrate(self.migrate_from)
+        Company = apps.get_model('api', 'Company')
+        Comment = apps.get_model('api', 'Comment')
+        PhoneNumber = apps.get_model('api', 'PhoneNumber')
+        TaskQueue = apps.get_model('api', 'TaskQueue')
+        User = apps.get_model('auth', 'User')
+        alice, bob = User.objects.create(username='alice'), User.objects.create(username='bob')
+
+        kept = Company.objects.create(url='https://acme.com', slug='acme-com', name='Acme', is_processed=True)
+        PhoneNumber.objects.create(company=kept, number='1', verified=True)
+        Comment.objects.create(company=kept, user=alice, text='old', rating=1)
+        for i, url in enumerate(['acme.com', 'http://www.acme.com/']):
+            dupe = Company.objects.create(url=url, slug=f'dupe-{i}', name='Processing...')
+            Comment.objects.create(company=dupe, user=alice if i else bob, text=f'new {i}', rating=5)
+        Company.objects.create(url='other.com', slug='other-com', name='Other', is_processed=True)
+        TaskQueue.objects.create(url='acme.com', status='completed')
+        TaskQueue.objects.create(url='https://www.acme.com', status='pending', priority=2)
+
+        apps = self.migrate(self.migrate_to)
+        Company = apps.get_model('api', 'Company')
+        Comment = apps.get_model('api', 'Comment')
+        TaskQueue = apps.get_model('api', 'TaskQueue')
+        self.assertEqual(sorted(Company.objects.values_list('domain', 'slug')), [('acme.com', 'acme-com'), ('other.com', 'other-com')])
+        self.assertEqual(
+            sorted(Comment.objects.values_list('company__slug', 'user__username', 'text')),
+            [('acme-com', 'alice', 'new 1'), ('acme-com', 'bob', 'new 0')],
+        )
+        acme = Company.objects.get(domain='acme.com')
+        self.assertEqual((acme.rating_count, acme.verified_phone_count, acme.score), (2, 1, 3.0))
+        self.assertEqual(list(TaskQueue.objects.values_list('domain', 'status', 'priority')), [('acme.com', 'pending', 0)])
+
+
+class CompanyEventsTests(TestCase):
+    def setUp(self):
+        self.placeholder = Company.objects.create(url='pending.com', name='Processing pending.com...')
+        self.company = create_company(1, comments=0)
+
+    async def test_long_poll(self):
+        response = await self.async_client.get(f'/api/companies/{self.company.slug}/events/')
+        self.assertEqual(response.json(), {'slug': self.company.slug, 'status': 'processed'})
+        response = await self.async_client.get('/api/companies/gone-com/events/')
+        self.assertEqual(response.json()['status'], 'not_found')
+        response = await self.async_client.get(f'/api/companies/{self.placeholder.slug}/events/', {'timeout': 0.05})
+        self.assertEqual(response.json()['status'], 'processing')
+
+    async def test_timeout_is_clamped(self):
+        url = f'/api/companies/{self.placeholder.slug}/events/'
+        with mock.patch('api.views.wait_for_company_status', mock.AsyncMock(return_value='processing')) as wait:
+            for value in ('nan', 'inf', '-inf', 'soon', '-5', '1e9', '2.5'):
+                await self.async_client.get(url, {'timeout': value})
+        self.assertEqual([call.args[1] for call in wait.call_args_list],
+                         [COMPANY_EVENTS_TIMEOUT] * 4 + [0, COMPANY_EVENTS_TIMEOUT, 2.5])
+
+    async def test_server_sent_events(self):
+        response = await self.async_client.get(
+            f'/api/companies/{self.company.slug}/events/', headers={'Accept': 'text/event-stream'}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = ''.join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertEqual(body, f'event: status\ndata: {{"slug": "{self.company.slug}", "status": "processed"}}\n\n')
+
+    async def test_notification_wakes_waiter(self):
+        listener = CompanyEventListener('redis://unused')
+        with mock.patch('api.notifications.uses_redis', return_value=True), \
+                mock.patch('api.notifications.get_listener', return_value=listener), \
+                mock.patch.object(listener, 'start', mock.AsyncMock(return_value=True)):
+            waiter = asyncio.ensure_future(wait_for_company_status(self.placeholder.slug, timeout=5))
+            while not listener.waiters:
+                await asyncio.sleep(0.01)
+            listener.dispatch(self.placeholder.slug, 'processed')
+            self.assertEqual(await waiter, 'processed')
+        self.assertEqual(dict(listener.waiters), {})
+
+
+class FakePubSub:
+    async def psubscribe(self, pattern):
+        pass
+
+    async def listen(self):
+        await asyncio.Event().wait()  # Nothing is published; dispatch() is called directly
+        yield
+
+    async def aclose(self):
+        pass
+
+
+class CompanyEventListenerThreadTests(TestCase):
+    def test_one_listener_serves_every_event_loop(self):
+        listener = CompanyEventListener('redis://unused')
+        client = mock.Mock(pubsub=FakePubSub, aclose=mock.AsyncMock())
+        wait = async_to_sync(wait_for_company_status)  # A new event loop per call, as under WSGI
+        with mock.patch('api.notifications.redis.asyncio.Redis.from_url', return_value=client) as connect, \
+                mock.patch('api.notifications.uses_redis', return_value=True), \
+                mock.patch('api.notifications.get_listener', return_value=listener), \
+                mock.patch('api.notifications.company_status', mock.AsyncMock(return_value='processing')), \
+                ThreadPoolExecutor(max_workers=2) as pool:
+            try:
+                for slug in ('first-com', 'second-com'):
+                    waiter = pool.submit(wait, slug, 5)
+                    while slug not in listener.waiters:
+                        time.sleep(0.01)
+                    listener.dispatch(slug, 'processed')
+                    self.assertEqual(waiter.result(timeout=5), 'processed')
+            finally:
+                listener.stop()
+        connect.assert_called_once()
+        self.assertEqual(dict(listener.waiters), {})
+        self.assertFalse(listener.thread.is_alive())
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.limiter = LocalRateLimiter(interval=10, burst=3, max_concurrency=2, lease=600,
+                                        clock=lambda: self.now)
+
+    def test_burst_then_steady_rate(self):
+        self.limiter.max_concurrency = 0
+        self.assertEqual([self.limiter.try_acquire(i)[0] for i in range(4)], [True, True, True, False])
+        self.assertEqual(self.limiter.try_acquire('x'), (False, 10.0))
+        self.now += 10
+        self.assertTrue(self.limiter.try_acquire('x')[0])
+        self.assertFalse(self.limiter.try_acquire('y')[0])
+
+    def test_concurrency_cap_and_release(self):
+        self.assertTrue(self.limiter.try_acquire('a')[0])
+        self.assertTrue(self.limiter.try_acquire('b')[0])
+        self.assertEqual(self.limiter.try_acquire('c'), (False, None))  # Waits for a release, not the clock
+        self.limiter.release('a')
+        self.assertTrue(self.limiter.try_acquire('c')[0])
+
+    def test_abandoned_slot_expires(self):
+        self.limiter.try_acquire('a')
+        self.limiter.try_acquire('b')
+        self.now += 601
+        self.assertTrue(self.limiter.try_acquire('c')[0])
+
+    def test_refund_returns_the_token(self):
+        self.limiter.max_concurrency = 0
+        for i in range(3):
+            self.limiter.try_acquire(i)
+        self.limiter.release(2, refund=True)
+        self.assertTrue(self.limiter.try_acquire(3)[0])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SKIP LOCKED needs PostgreSQL')
+class ConcurrentTaskQueueClaimTests(TransactionTestCase):
+    def test_parallel_claims_never_share_a_row(self):
+        TaskQueue.objects.bulk_create(TaskQueue(url=f'site{i}.com', domain=f'site{i}.com') for i in range(40))
+
+        def claim(_):
+            try:
+                return [t.url for t in TaskQueue.objects.claim(limit=3)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            claimed = [url for urls in pool.map(claim, range(20)) for url in urls]
+        self.assertEqual(len(claimed), 40)
+        self.assertEqual(len(set(claimed)), 40)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL')
+class QueryPlanTests(TestCase):
+    """
+    The hot queries must have an index to use. Seq scans are disabled while
+    planning, so the planner only picks one when no index fits; on a table
+    this small it would otherwise prefer one regardless.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        companies = Company.objects.bulk_create(
+            Company(name=f'Company {i}', url=f'company{i}.com', domain=f'company{i}.com', slug=f'company{i}-com',
+                    is_processed=i % 4 != 0)
+            for i in range(2000)
+        )
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(500))
+        # A few comments on most companies, and one much-reviewed company whose page must not sort them all
+        Comment.objects.bulk_create(
+            Comment(company=company, user=user, text='ok', rating=3)
+            for company in companies[:200] for user in users[:20]
+        )
+        cls.busy_company = companies[7]
+        Comment.objects.bulk_create(Comment(company=cls.busy_company, user=user, text='ok', rating=3) for user in users[20:])
+        statuses = ['pending', 'processing', 'completed', 'completed', 'failed', 'dead']
+        TaskQueue.objects.bulk_create(
+            TaskQueue(url=f'site{i}.com', domain=f'site{i}.com', status=statuses[i % len(statuses)], priority=i % 3,
+                      last_executed_at=now - timedelta(minutes=i), finished_at=now - timedelta(minutes=i))
+            for i in range(3000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, *indexes):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan, plan)
+        for index in indexes:
+            # Scanning some other index from end to end would pass the check above
+            self.assertIn(index, plan, plan)
+
+    def test_recent_companies(self):
+        self.assertUsesIndex(
+            Company.objects.filter(is_processed=True).order_by('-last_updated')[:3], 'company_processed_updated_idx',
+        )
+
+    def test_dispatcher_claims(self):
+        since = timezone.now() - timedelta(hours=1)
+        for priority, _ in TaskQueue.PRIORITY_CHOICES:
+            with self.subTest(priority=priority):
+                self.assertUsesIndex(
+                    TaskQueue.objects.filter(priority=priority).claimable().order_by('enqueued_at', 'id')
+                    .select_for_update(skip_locked=True).values_list('id', flat=True)[:1],
+                    'taskqueue_pending_idx', 'taskqueue_retry_idx',
+                )
+                self.assertUsesIndex(
+                    TaskQueue.objects.filter(priority=priority, last_executed_at__gte=since), 'taskqueue_started_idx',
+                )
+                self.assertUsesIndex(
+                    TaskQueue.objects.filter(priority=priority, status='completed', finished_at__gte=since),
+                    'taskqueue_completed_idx',
+                )
+
+    def test_company_comments(self):
+        self.assertUsesIndex(
+            # As CommentViewSet.list queries it, by the id the validators read
+            Comment.objects.select_related('user').filter(company_id=self.busy_company.id)
+            .order_by('-created_at', 'id')[:21],
+            'comment_company_created_idx',
+        )
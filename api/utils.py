@@ -1,4 +1,8 @@
+import math
+import os
 import re
+import time
+from contextlib import contextmanager
 
 def custom_slugify(text):
     if not text:
@@ -19,4 +23,97 @@ def custom_slugify(text):
 
     text = text.strip('-')
 
-    return text
\ No newline at end of file
+    return text
+def normalize_domain(url):
+    """
+    The bare host of a URL or domain, lowercased, without scheme, credentials,
+    port, path, a leading www. or a trailing dot: 'HTTPS://www.Acme.com/about'
+    becomes 'acme.com'.
+    """
+    if not url:
+        return ""
+    host = url.strip().lower()
+    host = re.sub(r'^[a-z][a-z0-9+.-]*://', '', host)
+    host = re.split(r'[/?#]', host, maxsplit=1)[0]
+    host = host.rsplit('@', 1)[-1]
+    host = host.split(':', 1)[0].rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+def process_tree_rss_mb(pid, include_self=True):
+    """
+    Resident memory of a process and all of its descendants, in MiB.
+    Reads /proc, so it returns 0 on platforms without it.
+    """
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        if current != pid or include_self:
+            try:
+                with open(f'/proc/{current}/statm') as f:
+                    total += int(f.read().split()[1]) * page_size
+            except (OSError, ValueError, IndexError):
+                continue
+        try:
+            for tid in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{tid}/children') as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total / (1024 * 1024)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+class StageTimer:
+    """
+    Wall time of the named stages of one unit of work (a scrape), in the
+    order they first ran. A stage entered more than once adds up.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + self.clock() - started
+
+    def as_dict(self):
+        """Seconds per stage, to the millisecond."""
+        return {name: round(seconds, 3) for name, seconds in self.stages.items()}
+
+
+def stage_summary(timings):
+    """
+    Per-stage count, p50, p95, max and sum of seconds over StageTimer.as_dict()
+    results. Postgres stores JSON objects without their key order, so stages
+    come out in no particular order.
+    """
+    samples = {}
+    for stages in timings:
+        for name, seconds in (stages or {}).items():
+            samples.setdefault(name, []).append(seconds)
+    return {
+        name: {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'max': max(values),
+            'sum': sum(values),
+        }
+        for name, values in samples.items()
+    }
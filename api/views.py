@@ -1,16 +1,35 @@
+import math
 from django.contrib.auth.models import Group, User
 from rest_framework import permissions, viewsets, generics, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import viewsets
-from .models import Company, Comment
+from .models import Company, Comment, NegativeResult
 from .serializers import CompanySerializer
+from .pagination import CompanyPagination, CommentPagination
 from api.serializers import GroupSerializer, UserSerializer, CommentSerializer
+from api.badges import BADGE_FORMATS, BADGE_MAX_AGE, badge_etag, score_tenths
+from api.company_cache import get_document_cache
+from api.metrics import METRICS_CONTENT_TYPE, METRICS_TOKEN, render_metrics
+from api.conditional import company_validators, not_modified, set_validators
+from api.notifications import COMPANY_EVENTS_TIMEOUT, company_event_stream, wait_for_company_status
 from api.tasks import queue_scrape_company
+from api.utils import normalize_domain
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
 from django.views.generic import TemplateView
 from django.shortcuts import get_object_or_404
 
 
+def company_document(slug):
+    """The serialized company, from the document cache; None if there is no such company."""
+    def build():
+        company = Company.objects.with_details().filter(slug=slug).first()
+        return None if company is None else CompanySerializer(company).data
+    return get_document_cache().get_or_build(slug, build)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
@@ -38,94 +57,118 @@ class CompanyViewSet(viewsets.ModelViewSet):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = CompanyPagination
     lookup_field = 'slug'
 
+    def get_queryset(self):
+        return Company.objects.with_details()
+
+    def retrieve(self, request, *args, **kwargs):
+        slug = kwargs[self.lookup_field]
+        validators = company_validators(Company.objects.filter(slug=slug))
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        document = company_document(slug)
+        if document is None:
+            raise Http404
+        return set_validators(Response(document), validators)
+
     @action(detail=False, methods=['get'], url_path='get')
     def get_company(self, request):
-        try:
-            slug = request.query_params.get('slug', '').strip()
-            print("Fetching company with slug:", slug)
-            company = Company.objects.get(slug=slug)
-            if company.is_processed:
-                serializer = self.get_serializer(company)
-                return Response({
-                    'status': 'success',
-                    'message': 'Company information retrieved successfully.',
-                    'company': serializer.data
-                })
-            else:
-                return Response({
-                    'status': 'error',
-                    'message': 'Company information is still being processed. Please check back later.',
-                    'company': None
-                })
-
-        except Company.DoesNotExist:
+        slug = request.query_params.get('slug', '').strip()
+        print("Fetching company with slug:", slug)
+        validators = company_validators(Company.objects.filter(slug=slug)) if slug else None
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        document = company_document(slug) if slug else None
+        if document is None:
             return Response({
                     'status': 'error',
                     'message': 'Company not found.',
                     'company': None
                 })
+        if document['is_processed']:
+            return set_validators(Response({
+                'status': 'success',
+                'message': 'Company information retrieved successfully.',
+                'company': document
+            }), validators)
+        else:
+            return set_validators(Response({
+                'status': 'error',
+                'message': 'Company information is still being processed. Please check back later.',
+                'company': None
+            }), validators)
 
     @action(detail=False, methods=['get'], url_path='recent')
     def recent_companies(self, request):
-        recent_companies = Company.objects.filter(is_processed=True).order_by('-last_updated')[:3]
+        recent_companies = self.get_queryset().filter(is_processed=True).order_by('-last_updated')[:3]
         serializer = self.get_serializer(recent_companies, many=True)
         return Response(serializer.data)
 
+    def processing_response(self, company):
+        # Identical for whoever started the search and everyone polling or racing it
+        return Response({
+            'status': 'processing',
+            'message': 'Company information is being gathered. Please check back later.',
+            'company': {
+                'slug': company.slug,
+                'url': company.url,
+                'name': company.name or 'Processing...'
+            }
+        }, status=status.HTTP_202_ACCEPTED)
+
     @action(detail=False, methods=['get'], url_path='search')
     def search_company(self, request):
         url = request.query_params.get('url', '').strip()
         
-        if not url:
+        if not normalize_domain(url):
             return Response(
                 {'status': 'error', 'message': 'URL is required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        validators = company_validators(Company.objects.for_url(url))
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+
         try:
-            # Try to find existing company
-            company = Company.objects.get(url=url)
+            # Try to find existing company; its details come from the document cache
+            company = Company.objects.for_url(url).only('slug', 'url', 'name', 'is_processed').get()
 
-            if company.is_processed:
-                serializer = self.get_serializer(company)
-                return Response({
+            document = company_document(company.slug) if company.is_processed else None
+            if document is not None:
+                return set_validators(Response({
                     'status': 'success',
-                    'company': serializer.data
-                })
+                    'company': document
+                }), validators)
             else:
                 # Company exists but still processing
-                return Response({
-                    'status': 'processing',
-                    'message': 'Company information is being gathered. Please check back later.',
-                    'company': {
-                        'slug': company.slug,
-                        'url': company.url,
-                        'name': company.name or 'Processing...'
-                    }
-                }, status=status.HTTP_202_ACCEPTED)
+                return self.processing_response(company)
 
         except Company.DoesNotExist:
-            # Create new company entry with placeholder data
+            # A recent scrape found nothing for this domain; don't spend another one
+            if NegativeResult.objects.lookup(url):
+                return Response({
+                    'status': 'not_found',
+                    'message': 'No company information is available for this URL.',
+                    'company': None
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            # Create new company entry with placeholder data. Concurrent searches for the
+            # same new domain all get this one row, and only the request that inserted it
+            # queues the scrape.
             try:
-                company = Company.objects.create(
-                    url=url,
-                    name=f'Processing {url}...',
-                    is_processed=False
-                )
+                company, created = Company.objects.get_or_create_placeholder(url, name=f'Processing {url}...')
                 
                 # Start scraping task with rate limiting queue
-                queue_scrape_company.delay(url)
+                if created:
+                    queue_scrape_company.delay(url)
 
-                return Response({
-                    'status': 'processing',
-                    'message': 'Company search initiated. Gathering information...',
-                    'company': {
-                        'slug': company.slug,
-                        'url': company.url,
-                        'name': company.name
-                    }
-                }, status=status.HTTP_202_ACCEPTED)
+                return self.processing_response(company)
 
             except Exception as e:
                 print(f"Error creating company entry: {e}")
@@ -134,10 +177,45 @@ class CompanyViewSet(viewsets.ModelViewSet):
                     'message': 'Unable to process the URL. Please try again later.'
                 }, status=status.HTTP_400_BAD_REQUEST)
         
+def events_timeout(value):
+    """
+    The ?timeout= of company_events, clamped to [0, COMPANY_EVENTS_TIMEOUT].
+    Missing or unusable values, including nan and inf, get the full timeout;
+    nan would otherwise never compare as expired and hold the connection forever.
+    """
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return COMPANY_EVENTS_TIMEOUT
+    if not math.isfinite(timeout):
+        return COMPANY_EVENTS_TIMEOUT
+    return min(max(timeout, 0), COMPANY_EVENTS_TIMEOUT)
+
+async def company_events(request, slug):
+    """
+    Holds the request open until the company's scrape finishes, instead of
+    clients polling search. With Accept: text/event-stream it streams
+    Server-Sent Events; otherwise it long-polls and answers with JSON. Either
+    way the status is processed, not_found, or processing after the timeout
+    (COMPANY_EVENTS_TIMEOUT, or ?timeout= seconds if shorter). Streaming
+    needs the ASGI server (vgetit.asgi).
+    """
+    timeout = events_timeout(request.GET.get('timeout'))
+
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        response = StreamingHttpResponse(company_event_stream(slug, timeout), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+        return response
+
+    status = await wait_for_company_status(slug, timeout)
+    return JsonResponse({'slug': slug, 'status': status})
+
 class CommentViewSet(viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = CommentPagination
 
     def perform_create(self, serializer):
         company = Company.objects.get(slug=self.kwargs['company_slug'])
@@ -163,7 +241,20 @@ class CommentViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user, company=company)
 
     def get_queryset(self):
-        return self.queryset.filter(company__slug=self.kwargs['company_slug'])
+        comments = self.queryset.select_related('user')
+        if getattr(self, 'listed_company_id', None) is not None:
+            # By id rather than through a join, so the planner knows how many comments this company has
+            # and walks comment_company_created_idx instead of sorting them all
+            return comments.filter(company_id=self.listed_company_id)
+        return comments.filter(company__slug=self.kwargs['company_slug'])
+
+    def list(self, request, *args, **kwargs):
+        validators = company_validators(Company.objects.filter(slug=self.kwargs['company_slug']))
+        response = not_modified(request, validators)
+        if response is not None:
+            return response
+        self.listed_company_id = validators.company_id if validators else None
+        return set_validators(super().list(request, *args, **kwargs), validators)
 
 class CompanyBadgeWidgetView(TemplateView):
     template_name = "badge_embed.html"
@@ -180,3 +271,44 @@ class CompanyBadgeWidgetView(TemplateView):
             context['status'] = 'error'
             context['message'] = 'Company not found'
         return context
+
+
+def company_badge(request, company_slug, format):
+    """
+    The company's trust score as a small SVG or PNG image for embedding on
+    other sites. Rendered once per score and process; the score comes from
+    the company document cache, so a warm badge needs no database query.
+    """
+    render, content_type = BADGE_FORMATS[format]
+    document = company_document(company_slug)
+    if document is None:
+        # No ETag, so a badge cached while the company still existed is never revalidated into a 304
+        response = HttpResponse(render(None), content_type=content_type, status=404)
+        response['Cache-Control'] = 'public, max-age=60'
+        return response
+
+    rated = document['is_processed']
+    tenths = score_tenths(document['score']) if rated else None
+    etag = badge_etag(tenths, format)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(render(tenths), content_type=content_type)
+    response['ETag'] = etag
+    # Unrated badges are checked again soon, to pick up the score once the scrape lands
+    response['Cache-Control'] = f'public, max-age={BADGE_MAX_AGE if rated else 60}'
+    return response
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint: this process's request histograms and
+    document cache counters, plus task queue depth and latency. Needs
+    "Authorization: Bearer <METRICS_TOKEN>", and is off (404) while
+    METRICS_TOKEN is not set.
+    """
+    if not METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
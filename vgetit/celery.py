@@ -1,8 +1,27 @@
 import os
+import sys
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vgetit.settings')
 
 app = Celery('vgetit')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_process_init.connect
+def preload_captcha_solver(**kwargs):
+    """Load the CLIP model when a worker process starts instead of on its first scrape."""
+    from django.conf import settings
+    if getattr(settings, 'CAPTCHA_PRELOAD', False):
+        from api.captcha_solver import get_captcha_solver
+        get_captcha_solver()
+
+
+@worker_process_shutdown.connect
+def close_browser_pool(**kwargs):
+    """Close Chromium, Playwright and the virtual display if this process started them."""
+    if 'api.browser_pool' in sys.modules:
+        from api.browser_pool import shutdown_browser_pool
+        shutdown_browser_pool()
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',  # First, so it times the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -160,14 +161,74 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 
+# Recycle a worker process once its resident memory exceeds this many KiB,
+# so several scrape workers (each holding a CLIP model) can share one box.
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = env.int('CELERY_WORKER_MAX_MEMORY_PER_CHILD', default=1536 * 1024)
+
+# Captcha solver configuration
+CAPTCHA_MODEL_NAME = env('CAPTCHA_MODEL_NAME', default='openai/clip-vit-base-patch32')
+CAPTCHA_PRELOAD = env.bool('CAPTCHA_PRELOAD', default=False)  # Load the model on worker_process_init
+CAPTCHA_TORCH_THREADS = env.int('CAPTCHA_TORCH_THREADS', default=1)  # 0 keeps torch's default
+
+# Browser pool configuration (one pool per scrape worker process)
+BROWSER_POOL_SIZE = env.int('BROWSER_POOL_SIZE', default=1)  # Persistent contexts per process
+BROWSER_POOL_MAX_PAGES = env.int('BROWSER_POOL_MAX_PAGES', default=50)  # Relaunch a context after this many pages
+BROWSER_POOL_MAX_MEMORY_MB = env.int('BROWSER_POOL_MAX_MEMORY_MB', default=1024)  # ... or once the browser uses this much RSS
+BROWSER_USER_DATA_DIR = env('BROWSER_USER_DATA_DIR', default='./user_data')
+
 # Rate limiting configuration (seconds between scrape tasks)
 SCRAPE_RATE_LIMIT = int(env('SCRAPE_RATE_LIMIT', default=60))
+SCRAPE_RATE_BURST = env.int('SCRAPE_RATE_BURST', default=1)  # Scrapes that may start back to back after an idle spell
+SCRAPE_MAX_CONCURRENCY = env.int('SCRAPE_MAX_CONCURRENCY', default=1)  # In-flight scrapes across all workers (0 = no cap)
+SCRAPE_RATE_LIMIT_URL = env('SCRAPE_RATE_LIMIT_URL', default=CELERY_BROKER_URL)  # Redis holding the shared limiter
+
+# A claimed task whose worker has not finished it after this many seconds is handed out again
+TASK_QUEUE_LEASE_SECONDS = env.int('TASK_QUEUE_LEASE_SECONDS', default=CELERY_TASK_TIME_LIMIT + 5 * 60)
+
+# Seconds a domain BuiltWith had no company for is answered as not found without scraping
+NEGATIVE_RESULT_TTL_SECONDS = env.int('NEGATIVE_RESULT_TTL_SECONDS', default=7 * 24 * 60 * 60)
+
+# Failed scrapes are retried with jittered exponential backoff, then dead-lettered
+TASK_MAX_ATTEMPTS = env.int('TASK_MAX_ATTEMPTS', default=5)
+TASK_RETRY_BASE_SECONDS = env.int('TASK_RETRY_BASE_SECONDS', default=60)
+TASK_RETRY_MAX_SECONDS = env.int('TASK_RETRY_MAX_SECONDS', default=6 * 60 * 60)
+
+# Share of dispatches per priority lane while several lanes have work waiting
+TASK_QUEUE_LANE_WEIGHTS = {
+    'interactive': env.int('TASK_QUEUE_WEIGHT_INTERACTIVE', default=8),
+    'refresh': env.int('TASK_QUEUE_WEIGHT_REFRESH', default=2),
+    'backfill': env.int('TASK_QUEUE_WEIGHT_BACKFILL', default=1),
+}
 
-# Task queue processing
+# Completion notifications for /api/companies/<slug>/events/ (Redis pub/sub; polls the DB without Redis)
+NOTIFY_REDIS_URL = env('NOTIFY_REDIS_URL', default=CELERY_BROKER_URL)
+COMPANY_EVENTS_TIMEOUT = env.int('COMPANY_EVENTS_TIMEOUT', default=60)  # Longest a client is held open
+COMPANY_EVENTS_POLL_INTERVAL = env.float('COMPANY_EVENTS_POLL_INTERVAL', default=2.0)
+
+# Serialized company documents: an LRU per web process in front of Redis
+COMPANY_CACHE_URL = env('COMPANY_CACHE_URL', default=CELERY_BROKER_URL)
+COMPANY_CACHE_LOCAL_SIZE = env.int('COMPANY_CACHE_LOCAL_SIZE', default=1024)  # Documents per process
+COMPANY_CACHE_TTL = env.int('COMPANY_CACHE_TTL', default=60 * 60)  # Redis expiry, a backstop for missed invalidations
+COMPANY_CACHE_LOCK_SECONDS = env.float('COMPANY_CACHE_LOCK_SECONDS', default=5.0)  # One builder per missing document
+COMPANY_CACHE_LOCK_WAIT = env.float('COMPANY_CACHE_LOCK_WAIT', default=2.0)  # Longest others wait for it
+
+# Browser/CDN lifetime of /api/embed/company/<slug>/badge.svg and badge.png
+BADGE_MAX_AGE = env.int('BADGE_MAX_AGE', default=60 * 60)
+
+# Request metrics, exported at /api/metrics
+METRICS_QUERY_BUDGET = env.int('METRICS_QUERY_BUDGET', default=20)  # Requests over this many queries are logged
+# Bearer token Prometheus must send to /api/metrics. The endpoint is off (404) until one is set, since
+# it exposes queue depth, per-view latency and scrape timings. Generate one with `openssl rand -hex 32`.
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+WORKER_METRICS_URL = env('WORKER_METRICS_URL', default=CELERY_BROKER_URL)  # Redis where workers publish browser pool metrics
+
+# Task queue processing. Dispatch is event driven (enqueue, task finish, rate limiter
+# wakeups); beat only recovers from lost wakeups and expired leases.
+TASK_QUEUE_SAFETY_NET_SECONDS = env.float('TASK_QUEUE_SAFETY_NET_SECONDS', default=300.0)
 CELERY_BEAT_SCHEDULE = {
     'process-task-queue': {
         'task': 'api.tasks.process_task_queue',
-        'schedule': 70.0,  # Check every 10 seconds
+        'schedule': TASK_QUEUE_SAFETY_NET_SECONDS,
     },
 }
 
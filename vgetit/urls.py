@@ -39,11 +39,15 @@ companies_router = routers.NestedSimpleRouter(router, r'companies', lookup='comp
 companies_router.register(r'comments', views.CommentViewSet, basename='company-comments')
 
 api_urlpatterns = [
+    path('companies/<slug:slug>/events/', views.company_events, name='company_events'),
+    path('metrics', views.metrics, name='metrics'),
     path('', include(router.urls)),
     path('', include(companies_router.urls)),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path("embed/company/<slug:company_slug>/", views.CompanyBadgeWidgetView.as_view(), name="company_badge"),
+    path("embed/company/<slug:company_slug>/badge.svg", views.company_badge, {'format': 'svg'}, name="company_badge_svg"),
+    path("embed/company/<slug:company_slug>/badge.png", views.company_badge, {'format': 'png'}, name="company_badge_png"),
 
     path('api/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),